@@ -2,7 +2,7 @@ import os
 
 from setuptools import setup
 
-reqs = ['numpy>=1.13.1',
+reqs = ['numpy>=1.17',
         'munkres>=1.0.8',
         'scikit_image>=0.12.3',
         'pyilastik>=0.0.7',
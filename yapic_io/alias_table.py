@@ -0,0 +1,94 @@
+import numpy as np
+
+
+class AliasTable(object):
+    '''
+    Walker alias table for drawing indices with given weights in O(1).
+
+    The table is built once in O(n). Each draw needs one random index and
+    one random number, independent of the nr of weights.
+
+    Parameters
+    ----------
+    weights : array_like
+        Non-negative weights, one for each index. At least one weight
+        must be above 0.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.alias_table import AliasTable
+    >>> table = AliasTable([0, 3, 1])
+    >>> table.probabilities()
+    array([0.  , 0.75, 0.25])
+    >>> table.draw(size=8, rng=np.random.default_rng(42))
+    array([1, 1, 1, 1, 1, 2, 1, 1])
+    '''
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        msg = 'weights must not be negative and must not all be 0'
+        assert n > 0 and (weights >= 0).all() and weights.sum() > 0, msg
+
+        prob = weights * n / weights.sum()
+        alias = np.arange(n)
+
+        small = list(np.flatnonzero(prob < 1))
+        large = list(np.flatnonzero(prob >= 1))
+        while small and large:
+            i_small = small.pop()
+            i_large = large.pop()
+            alias[i_small] = i_large
+            prob[i_large] -= 1 - prob[i_small]
+            if prob[i_large] < 1:
+                small.append(i_large)
+            else:
+                large.append(i_large)
+
+        # remaining entries are 1 except for rounding errors
+        prob[small + large] = 1
+        # zero weights must never be drawn
+        is_zero = weights == 0
+        prob[is_zero] = 0
+        alias[is_zero & (alias == np.arange(n))] = np.argmax(weights)
+
+        self.prob = prob
+        self.alias = alias
+
+    def __len__(self):
+        return len(self.prob)
+
+    def __repr__(self):
+        return 'AliasTable ({} entries)'.format(len(self))
+
+    def draw(self, size=None, rng=None):
+        '''
+        Draw random indices.
+
+        Parameters
+        ----------
+        size : int, optional
+            Nr of indices. If None, a single index is returned.
+        rng : numpy.random.Generator, optional
+            Random number generator. If None, a new generator is used.
+
+        Returns
+        -------
+        int or numpy.ndarray
+        '''
+        if rng is None:
+            rng = np.random.default_rng()
+        idx = rng.integers(len(self.prob), size=size)
+        keep = rng.random(size) < self.prob[idx]
+        out = np.where(keep, idx, self.alias[idx])
+        return int(out) if size is None else out
+
+    def probabilities(self):
+        '''
+        Probability of each index, reconstructed from the table.
+        '''
+        n = len(self.prob)
+        p = self.prob / n
+        return p + np.bincount(self.alias, weights=(1 - self.prob) / n,
+                               minlength=n)
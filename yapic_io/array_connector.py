@@ -0,0 +1,376 @@
+import logging
+import os
+import itertools
+import warnings
+from itertools import zip_longest
+from pathlib import Path
+import numpy as np
+import yapic_io.utils as ut
+from yapic_io.coordinate_connector import CoordinateConnector
+from yapic_io.coordinate_index import LabelCoordinateIndex
+from yapic_io.tiff_connector import TiffConnector
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+def _as_array(image):
+    if image is None:
+        return None
+    if isinstance(image, (str, Path)):
+        # npy files are memmapped, only accessed tiles are read from disk
+        return np.load(str(image), mmap_mode='r')
+
+    # read only view, tiles are returned without copying
+    image = np.asarray(image).view()
+    image.setflags(write=False)
+    return image
+
+
+class ArrayConnector(CoordinateConnector):
+    '''
+    Implementation of Connector for images and labels held in memory as
+    numpy arrays or stored as npy files (memmapped).
+
+    Tiles are returned as views of the source arrays (zero-copy) whenever
+    no type conversion is needed. No file I/O is involved for in-memory
+    arrays, which makes the connector useful for preprocessed data and for
+    benchmarking the data pipeline.
+
+    Parameters
+    ----------
+    images : list of array_like or str
+        Pixel images with dimensions (channel, z, x, y) or paths to
+        npy files with pixel images.
+    labels : list of array_like or str or None, optional
+        Label images with dimensions (label channel, z, x, y) or paths to
+        npy files, one for each pixel image (None for images without
+        labels). Zxy dimensions must match the corresponding pixel
+        image. Label values are integers, 0 means unlabeled.
+    savepath : str, optional
+        Directory to save probability maps as npy files. By default,
+        probability maps are kept in memory.
+
+    Notes
+    -----
+    Label values of different label channels are mapped to unique label
+    values in the same way as in TiffConnector (see `labelvalue_mapping`).
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.array_connector import ArrayConnector
+    >>> pixels = np.random.rand(3, 1, 40, 26)  # 3 channels, 1 z-slice
+    >>> labels = np.zeros((1, 1, 40, 26), dtype=np.uint8)
+    >>> labels[0, 0, :10, :10] = 91
+    >>> labels[0, 0, 20:, :5] = 109
+    >>> c = ArrayConnector([pixels, pixels], [labels, None])
+    >>> print(c)
+    ArrayConnector object
+    nr of images: 2
+    labelvalue_mapping: [{91: 1, 109: 2}]
+    >>> c.label_count_for_image(0)
+    {1: 100, 2: 100}
+    >>> c.get_tile(0, (1, 0, 5, 5), (2, 1, 2, 2)).shape
+    (2, 1, 2, 2)
+    >>> c.put_tile(np.ones((1, 2, 2)), (0, 5, 5), 0, 2)
+    >>> c.probability_map(0, 2).sum()
+    4.0
+    '''
+
+    def __init__(self, images, labels=None, savepath=None):
+
+        assert len(images) > 0, 'no pixel images given'
+        if labels is None:
+            labels = [None] * len(images)
+        assert len(images) == len(labels), \
+            'nr of pixel images and label images must be identical'
+
+        self.images = [_as_array(img) for img in images]
+        self.labels = [_as_array(lbl) for lbl in labels]
+        self.savepath = Path(savepath) if savepath is not None else None
+        self.probability_maps = {}
+        # label coordinate indices, built on first use
+        self._label_coordinate_indices = {}
+
+        for img, lbl in zip(self.images, self.labels):
+            assert img.ndim == 4, \
+                'pixel images must have 4 dimensions (c, z, x, y)'
+            if lbl is not None:
+                assert lbl.ndim == 4, \
+                    'label images must have 4 dimensions (c, z, x, y)'
+                assert img.shape[1:] == lbl.shape[1:], \
+                    'pixel and label images differ in zxy: {} {}'.format(
+                        img.shape, lbl.shape)
+
+        self._original_label_counts = [
+            [ut.count_label_values([lbl[c]]) for c in range(lbl.shape[0])]
+            if lbl is not None else None
+            for lbl in self.labels]
+
+        original_labels = self.original_label_values_for_all_images()
+        self.labelvalue_mapping = TiffConnector.calc_label_values_mapping(
+            original_labels)
+
+    def __repr__(self):
+        infostring = \
+            'ArrayConnector object\n' \
+            'nr of images: {}\n' \
+            'labelvalue_mapping: {}'.format(self.image_count(),
+                                            self.labelvalue_mapping)
+        return infostring
+
+    def _subset(self, mask):
+        conn = ArrayConnector(list(itertools.compress(self.images, mask)),
+                              list(itertools.compress(self.labels, mask)),
+                              savepath=self.savepath)
+        conn.labelvalue_mapping = self.labelvalue_mapping
+        return conn
+
+    def filter_labeled(self):
+        '''
+        Removes images without labels.
+
+        Returns
+        -------
+        ArrayConnector
+            Connector object containing only images with labels.
+        '''
+        return self._subset([lbl is not None for lbl in self.labels])
+
+    def split(self, fraction, random_seed=42):
+        '''
+        Split the images pseudo-randomly into two Connector subsets.
+
+        The first of size `(1-fraction)*N_images`, the other of size
+        `fraction*N_images`
+
+        Parameters
+        ----------
+        fraction : float
+        random_seed : int, numpy.random.SeedSequence or Generator, optional
+
+        Returns
+        -------
+        connector_1, connector_2
+        '''
+        N = self.image_count()
+
+        mask = ut.random_split_mask(N, fraction, random_seed=random_seed)
+
+        if mask.all() or not mask.any():
+            msg = 'ArrayConnector.split({}): One connector is empty!'
+            warnings.warn(msg.format(fraction))
+
+        return self._subset(mask), self._subset(~mask)
+
+    def image_count(self):
+        return len(self.images)
+
+    def image_dimensions(self, image_nr):
+        return np.array(self.images[image_nr].shape)
+
+    def label_matrix_dimensions(self, image_nr):
+        lbl = self.labels[image_nr]
+        return None if lbl is None else np.array(lbl.shape)
+
+    def original_label_values_for_all_images(self):
+        '''
+        Get all unique label values per image.
+
+        Returns
+        -------
+        list
+            List of sets. Each set corresponds to 1 label channel.
+            each set contains the label values of that channel.
+        '''
+        labels_per_channel = []
+        for counts in self._original_label_counts:
+            if counts is None:
+                continue
+
+            labels = [set(c.keys()) for c in counts]
+            labels_per_channel = [l1.union(l2)
+                                  for l1, l2 in zip_longest(labels_per_channel,
+                                                            labels,
+                                                            fillvalue=set())]
+        return labels_per_channel
+
+    def label_count_for_image(self, image_nr):
+        '''
+        Get number of labels per labelvalue for an image.
+
+        Parameters
+        ----------
+        image_nr : int
+            index of image
+
+        Returns
+        -------
+        dict
+        '''
+        counts = self._original_label_counts[image_nr]
+        if counts is None:
+            return None
+
+        return {self.labelvalue_mapping[c][value]: count
+                for c, counts_per_channel in enumerate(counts)
+                for value, count in counts_per_channel.items()}
+
+    def _mapped_label_value_to_original(self, label_value):
+        for c, mapping in enumerate(self.labelvalue_mapping):
+            for original, mapped in mapping.items():
+                if mapped == label_value:
+                    return c, original
+
+        msg = 'Label value {} not found in labelvalue mapping {}'
+        raise ValueError(msg.format(label_value, self.labelvalue_mapping))
+
+    def get_tile(self, image_nr, pos, size):
+        C, *pos_zxy = pos
+        CC = C + size[0]
+
+        return self.get_multichannel_tile(image_nr, range(C, CC),
+                                          pos_zxy, size[1:], dtype=None)
+
+    def get_multichannel_tile(self, image_nr, channels, pos_zxy, size_zxy,
+                              out=None, dtype=np.float32):
+        Z, X, Y = pos_zxy
+        ZZ, XX, YY = np.add(pos_zxy, size_zxy)
+        img = self.images[image_nr]
+
+        channels = list(channels)
+        C, CC = channels[0], channels[-1] + 1
+        if channels == list(range(C, CC)):
+            tile = img[C:CC, Z:ZZ, X:XX, Y:YY]  # view
+        else:
+            tile = img[channels, Z:ZZ, X:XX, Y:YY]
+
+        if out is not None:
+            out[:] = tile
+            return out
+        if dtype is None:
+            return tile
+        return tile.astype(dtype, copy=False)
+
+    def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
+        return self.label_tiles(image_nr, pos_zxy, size_zxy, [label_value])[0]
+
+    def label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+        out = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
+        lbl = self.labels[image_nr]
+        if lbl is None:
+            return out
+
+        Z, X, Y = pos_zxy
+        ZZ, XX, YY = np.add(pos_zxy, size_zxy)
+        for i, label_value in enumerate(label_values):
+            C, original_label_value = self._mapped_label_value_to_original(
+                label_value)
+            np.equal(lbl[C, Z:ZZ, X:XX, Y:YY], original_label_value,
+                     out=out[i])
+        return out
+
+    def label_index_to_coordinate(self, image_nr, label_value, label_index):
+        '''
+        Get czxy coordinate of the `label_index`-th pixel with (mapped)
+        label value `label_value` (see
+        CoordinateConnector.label_index_to_coordinate).
+        '''
+        C, original_label_value = self._mapped_label_value_to_original(
+            label_value)
+        index = self._label_coordinate_index(image_nr)
+        assert index is not None, \
+            'no label image given for image {}'.format(image_nr)
+        return index.coordinate(C, original_label_value, label_index)
+
+    def label_positions(self, image_nr, label_value):
+        index = self._label_coordinate_index(image_nr)
+        if index is None:
+            return np.zeros((0, 3), dtype=np.int64)
+
+        C, original_label_value = self._mapped_label_value_to_original(
+            label_value)
+        return index.positions_zxy(C, original_label_value)
+
+    def _label_coordinate_index(self, image_nr):
+        if image_nr not in self._label_coordinate_indices:
+            lbl = self.labels[image_nr]
+            self._label_coordinate_indices[image_nr] = \
+                LabelCoordinateIndex.from_planes(lbl) \
+                if lbl is not None else None
+        return self._label_coordinate_indices[image_nr]
+
+    def probability_map(self, image_nr, label_value=None):
+        '''
+        Get probability map written with put_tile.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int, optional
+            Id of the label. If None, the multichannel probability map
+            (one channel for each label) is returned.
+
+        Returns
+        -------
+        numpy.ndarray
+            Probability map with dimensions (channel, z, x, y).
+        '''
+        return self.probability_maps[(image_nr, label_value)]
+
+    def _probability_map(self, image_nr, label_value, multichannel):
+        key = (image_nr, None if multichannel else label_value)
+        if key in self.probability_maps:
+            return self.probability_maps[key]
+
+        C = multichannel if multichannel else 1
+        shape = (C,) + tuple(self.image_dimensions(image_nr)[1:])
+        if self.savepath is None:
+            probmap = np.zeros(shape, dtype=np.float32)
+        else:
+            if multichannel:
+                fname = 'image_{}.npy'.format(image_nr)
+            else:
+                fname = 'image_{}_class_{}.npy'.format(image_nr, label_value)
+            probmap = np.lib.format.open_memmap(str(self.savepath / fname),
+                                                mode='w+', dtype=np.float32,
+                                                shape=shape)
+
+        return self.probability_maps.setdefault(key, probmap)
+
+    def put_tile(self, pixels, pos_zxy, image_nr, label_value,
+                 multichannel=False):
+        np.testing.assert_equal(len(pos_zxy), 3)
+        np.testing.assert_equal(len(pixels.shape), 3)
+
+        self.put_tiles(np.asarray(pixels)[np.newaxis, np.newaxis],
+                       [(image_nr, pos_zxy)],
+                       [label_value],
+                       multichannel=multichannel)
+
+    def put_tiles(self, pixels, positions, label_values, multichannel=False):
+        np.testing.assert_equal(len(pixels.shape), 5)
+        np.testing.assert_equal(len(positions), pixels.shape[0])
+        np.testing.assert_equal(len(label_values), pixels.shape[1])
+
+        size_zxy = pixels.shape[2:]
+        for tile, (image_nr, pos_zxy) in zip(pixels, positions):
+            Z, X, Y = pos_zxy
+            ZZ, XX, YY = np.add(pos_zxy, size_zxy)
+
+            if multichannel:
+                # all labels of a tile with one assignment
+                probmap = self._probability_map(image_nr, None, multichannel)
+                C = np.asarray(label_values) - 1
+                probmap[C, Z:ZZ, X:XX, Y:YY] = tile
+                continue
+
+            for label_tile, label_value in zip(tile, label_values):
+                probmap = self._probability_map(image_nr, label_value, False)
+                probmap[0, Z:ZZ, X:XX, Y:YY] = label_tile
+
+    def flush(self):
+        for probmap in self.probability_maps.values():
+            if isinstance(probmap, np.memmap):
+                probmap.flush()
@@ -1,7 +1,6 @@
 from yapic_io.tiff_connector import TiffConnector
 from yapic_io.ilastik_connector import IlastikConnector
 from skimage import io
-from functools import lru_cache
 import numpy as np
 from glob import glob
 import os
@@ -9,7 +8,9 @@ import os
 
 class CellvoyConnector(IlastikConnector):
 
-    def __init__(self, img_filepath, label_filepath, savepath=None):
+    def __init__(self, img_filepath, label_filepath, savepath=None,
+                 workers=1, lazy=False, max_open_files=None,
+                 max_mapped_bytes=None, max_buffered_bytes=None):
 
         ref_names = glob(os.path.join(img_filepath, '*C01.tif'))
         self.names_all_channels = []
@@ -19,7 +20,12 @@ class CellvoyConnector(IlastikConnector):
 
         super().__init__(ref_names,
                          label_filepath,
-                         savepath=savepath)
+                         savepath=savepath,
+                         workers=workers,
+                         lazy=lazy,
+                         max_open_files=max_open_files,
+                         max_mapped_bytes=max_mapped_bytes,
+                         max_buffered_bytes=max_buffered_bytes)
 
         # order names_all_channels according to self.filenames
         pxnames_tiff_connector = [str(e.img) for e in self.filenames]
@@ -28,13 +34,16 @@ class CellvoyConnector(IlastikConnector):
         idx = [pxnames_cellvoy.index(e) for e in pxnames_tiff_connector]
         self.names_all_channels = [self.names_all_channels[i] for i in idx]
 
-    @lru_cache(maxsize=10)
     def _open_image_file(self, image_nr):
 
-        img_names = self.names_all_channels[image_nr]
-        pixels = np.array([[io.imread(img_name)] for img_name in img_names])
-        pixels = np.expand_dims(pixels, axis=0)
-        return pixels
+        def open_file():
+            img_names = self.names_all_channels[image_nr]
+            pixels = np.array([[io.imread(img_name)]
+                               for img_name in img_names])
+            pixels = np.expand_dims(pixels, axis=0)
+            return pixels
+
+        return self.handle_pool.get(('image', image_nr), open_file)
 
     def image_dimensions(self, image_nr):
         dims = np.array(self. _open_image_file(image_nr)[0].shape)
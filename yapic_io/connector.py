@@ -1,6 +1,7 @@
 from abc import ABCMeta, abstractmethod
 import logging
 import os
+import numpy as np
 logger = logging.getLogger(os.path.basename(__file__))
 
 
@@ -125,6 +126,48 @@ class Connector(metaclass=ABCMeta):
         '''
         pass
 
+    def get_multichannel_tile(self, image_nr, channels, pos_zxy, size_zxy,
+                              out=None, dtype=np.float32):
+        '''
+        Get 4D subsection of an image for a selection of channels with
+        one call.
+
+        Connectors should override this method to read all channels
+        directly into one output array. The default implementation calls
+        get_tile for each channel.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        channels : array_like
+            List of channels to be fetched (in this order).
+        pos_zxy : (zslice, x, y)
+            Upper left position of subsection.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Size of subsection.
+        out : numpy.ndarray, optional
+            Preallocated output array of shape
+            (len(channels), nr_zslices, nr_x, nr_y).
+        dtype : numpy.dtype, optional
+            Data type of the returned tile (if out is not given). If None,
+            the data type of the image is kept.
+
+        Returns
+        -------
+        numpy.ndarray
+            4D subsection of image with dimensions (channel, z, x, y)
+        '''
+        tiles = [self.get_tile(image_nr=image_nr,
+                               pos=np.hstack([[c], pos_zxy]),
+                               size=np.hstack([[1], size_zxy]))
+                 for c in channels]
+
+        if out is None:
+            tile = np.concatenate(tiles)
+            return tile if dtype is None else tile.astype(dtype, copy=False)
+        return np.concatenate(tiles, out=out)
+
     @abstractmethod
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
         '''
@@ -153,6 +196,58 @@ class Connector(metaclass=ABCMeta):
 
         pass
 
+    def label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+        '''
+        Get 4d boolean label masks for several labels at once.
+
+        The default implementation calls label_tile for each label.
+        Implementations should read the label region only once.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        pos_zxy : (z, x, y)
+            Upper left position of subsection.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Size of subsection.
+        label_values : list of int
+            Ids of the labels.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean masks with dimensions (label, z, x, y).
+        '''
+        out = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
+        for i, label_value in enumerate(label_values):
+            out[i] = self.label_tile(image_nr, pos_zxy, size_zxy, label_value)
+        return out
+
+    def label_positions(self, image_nr, label_value):
+        '''
+        Get zxy positions of all pixels with a certain label.
+
+        The default implementation reads the whole label matrix with
+        label_tile. Implementations should use an index of label
+        coordinates.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label.
+
+        Returns
+        -------
+        numpy.ndarray
+            Positions with shape (nr_of_pixels, 3).
+        '''
+        shape_zxy = self.image_dimensions(image_nr)[1:]
+        mask = self.label_tile(image_nr, (0, 0, 0), shape_zxy, label_value)
+        return np.argwhere(mask)
+
     @abstractmethod
     def put_tile(self, pixels, pos_zxy, image_nr, label_value):
         '''
@@ -178,6 +273,31 @@ class Connector(metaclass=ABCMeta):
             True in case of successful write.
         '''
 
+    def put_tiles(self, pixels, positions, label_values, multichannel=False):
+        '''
+        Puts probabilities of several tiles and labels to the data storage.
+
+        The default implementation calls put_tile for each tile and label.
+
+        Parameters
+        ----------
+        pixels : numpy.ndarray
+            5D matrix of probability values with shape
+            (nr_tiles, nr_labels, z, x, y).
+        positions : list of (image_nr, (z, x, y))
+            Image index and upper left position of each tile.
+        label_values : list of int
+            Ids of the labels, one for each label layer of `pixels`.
+        multichannel : int or bool, optional
+            Nr of classes if probabilities are saved in one multichannel
+            image, one channel for each label.
+        '''
+        kwds = {'multichannel': multichannel} if multichannel else {}
+        for tile, (image_nr, pos_zxy) in zip(pixels, positions):
+            for label_tile, label_value in zip(tile, label_values):
+                self.put_tile(label_tile, pos_zxy, image_nr, label_value,
+                              **kwds)
+
     @abstractmethod
     def image_dimensions(self, image_nr):
         '''
@@ -195,3 +315,24 @@ class Connector(metaclass=ABCMeta):
             Image shape.
         '''
         pass
+
+    def flush(self):
+        '''
+        Write buffered data (e.g. probability map tiles passed to
+        put_tile) to the data storage.
+        '''
+        pass
+
+    def close(self):
+        '''
+        Write buffered data and release resources (e.g. open files) held
+        by the connector. The connector can still be used afterwards,
+        files are reopened on demand.
+        '''
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
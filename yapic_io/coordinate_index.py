@@ -0,0 +1,230 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class LabelCoordinateIndex(object):
+    '''
+    Coordinates of all labeled pixels of one label image.
+
+    Positions are stored as flat indices into the (z, x, y) label matrix
+    in one integer array, grouped by label channel and original label
+    value (ascending position order within each group). A small table
+    holds the range of each group within the array. Thus, the i-th pixel
+    of a certain label is found in O(1), without reading the label image.
+
+    The index can be persisted (see `save` and `load`). The position array
+    is stored in npy format and memmapped when loaded.
+
+    Parameters
+    ----------
+    shape_zxy : (nr_zslices, nr_x, nr_y)
+        Shape of the label matrix (one label channel).
+    table : dict
+        Keys are (channel, original label value), values are
+        (start, stop) ranges within `positions`.
+    positions : numpy.ndarray
+        Flat indices of labeled pixels.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.coordinate_index import LabelCoordinateIndex
+    >>> lbl = np.zeros((2, 3, 4), dtype=np.uint8)  # (z, x, y)
+    >>> lbl[0, 1, 2] = 5
+    >>> lbl[1, 2, 0] = 5
+    >>> lbl[1, 0, 3] = 7
+    >>> index = LabelCoordinateIndex.from_planes([lbl])
+    >>> index.count(0, 5)
+    2
+    >>> index.coordinate(0, 5, 1)  # czxy of the 2nd pixel with label 5
+    array([0, 1, 2, 0])
+    '''
+
+    def __init__(self, shape_zxy, table, positions):
+        self.shape_zxy = tuple(int(s) for s in shape_zxy)
+        self.table = table
+        self.positions = positions
+
+    def __repr__(self):
+        return 'LabelCoordinateIndex ({} labeled pixels, shape {})'.format(
+            len(self.positions), self.shape_zxy)
+
+    @classmethod
+    def from_planes(cls, channels):
+        '''
+        Build index from label planes.
+
+        Parameters
+        ----------
+        channels : list
+            For each label channel, a list of 2D label planes with
+            dimensions (x, y), one for each z slice. Planes are read
+            one by one, so memmapped planes are never loaded at once.
+
+        Returns
+        -------
+        LabelCoordinateIndex
+        '''
+        shape_zxy = None
+        table = {}
+        positions = []
+        offset = 0
+
+        empty = np.zeros(0, dtype=np.int64)
+        for c, planes in enumerate(channels):
+            plane_positions = [empty]
+            plane_values = [empty]
+            for z, plane in enumerate(planes):
+                if shape_zxy is None:
+                    shape_zxy = (len(planes),) + plane.shape
+                plane = np.asarray(plane)
+                nonzero = np.flatnonzero(plane)
+                plane_values.append(plane.ravel()[nonzero])
+                plane_positions.append(nonzero + z * plane.size)
+
+            values = np.concatenate(plane_values)
+            order = np.argsort(values, kind='stable')
+            values = values[order]
+            positions.append(np.concatenate(plane_positions)[order])
+
+            unique, starts = np.unique(values, return_index=True)
+            stops = np.append(starts[1:], len(values))
+            for value, start, stop in zip(unique, starts, stops):
+                table[(c, int(value))] = (offset + int(start),
+                                          offset + int(stop))
+            offset += len(values)
+
+        if shape_zxy is None:  # no label planes
+            shape_zxy = (0, 0, 0)
+        dtype = np.uint32 if np.prod(shape_zxy) < 2**32 else np.uint64
+        positions = np.concatenate([empty] + positions).astype(dtype)
+        return cls(shape_zxy, table, positions)
+
+    def count(self, channel, label_value):
+        '''
+        Nr of pixels with a certain original label value in a label
+        channel.
+        '''
+        start, stop = self.table.get((channel, label_value), (0, 0))
+        return stop - start
+
+    def coordinates(self, channel, label_value, label_indices):
+        '''
+        Get coordinates of labeled pixels.
+
+        Parameters
+        ----------
+        channel : int
+            Label channel.
+        label_value : int
+            Original label value.
+        label_indices : array_like
+            Values between 0 and ``count(channel, label_value)``.
+
+        Returns
+        -------
+        numpy.ndarray
+            czxy coordinates with shape (len(label_indices), 4).
+        '''
+        label_indices = np.asarray(label_indices)
+        count = self.count(channel, label_value)
+        assert ((label_indices >= 0) & (label_indices < count)).all(), \
+            'label index out of range (count: {})'.format(count)
+
+        start, _ = self.table[(channel, label_value)]
+        flat = self.positions[start + label_indices]
+        zxy = np.unravel_index(flat, self.shape_zxy)
+        return np.stack([np.full(len(flat), channel)] + list(zxy), axis=1)
+
+    def coordinate(self, channel, label_value, label_index):
+        '''
+        Get czxy coordinate of one labeled pixel (see `coordinates`).
+        '''
+        return self.coordinates(channel, label_value, [label_index])[0]
+
+    def positions_zxy(self, channel, label_value):
+        '''
+        Get zxy positions of all pixels with a certain original label value
+        in a label channel, with shape (count, 3).
+        '''
+        start, stop = self.table.get((channel, label_value), (0, 0))
+        zxy = np.unravel_index(self.positions[start:stop], self.shape_zxy)
+        return np.stack(zxy, axis=1)
+
+    @staticmethod
+    def _filename_stem(fname, name=''):
+        fname = Path(fname).expanduser().resolve()
+        stat = fname.stat()
+        key = '{}|{}|{}|{}'.format(fname, name, stat.st_size,
+                                   stat.st_mtime_ns)
+        return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+    @classmethod
+    def load(cls, directory, fname, name=''):
+        '''
+        Load a persisted index of a label file.
+
+        Parameters
+        ----------
+        directory : str or pathlib.Path
+            Directory of persisted indices.
+        fname : str or pathlib.Path
+            Path to the label file. Indices of changed label files are not
+            loaded.
+        name : str, optional
+            Name of the label image within the label file (if the file
+            contains several label images).
+
+        Returns
+        -------
+        LabelCoordinateIndex or None
+            None if no up to date index exists.
+        '''
+        stem = Path(directory) / cls._filename_stem(fname, name)
+        table_path = stem.with_suffix('.json')
+        if not table_path.exists():
+            return None
+
+        try:
+            with open(str(table_path)) as f:
+                data = json.load(f)
+            positions = np.load(str(stem.with_suffix('.npy')), mmap_mode='r')
+        except (OSError, ValueError) as e:
+            msg = 'Could not read label coordinate index {}: {}'
+            logger.warning(msg.format(stem, e))
+            return None
+
+        table = {(c, value): (start, stop)
+                 for c, value, start, stop in data['table']}
+        return cls(data['shape'], table, positions)
+
+    def save(self, directory, fname, name=''):
+        '''
+        Persist the index of a label file (see `load`).
+        '''
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = directory / self._filename_stem(fname, name)
+
+        # the table is written last, an index is only valid with its table
+        tmp_path = stem.with_suffix('.tmp.npy')
+        np.save(str(tmp_path), self.positions)
+        os.replace(str(tmp_path), str(stem.with_suffix('.npy')))
+
+        data = {'shape': self.shape_zxy,
+                'table': [[c, value, start, stop]
+                          for (c, value), (start, stop)
+                          in sorted(self.table.items())]}
+        tmp_path = stem.with_suffix('.tmp.json')
+        with open(str(tmp_path), 'w') as f:
+            json.dump(data, f)
+        os.replace(str(tmp_path), str(stem.with_suffix('.json')))
+
+        logger.debug('Saved label coordinate index for %s to %s', fname,
+                     stem)
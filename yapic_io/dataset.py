@@ -1,20 +1,34 @@
 import numpy as np
-from numpy.random import choice, randint
-import random
 import collections
 import yapic_io.utils as ut
 from functools import lru_cache
 import logging
 import os
 import yapic_io.transformations as trafo
+from yapic_io.coordinate_connector import CoordinateConnector
+from yapic_io.label_integral import LabelIntegral
+from yapic_io.alias_table import AliasTable
 import sys
+import threading
 
 logger = logging.getLogger(os.path.basename(__file__))
 logger.setLevel(logging.INFO)
-randint_array = np.vectorize(randint)
 TrainingTile = collections.namedtuple('TrainingTile',
                                       ['pixels', 'channels', 'weights',
                                        'labels', 'augmentation'])
+# read and padding plan of tiles, see tile_plans()
+TilePlan = collections.namedtuple('TilePlan',
+                                  ['pos_transient', 'size_transient',
+                                   'pos_inside', 'padding'])
+# request for one random training tile, see Dataset.random_tile_requests()
+TILE_REQUEST_DTYPE = np.dtype([('image_nr', np.int64),
+                               ('pos_zxy', np.int64, (3,)),
+                               ('label_value', np.int64),
+                               ('fliplr', bool),
+                               ('flipud', bool),
+                               ('rot90', np.int8),
+                               ('rotation_angle', np.float32),
+                               ('shear_angle', np.float32)])
 
 
 class Dataset(object):
@@ -32,6 +46,18 @@ class Dataset(object):
     pixel_connector : yapic_io.connector.Connector
         Connector object (e.g. TiffConnector or IlastikConnector) for binding
         of pixel and label data, as well as prediction result data.
+    workers : int, optional
+        Nr of threads for reading label counts and image dimensions of all
+        images at construction. Default is 1 (no parallelization).
+    lazy : bool, optional
+        If True, label counts are loaded the first time they are needed
+        and the channel consistency check is skipped. Use it together
+        with a lazy connector to start prediction on large image
+        collections without reading all images first.
+    random_seed : int or numpy.random.SeedSequence, optional
+        Seed of the random number generator for tile sampling. The global
+        numpy random state is not used. Independent generators for
+        parallel workers are derived with spawn_rngs().
 
     Notes
     -----
@@ -39,18 +65,59 @@ class Dataset(object):
     Pixel data is cached in memory for repeated requests.
     '''
 
-    def __init__(self, pixel_connector):
+    def __init__(self, pixel_connector, workers=1, lazy=False,
+                 random_seed=None):
 
         self.pixel_connector = pixel_connector
+        self.workers = workers
+        if isinstance(random_seed, np.random.SeedSequence):
+            self.seed_sequence = random_seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(random_seed)
+        # random number generator for tile sampling
+        self.rng = np.random.default_rng(self.seed_sequence)
         self.n_images = pixel_connector.image_count()
-        self.label_counts = self.load_label_counts()
-
-        # self.label_weights dict is complementary to self.label_counts
-        self.label_weights = {label: 1 for label in self.label_counts.keys()}
+        self._label_counts = None
+        self._label_weights = None
+        # alias tables for label and image selection, see _samplers()
+        self._label_samplers = None
 
         # max nr of trials to get a random training tile in polling mode
         self.max_pollings = 30
 
+        # if True, random training tiles are positioned around randomly
+        # drawn label coordinates (see label_coordinate()), no tiles are
+        # rejected. Requires a connector implementing
+        # label_index_to_coordinate (e.g. TiffConnector).
+        self.coordinate_sampling = isinstance(pixel_connector,
+                                              CoordinateConnector)
+
+        # if True, random tile positions are drawn around labeled regions
+        # and positions without labels are skipped before any pixel data
+        # is read (see label_integral())
+        self.use_label_integrals = True
+        # label integrals are computed on first use and kept in a least
+        # recently used cache of at most max_label_integrals entries
+        self.max_label_integrals = 64
+        self._label_integrals = collections.OrderedDict()
+        self._label_integral_lock = threading.RLock()
+
+        # optional transformations.WarpIndexCache for rotation and shear
+        # augmentation with quantized angles (see
+        # TrainingBatch.augment_by_rotation)
+        self.warp_cache = None
+
+        # data type of pixel and weight tiles
+        self.float_data_type = np.float32
+        # if True, pixel tiles keep the data type of the images (e.g. uint8)
+        # and are converted to float_data_type at normalization
+        self.raw_pixels = False
+
+        if lazy:
+            return
+
+        self.label_counts = self.load_label_counts()
+
         is_consistent, channel_cnt = self.channels_are_consistent()
         msg = ('Varying number of channels: {}. '
                'Channel counts must be identical '
@@ -61,6 +128,112 @@ class Dataset(object):
     def __repr__(self):
         return 'Dataset ({} images)'.format(self.n_images)
 
+    @property
+    def label_counts(self):
+        '''
+        Count of each labelvalue for each image, see load_label_counts().
+        '''
+        if self._label_counts is None:
+            self._label_counts = self.load_label_counts()
+        return self._label_counts
+
+    @label_counts.setter
+    def label_counts(self, label_counts):
+        self._label_counts = label_counts
+        self._label_samplers = None
+
+    @property
+    def label_weights(self):
+        '''
+        Weight of each labelvalue. The label_weights dict is complementary
+        to label_counts, all weights are 1 by default.
+        '''
+        if self._label_weights is None:
+            self._label_weights = {label: 1
+                                   for label in self.label_counts.keys()}
+        return self._label_weights
+
+    @label_weights.setter
+    def label_weights(self, label_weights):
+        self._label_weights = label_weights
+        self._label_samplers = None
+
+    def spawn_rngs(self, n):
+        '''
+        Independent random number generators, e.g. one for each parallel
+        loader worker. Generators are derived from random_seed, i.e.
+        they are reproducible, and each call returns new streams.
+
+        Parameters
+        ----------
+        n : int
+            Nr of generators.
+
+        Returns
+        -------
+        list
+            n numpy.random.Generator objects.
+        '''
+        return [np.random.default_rng(seq)
+                for seq in self.seed_sequence.spawn(n)]
+
+    def label_count_matrix(self):
+        '''
+        Label counts as dense matrix.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of shape (nr_of_labels, nr_of_images). Rows are in the
+            order of label_values().
+        '''
+        return self._samplers()['matrix']
+
+    def _samplers(self):
+        '''
+        Alias tables for label and image selection in O(1), built from
+        label_counts the first time they are needed.
+
+        Tables are rebuilt when label_counts or label_weights are set. If
+        label_counts is changed in place, call _reset_samplers().
+        '''
+        if self._label_samplers is not None:
+            return self._label_samplers
+
+        label_values = self.label_values()
+        matrix = np.zeros((len(label_values), self.n_images), dtype=np.int64)
+        for i, label_value in enumerate(label_values):
+            matrix[i] = self.label_counts[label_value]
+
+        label_totals = matrix.sum(axis=1)
+        samplers = {
+            'matrix': matrix,
+            'labels': (AliasTable(label_totals)
+                       if label_totals.sum() > 0 else None),
+            'images': {label_value: AliasTable(counts)
+                       for label_value, counts in zip(label_values, matrix)
+                       if counts.sum() > 0},
+        }
+        if label_totals.sum() > 0:
+            samplers['images'][None] = AliasTable(matrix.sum(axis=0))
+
+        self._label_samplers = samplers
+        return samplers
+
+    def _reset_samplers(self):
+        self._label_samplers = None
+
+    def _random_image_nr(self, label_value):
+        '''
+        Get a random image index. Images with more frequent labels of
+        type label_value (of all labels if label_value is None) are more
+        likely to be selected.
+        '''
+        images = self._samplers()['images']
+        msg = 'no label data for label {} in dataset'.format(label_value)
+        assert label_value in images, msg
+        return images[label_value].draw(rng=self.rng)
+
     @lru_cache(maxsize=1000)
     def image_dimensions(self, image_nr):
         '''
@@ -158,8 +331,10 @@ class Dataset(object):
         list
             List with channel counts
         '''
-        channel_cnt = np.unique([self.image_dimensions(i)[0]
-                                for i in range(self.n_images)])
+        dims = ut.parallel_map(self.image_dimensions,
+                               range(self.n_images),
+                               workers=self.workers)
+        channel_cnt = np.unique([dim[0] for dim in dims])
 
         if len(channel_cnt) == 1:
             return True, channel_cnt
@@ -222,7 +397,7 @@ class Dataset(object):
         if labels == 'all':
             labels = self.label_values()
 
-        if hasattr(self.pixel_connector, 'label_index_to_coordinate'):
+        if self.coordinate_sampling:
             # fetch by label index
             return self._random_training_tile_by_coordinate(
                 size_zxy,
@@ -242,40 +417,418 @@ class Dataset(object):
                 augment_params=augment_params,
                 ensure_labelvalue=ensure_labelvalue)
 
-    def _random_pos_izxy(self, label_value, tile_size_zxy):
+    def _random_pos_izxy(self, label_value, tile_size_zxy,
+                         in_label_region=False):
         '''
         Get a random image and a random zxy position (for a tile of shape
         size_zxy) within this image.
         Images with more frequent labels of type label_value are more likely to
         be selected.
+        If in_label_region is True, only tiles intersecting the bounding box
+        of label_value (of all labels if label_value is None) are drawn
+        (see label_bounding_box()).
         '''
         # get random image by label probability
-        # label probability per image
-        label_prob = self._get_label_probs(label_value)
-        img_nr = choice(len(label_prob), p=label_prob)
+        img_nr = self._random_image_nr(label_value)
 
         # get random zxy position within selected image
-        img_shape_zxy = self.image_dimensions(img_nr)[1:]
+        img_minpos_zxy, img_maxpos_zxy = self._position_range(
+            img_nr, label_value, tile_size_zxy, in_label_region)
+
+        pos_zxy = self.rng.integers(img_minpos_zxy, img_maxpos_zxy + 1)
+        return img_nr, pos_zxy
+
+    def _position_range(self, image_nr, label_value, tile_size_zxy,
+                        in_label_region=False):
+        '''
+        Get lowest and highest zxy position of a tile of shape
+        tile_size_zxy within an image, see _random_pos_izxy().
+        '''
+        img_shape_zxy = self.image_dimensions(image_nr)[1:]
         img_maxpos_zxy = np.array(img_shape_zxy) - tile_size_zxy
 
         msg = 'Tile of size {} does not fit in image of size {}'.format(
                     tile_size_zxy, img_shape_zxy)
         assert (img_maxpos_zxy > -1).all(), msg
 
-        pos_zxy = randint_array(img_maxpos_zxy + 1)
-        return img_nr, pos_zxy
-
-    def _get_label_probs(self, label_value):
+        img_minpos_zxy = np.zeros(3, dtype=np.int64)
+        if in_label_region:
+            label_values = self.label_values() if label_value is None \
+                else [label_value]
+            bbox = self.label_bounding_box(image_nr, label_values)
+            if bbox is not None:
+                start_zxy, stop_zxy = bbox
+                img_minpos_zxy = np.clip(start_zxy - tile_size_zxy + 1,
+                                         0, img_maxpos_zxy)
+                img_maxpos_zxy = np.clip(stop_zxy - 1,
+                                         img_minpos_zxy, img_maxpos_zxy)
+
+        return img_minpos_zxy, img_maxpos_zxy
+
+    def random_tile_requests(self,
+                             n,
+                             size_zxy,
+                             ensure_labelvalues=None,
+                             equalized=False,
+                             augmentation=None,
+                             rotation_range=(-45, 45),
+                             shear_range=(-5, 5),
+                             rng=None):
         '''
-        Get probabilities for labels per image if label_value is None,
-        probabilities for the sum of all label values is returned.
+        Draws images, positions and augmentation parameters of n random
+        training tiles at once, without reading any data.
+
+        Each tile request has a label value. Images are drawn by the
+        frequency of this label, positions are drawn around its labeled
+        regions. If use_label_integrals is True, positions of tiles without
+        the label are redrawn (up to max_pollings times) before returning.
+
+        Parameters
+        ----------
+        n : int
+            Nr of tiles.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Tile size.
+        ensure_labelvalues : array_like, optional
+            Label value for each tile. If None, label values are drawn
+            by label frequency.
+        equalized : bool
+            If true and ensure_labelvalues is None, less frequent
+            label_values are picked with same probability as frequent
+            label_values.
+        augmentation : set, optional
+            Augmentations to draw parameters for: 'flip', 'rotate' and
+            'shear'.
+        rotation_range : (min, max)
+            Rotation angle range in degrees.
+        shear_range : (min, max)
+            Shear angle range in degrees.
+        rng : numpy.random.Generator, optional
+            Random number generator. If None, the generator of the dataset
+            is used.
+
+        Returns
+        -------
+        numpy.ndarray
+            Structured array of dtype TILE_REQUEST_DTYPE with n tile
+            requests. Sort it by image_nr and pos_zxy to read tiles in
+            file order.
+
+        Examples
+        --------
+        >>> import numpy as np
+        >>> from yapic_io.dataset import Dataset
+        >>> from yapic_io.tiff_connector import TiffConnector
+        >>> pixel_image_dir = 'yapic_io/test_data/tiffconnector_1/im/*.tif'
+        >>> label_image_dir = 'yapic_io/test_data/tiffconnector_1/labels/*.tif'
+        >>>
+        >>> d = Dataset(TiffConnector(pixel_image_dir, label_image_dir))
+        >>> rng = np.random.default_rng(42)
+        >>> requests = d.random_tile_requests(4, (1, 2, 2),
+        ...                                   ensure_labelvalues=[1, 2, 3, 2],
+        ...                                   augmentation={'flip'}, rng=rng)
+        >>> requests['image_nr']
+        array([0, 2, 2, 2])
+        >>> requests['pos_zxy'].shape
+        (4, 3)
         '''
-        if label_value is None:
-            # label count for all labelvalues
-            lbl_count = sum(self.label_counts.values())
+        if rng is None:
+            rng = self.rng
+        size_zxy = np.array(size_zxy)
+        augmentation = augmentation or set()
+        requests = np.zeros(n, dtype=TILE_REQUEST_DTYPE)
+
+        if ensure_labelvalues is not None:
+            msg = 'ensure_labelvalues must have {} entries'.format(n)
+            assert len(ensure_labelvalues) == n, msg
+            requests['label_value'] = ensure_labelvalues
+        elif equalized:
+            requests['label_value'] = rng.choice(self.label_values(), size=n)
         else:
-            lbl_count = self.label_counts[label_value]
-        return lbl_count / lbl_count.sum()
+            labels = self._samplers()['labels']
+            assert labels is not None, 'no label data in dataset'
+            requests['label_value'] = np.array(self.label_values())[
+                labels.draw(size=n, rng=rng)]
+
+        todo = np.arange(n)
+        for _ in range(self.max_pollings):
+            label_values = requests['label_value'][todo]
+            image_nrs, positions = self._random_positions(label_values,
+                                                          size_zxy, rng)
+            requests['image_nr'][todo] = image_nrs
+            requests['pos_zxy'][todo] = positions
+
+            if not self.use_label_integrals:
+                break
+
+            # redraw tiles without labels
+            counts = self._label_counts_in_tiles(image_nrs, positions,
+                                                 size_zxy, label_values)
+            todo = todo[counts == 0]
+            if len(todo) == 0:
+                break
+
+        if 'flip' in augmentation:
+            requests['fliplr'] = rng.random(n) < 0.5
+            requests['flipud'] = rng.random(n) < 0.5
+            if size_zxy[1] == size_zxy[2]:  # square tiles
+                requests['rot90'] = rng.integers(4, size=n)
+
+        if 'rotate' in augmentation:
+            requests['rotation_angle'] = rng.uniform(*rotation_range, size=n)
+
+        if 'shear' in augmentation:
+            requests['shear_angle'] = rng.uniform(*shear_range, size=n)
+
+        return requests
+
+    def _random_positions(self, label_values, size_zxy, rng):
+        '''
+        Draw an image and a zxy position for each label value,
+        see _random_pos_izxy().
+        '''
+        n = len(label_values)
+        image_nrs = np.zeros(n, dtype=np.int64)
+        images = self._samplers()['images']
+        for label_value in np.unique(label_values):
+            msg = 'no label data for label {} in dataset'.format(label_value)
+            assert label_value in images, msg
+            is_label = label_values == label_value
+            image_nrs[is_label] = images[label_value].draw(
+                size=is_label.sum(), rng=rng)
+
+        minpos = np.zeros((n, 3), dtype=np.int64)
+        maxpos = np.zeros((n, 3), dtype=np.int64)
+        pairs = np.unique(np.stack([image_nrs, label_values], axis=1), axis=0)
+        for image_nr, label_value in pairs:
+            is_pair = (image_nrs == image_nr) & (label_values == label_value)
+            minpos[is_pair], maxpos[is_pair] = self._position_range(
+                image_nr, label_value, size_zxy,
+                in_label_region=self.use_label_integrals)
+
+        positions = minpos + (rng.random((n, 3)) *
+                              (maxpos - minpos + 1)).astype(np.int64)
+        return image_nrs, np.minimum(positions, maxpos)
+
+    def _label_counts_in_tiles(self, image_nrs, positions, size_zxy,
+                               label_values):
+        '''
+        Label counts of tiles looked up in label integrals, one label value
+        per tile.
+        '''
+        counts = np.zeros(len(image_nrs), dtype=np.int64)
+        pairs = np.unique(np.stack([image_nrs, label_values], axis=1), axis=0)
+        for image_nr, label_value in pairs:
+            is_pair = (image_nrs == image_nr) & (label_values == label_value)
+            integral = self.label_integral(image_nr, label_value)
+            if integral is not None:
+                counts[is_pair] = integral.counts(positions[is_pair],
+                                                  size_zxy)
+        return counts
+
+    def random_training_tiles(self,
+                              n,
+                              size_zxy,
+                              channels,
+                              labels='all',
+                              pixel_padding=(0, 0, 0),
+                              ensure_labelvalues=None,
+                              equalized=False,
+                              augmentation=None,
+                              rotation_range=(-45, 45),
+                              shear_range=(-5, 5),
+                              rng=None):
+        '''
+        Returns n randomly chosen training tiles including weights.
+
+        Tile requests are drawn at once with random_tile_requests() and
+        tiles are read sorted by image and position.
+
+        Parameters
+        ----------
+        n : int
+            Nr of tiles.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Tile size.
+        channels : array_like
+            List of pixel channels to be fetched.
+        labels : array_like or str
+            List of labelvalues to be fetched.
+        pixel_padding : (pad_z, pad_x, pad_y)
+            Amount of padding to increase tile size in zxy.
+        ensure_labelvalues, equalized, augmentation, rotation_range,
+        shear_range, rng
+            See random_tile_requests().
+
+        Returns
+        -------
+        list
+            n TrainingTile(pixels, channels, labels, weights, augmentation)
+            in the order of the tile requests.
+        '''
+        if labels == 'all':
+            labels = self.label_values()
+        augmentation = augmentation or set()
+
+        requests = self.random_tile_requests(
+            n, size_zxy,
+            ensure_labelvalues=ensure_labelvalues,
+            equalized=equalized,
+            augmentation=augmentation,
+            rotation_range=rotation_range,
+            shear_range=shear_range,
+            rng=rng)
+
+        pos_zxy = requests['pos_zxy']
+        order = np.lexsort((pos_zxy[:, 2], pos_zxy[:, 1], pos_zxy[:, 0],
+                            requests['image_nr']))
+        tiles = [None] * n
+        for i in order:
+            request = requests[i]
+            tiles[i] = self.training_tile(
+                int(request['image_nr']),
+                request['pos_zxy'],
+                size_zxy,
+                channels,
+                labels,
+                pixel_padding=pixel_padding,
+                augment_params=_request_augment_params(request, augmentation))
+        return tiles
+
+    def label_coordinate(self, label_value, label_index):
+        '''
+        Get image and czxy coordinate of a labeled pixel.
+
+        Labeled pixels of all images are enumerated image by image, i.e.
+        the label index refers to the whole dataset.
+
+        Parameters
+        ----------
+        label_value : int
+            Id of the label.
+        label_index : int
+            Value between 0 and the total count of `label_value` in the
+            dataset (see label_counts).
+
+        Returns
+        -------
+        (image_nr, c, z, x, y)
+            Image index and czxy coordinate of the pixel.
+
+        Examples
+        --------
+        >>> from yapic_io.dataset import Dataset
+        >>> from yapic_io.tiff_connector import TiffConnector
+        >>> pixel_image_dir = 'yapic_io/test_data/tiffconnector_1/im/*.tif'
+        >>> label_image_dir = 'yapic_io/test_data/tiffconnector_1/labels/*.tif'
+        >>>
+        >>> d = Dataset(TiffConnector(pixel_image_dir, label_image_dir))
+        >>> d.label_counts[2]
+        array([ 3,  0, 11])
+        >>> d.label_coordinate(2, 3)  # 1st pixel with label 2 in image 2
+        (2, 0, 0, 2, 1)
+        '''
+        counts = np.cumsum(self.label_counts[label_value])
+        assert 0 <= label_index < counts[-1], \
+            'label index {} out of range (count: {})'.format(label_index,
+                                                             counts[-1])
+
+        img_nr = int(np.searchsorted(counts, label_index, side='right'))
+        if img_nr > 0:
+            label_index -= counts[img_nr - 1]
+
+        coordinate = self.pixel_connector.label_index_to_coordinate(
+            img_nr, label_value, label_index)
+        return (img_nr,) + tuple(int(x) for x in coordinate)
+
+    def label_integral(self, image_nr, label_value):
+        '''
+        Summed-area table of a label in an image. Tables are computed from
+        the label positions of the connector on first use and recomputed if
+        they were dropped from the cache.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label.
+
+        Returns
+        -------
+        LabelIntegral or None
+            None if the image contains no pixels of the label.
+        '''
+        image_nr = int(image_nr)
+        label_value = int(label_value)
+        counts = self.label_counts.get(label_value)
+        if counts is None or counts[image_nr] == 0:
+            return None
+
+        key = (image_nr, label_value)
+        with self._label_integral_lock:
+            integral = self._label_integrals.get(key)
+            if integral is not None:
+                self._label_integrals.move_to_end(key)
+                return integral
+
+        integral = self._compute_label_integral(image_nr, label_value)
+        self._cache_label_integral(key, integral)
+        return integral
+
+    def _compute_label_integral(self, image_nr, label_value):
+        shape_zxy = self.image_dimensions(image_nr)[1:]
+        positions_zxy = self.pixel_connector.label_positions(image_nr,
+                                                             label_value)
+        return LabelIntegral.from_positions(positions_zxy, shape_zxy)
+
+    def _cache_label_integral(self, key, integral):
+        with self._label_integral_lock:
+            self._label_integrals[key] = integral
+            self._label_integrals.move_to_end(key)
+            while len(self._label_integrals) > self.max_label_integrals:
+                self._label_integrals.popitem(last=False)
+
+    def label_count_in_tile(self, image_nr, pos_zxy, size_zxy, label_values):
+        '''
+        Nr of labeled pixels in a tile, summed over `label_values`, looked
+        up in label integrals without reading label data. For downsampled
+        label integrals (large images) the count is an upper bound, but 0
+        always means that the tile contains none of the labels.
+        '''
+        integrals = [self.label_integral(image_nr, label_value)
+                     for label_value in label_values]
+        return sum(integral.count(pos_zxy, size_zxy)
+                   for integral in integrals if integral is not None)
+
+    def label_bounding_box(self, image_nr, label_values):
+        '''
+        Bounding box of all pixels of `label_values` in an image, taken
+        from the label integrals.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_values : list
+            Ids of labels.
+
+        Returns
+        -------
+        (start_zxy, stop_zxy) or None
+            Upper left position and (exclusive) lower right position of the
+            box. None if the image contains none of the labels.
+        '''
+        integrals = [self.label_integral(image_nr, label_value)
+                     for label_value in label_values]
+        boxes = [integral.bounding_box() for integral in integrals
+                 if integral is not None]
+        if not boxes:
+            return None
+
+        start_zxy = np.min([start for start, _ in boxes], axis=0)
+        stop_zxy = np.max([stop for _, stop in boxes], axis=0)
+        return start_zxy, stop_zxy
 
     def _random_training_tile_by_polling(self,
                                          size_zxy,
@@ -291,14 +844,28 @@ class Dataset(object):
         tile. The number if trials is set in self.max_pollings.
         If the nr of trials exceeds max_pollings, the last fetched tile is
         returned, although not containing the label.
+        If use_label_integrals is True, positions are drawn around labeled
+        regions only, and positions without labels are rejected by a label
+        integral lookup before reading.
         '''
         augment_params = augment_params or {}
         if ensure_labelvalue is None and equalized:
             ensure_labelvalue = self._random_label_value(equalized=equalized)
 
+        check_labels = [ensure_labelvalue] if ensure_labelvalue is not None \
+            else list(labels)
+
         for counter in range(self.max_pollings):
-            img_nr, pos_zxy = self._random_pos_izxy(ensure_labelvalue,
-                                                    size_zxy)
+            img_nr, pos_zxy = self._random_pos_izxy(
+                ensure_labelvalue, size_zxy,
+                in_label_region=self.use_label_integrals)
+
+            if self.use_label_integrals and \
+               counter < self.max_pollings - 1 and \
+               self.label_count_in_tile(img_nr, pos_zxy, size_zxy,
+                                        check_labels) == 0:
+                # no labels in tile, skip without reading
+                continue
 
             tile_data = self.training_tile(img_nr, pos_zxy, size_zxy,
                                            channels, labels,
@@ -346,13 +913,19 @@ class Dataset(object):
                                             equalized=False,
                                             augment_params=None,
                                             ensure_labelvalue=None):
+        '''
+        Fetches a random training tile around a randomly drawn labeled
+        pixel (see label_coordinate()). The tile is guaranteed to contain
+        the label specified in ensure_labelvalue (before augmentation), i.e.
+        no tiles are read in vain.
+        '''
         augment_params = augment_params or {}
         if ensure_labelvalue is None:
             ensure_labelvalue = self._random_label_value(equalized=equalized)
 
         total_count = self.label_counts[ensure_labelvalue].sum()
-        img_nr, _, *pos_zxy = self.label_coordinate(ensure_labelvalue,
-                                                    randint(total_count))
+        img_nr, _, *pos_zxy = self.label_coordinate(
+            ensure_labelvalue, int(self.rng.integers(total_count)))
         np.testing.assert_array_equal(len(pos_zxy), len(size_zxy))
 
         # Now we have a label. But we can but the tile anywhere as long as the
@@ -364,7 +937,7 @@ class Dataset(object):
         maxpos = np.minimum(pos_zxy, shape_zxy - size_zxy)
         minpos = np.maximum(0, pos_zxy - size_zxy + 1)
 
-        pos_zxy = [np.random.randint(a, b + 1) for a, b in zip(minpos, maxpos)]
+        pos_zxy = self.rng.integers(minpos, maxpos + 1)
 
         tile_data = self.training_tile(img_nr, pos_zxy, size_zxy,
                                        channels, labels,
@@ -380,7 +953,8 @@ class Dataset(object):
                       channels,
                       labels,
                       pixel_padding=(0, 0, 0),
-                      augment_params=None):
+                      augment_params=None,
+                      label_masks=False):
         '''
         Returns a training tile including weights.
 
@@ -405,6 +979,9 @@ class Dataset(object):
             rot90 : int, number of 90 degree rotations;
             rotate : float, rotation in degrees;
             shear : float, shear in degrees.
+        label_masks : bool
+            If True, weights are returned as boolean label masks. The
+            weight of each label is given by label_weights.
 
         Returns
         -------
@@ -418,15 +995,26 @@ class Dataset(object):
                         pixel_padding=pixel_padding,
                         augment_params=augment_params)
 
-        # 4d label tile with selected labels in 1st dimension
+        # 4d label tile with selected labels in 1st dimension,
+        # all labels are read and augmented in one pass
         shape_zxy = self.image_dimensions(image_nr)[1:]
-        label_tile = [_augment_tile(shape_zxy, pos_zxy, size_zxy,
-                                    self._get_weights_tile,
-                                    augment_params=augment_params,
-                                    image_nr=image_nr,
-                                    label_value=l)
-                      for l in labels]
-        label_tile = np.array(label_tile)
+        label_values = list(labels)
+        L = len(label_values)
+        get_label_tiles = self._get_label_masks if label_masks \
+            else self._get_weights_tiles
+        if L == 0:
+            label_tile = np.zeros((0,) + tuple(size_zxy),
+                                  dtype=bool if label_masks
+                                  else self.float_data_type)
+        else:
+            label_tile = _augment_tile(np.hstack([[L], shape_zxy]),
+                                       np.hstack([[0], pos_zxy]),
+                                       np.hstack([[L], size_zxy]),
+                                       get_label_tiles,
+                                       augment_params=augment_params,
+                                       warp_cache=self.warp_cache,
+                                       image_nr=image_nr,
+                                       label_values=label_values)
 
         msg = 'pixel tile dim={} label tile dim={} labels={}'.format(
                     pixel_tile.shape, label_tile.shape, len(labels))
@@ -441,32 +1029,109 @@ class Dataset(object):
                                 size_zxy,
                                 channels,
                                 pixel_padding=(0, 0, 0),
-                                augment_params=None):
-        augment_params = augment_params or {}
-        np.testing.assert_equal(len(pos_zxy), 3,
-                                'Expected 3 dimensions (Z, X, Y)')
-        np.testing.assert_equal(len(size_zxy), 3,
-                                'Expected 3 dimensions (Z, X, Y)')
+                                augment_params=None,
+                                plan=None):
+        '''
+        Returns a 4d pixel tile with dimensions czxy.
 
+        plan is the read and padding plan of the tile (one entry of
+        pixel_tile_plans). If given, the tile position is not checked
+        again.
+        '''
+        augment_params = augment_params or {}
         image_shape_zxy = self.image_dimensions(image_nr)
-        ut.assert_valid_image_subset(image_shape_zxy[1:], pos_zxy, size_zxy)
+        channels = list(channels)
+        C = len(channels)
 
         pixel_padding = np.array(pixel_padding)
         size_padded = size_zxy + 2 * pixel_padding
         pos_padded = pos_zxy - pixel_padding
 
+        if plan is None:
+            np.testing.assert_equal(len(pos_zxy), 3,
+                                    'Expected 3 dimensions (Z, X, Y)')
+            np.testing.assert_equal(len(size_zxy), 3,
+                                    'Expected 3 dimensions (Z, X, Y)')
+            ut.assert_valid_image_subset(image_shape_zxy[1:], pos_zxy,
+                                         size_zxy)
+        else:
+            # add channel dimension
+            plan = (np.hstack([[0], plan.pos_transient]),
+                    np.hstack([[C], plan.size_transient]),
+                    np.hstack([[0], plan.pos_inside]),
+                    np.vstack([[(0, 0)], plan.padding]))
+
         for c in channels:
             msg = 'channel {} does not exist'.format(c)
-            assert c < self.pixel_connector.image_dimensions(image_nr)[0], msg
-        tile = [_augment_tile(image_shape_zxy,
-                              np.hstack([[c], pos_padded]),
-                              np.hstack([[1], size_padded]),
-                              self.pixel_connector.get_tile,
-                              augment_params=augment_params,
-                              image_nr=image_nr)
-                for c in channels]
+            assert c < image_shape_zxy[0], msg
+
+        # all channels are read and augmented in one pass
+        return _augment_tile(np.hstack([[C], image_shape_zxy[1:]]),
+                             np.hstack([[0], pos_padded]),
+                             np.hstack([[C], size_padded]),
+                             self._get_pixel_tiles,
+                             augment_params=augment_params,
+                             warp_cache=self.warp_cache,
+                             plan=plan,
+                             image_nr=image_nr,
+                             channels=channels)
+
+    def pixel_tile_plans(self, image_nrs, positions_zxy, size_zxy,
+                         pixel_padding=(0, 0, 0)):
+        '''
+        Read and padding plans of many pixel tiles, computed in one
+        vectorized call (see tile_plans). Tile positions are checked once
+        for all tiles.
 
-        return np.vstack(tile)
+        Parameters
+        ----------
+        image_nrs : array_like
+            Image index of each tile.
+        positions_zxy : array_like
+            Upper left positions of tiles with dimensions (N, 3).
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Tile size.
+        pixel_padding : (pad_z, pad_x, pad_y)
+            Amount of padding to increase tile size in zxy.
+
+        Returns
+        -------
+        TilePlan
+            zxy plans of the padded pixel tiles, with N entries each. Pass
+            TilePlan(*entries) of a tile to multichannel_pixel_tile.
+        '''
+        image_nrs = np.asarray(image_nrs, dtype=int)
+        positions_zxy = np.asarray(positions_zxy).reshape((-1, 3))
+        size_zxy = np.asarray(size_zxy)
+        pixel_padding = np.asarray(pixel_padding)
+
+        unique_nrs, inverse = np.unique(image_nrs, return_inverse=True)
+        shapes_zxy = np.array([self.image_dimensions(nr)[1:]
+                               for nr in unique_nrs]).reshape((-1, 3))
+        shapes_zxy = shapes_zxy[inverse]
+
+        assert not (positions_zxy < 0).any(), 'tile out of image bounds'
+        assert not (shapes_zxy < positions_zxy + size_zxy).any(), \
+            'tile out of image bounds'
+
+        return tile_plans(shapes_zxy,
+                          positions_zxy - pixel_padding,
+                          size_zxy + 2 * pixel_padding)
+
+    def _get_pixel_tiles(self, image_nr=None, pos=None, size=None,
+                         channels=None):
+        '''
+        Returns a 4d pixel tile with dimensions czxy in the working data
+        type (see float_data_type and raw_pixels). The first element of pos
+        and size selects the channels from channels. Channels are fetched
+        with one call of the connector's get_multichannel_tile.
+        '''
+        C, *pos_zxy = pos
+        dtype = None if self.raw_pixels else self.float_data_type
+
+        return self.pixel_connector.get_multichannel_tile(
+                    image_nr, channels[C:C + size[0]], pos_zxy, size[1:],
+                    dtype=dtype)
 
     def _get_weights_tile(self, image_nr=None, pos=None, size=None,
                           label_value=None):
@@ -474,15 +1139,41 @@ class Dataset(object):
         Returns a 3d weight matrix tile for a certain label with
         dimensions zxy.
         '''
-        assert label_value in self.label_values()
+        return self._get_weights_tiles(image_nr=image_nr,
+                                       pos=np.hstack([[0], pos]),
+                                       size=np.hstack([[1], size]),
+                                       label_values=[label_value])[0]
+
+    def _get_weights_tiles(self, image_nr=None, pos=None, size=None,
+                           label_values=None):
+        '''
+        Returns a 4d weight matrix tile for several labels with
+        dimensions (label, z, x, y). The first element of pos and size
+        selects the labels from label_values. Label masks are fetched with
+        one call of the connector's label_tiles.
+        '''
+        L = pos[0]
+        boolmat = self._get_label_masks(image_nr=image_nr, pos=pos,
+                                        size=size, label_values=label_values)
 
-        boolmat = self.pixel_connector.label_tile(image_nr, pos, size,
-                                                  label_value)
+        weights = np.array([self.label_weights[label_value]
+                            for label_value in label_values[L:L + size[0]]],
+                           dtype=self.float_data_type)
+        return boolmat * weights[:, np.newaxis, np.newaxis, np.newaxis]
 
-        weight_mat = np.zeros_like(boolmat, float)
-        weight_mat[boolmat] = self.label_weights[label_value]
+    def _get_label_masks(self, image_nr=None, pos=None, size=None,
+                         label_values=None):
+        '''
+        Returns a 4d boolean label mask tile for several labels with
+        dimensions (label, z, x, y), see _get_weights_tiles.
+        '''
+        L, *pos_zxy = pos
+        label_values = label_values[L:L + size[0]]
+        for label_value in label_values:
+            assert label_value in self.label_counts
 
-        return weight_mat
+        return self.pixel_connector.label_tiles(image_nr, pos_zxy,
+                                                size[1:], label_values)
 
     def equalize_label_weights(self):
         '''
@@ -526,9 +1217,15 @@ class Dataset(object):
 
         label_counts = collections.defaultdict(lambda: np.zeros(self.n_images,
                                                                 dtype='int64'))
-        for i in range(self.n_images):
-            img_label_counts = \
-                self.pixel_connector.label_count_for_image(i) or {}
+        msg = 'Load label counts: ' if self.workers > 1 else None
+        count_func = self.pixel_connector.label_count_for_image
+        all_counts = ut.parallel_map(count_func,
+                                     range(self.n_images),
+                                     workers=self.workers,
+                                     msg=msg)
+
+        for i, img_label_counts in enumerate(all_counts):
+            img_label_counts = img_label_counts or {}
 
             for label_value in img_label_counts.keys():
                 label_counts[label_value][i] = img_label_counts[label_value]
@@ -600,6 +1297,9 @@ class Dataset(object):
         for lbl in missing_in_d2:
             lc2[lbl] = np.zeros((datset.n_images), dtype=np.int64)
 
+        self._reset_samplers()
+        datset._reset_samplers()
+
     def _random_label_value(self, equalized=False):
         '''
         Returns a randomly chosen labelvalue.
@@ -610,15 +1310,31 @@ class Dataset(object):
             If true, less frequent label_values are picked with same
             probability as frequent label_values.
         '''
+        label_values = self.label_values()
         if equalized:
-            return random.choice(self.label_values())
-
-        # probabilities for each labelvalue
-        total_counts = [counts.sum() for counts in self.label_counts.values()]
-        total_counts_norm = np.array(total_counts) / sum(total_counts)
+            return label_values[self.rng.integers(len(label_values))]
 
         # pick a labelvalue according to the labelvalue probability
-        return np.random.choice(self.label_values(), p=total_counts_norm)
+        labels = self._samplers()['labels']
+        assert labels is not None, 'no label data in dataset'
+        return label_values[labels.draw(rng=self.rng)]
+
+
+def _request_augment_params(request, augmentation):
+    '''
+    Augmentation parameters of a tile request (see TILE_REQUEST_DTYPE) as
+    dict, see Dataset.training_tile().
+    '''
+    augment_params = {}
+    if 'flip' in augmentation:
+        augment_params = {'fliplr': bool(request['fliplr']),
+                          'flipud': bool(request['flipud']),
+                          'rot90': int(request['rot90'])}
+    if 'rotate' in augmentation:
+        augment_params['rotation_angle'] = float(request['rotation_angle'])
+    if 'shear' in augmentation:
+        augment_params['shear_angle'] = float(request['shear_angle'])
+    return augment_params
 
 
 def inner_tile_size(image_shape, pos, tile_shape):
@@ -647,9 +1363,53 @@ def inner_tile_size(image_shape, pos, tile_shape):
         transient tile.
         (more explanation needed)
     '''
+    plan = tile_plans(image_shape, np.asarray(pos)[np.newaxis], tile_shape)
+
+    return (tuple(plan.pos_transient[0]),
+            tuple(plan.size_transient[0]),
+            tuple(plan.pos_inside[0]),
+            tuple(plan.padding[0]))
+
+
+def tile_plans(image_shape, positions, tile_shape):
+    '''
+    Vectorized inner_tile_size for many tiles.
+
+    Parameters
+    ----------
+    image_shape : array_like
+        Shape of full size original image, or one shape for each tile
+        with dimensions (N, ndim).
+    positions : array_like
+        Upper left positions of N tiles with dimensions (N, ndim).
+    tile_shape : array_like
+        Size of tiles.
+
+    Returns
+    -------
+    TilePlan
+        pos_transient, size_transient and pos_inside with dimensions
+        (N, ndim), padding with dimensions (N, ndim, 2). Values for each
+        tile are the same as returned by inner_tile_size.
+
+    Examples
+    --------
+    >>> from yapic_io.dataset import tile_plans
+    >>> plan = tile_plans((10, 10), [(2, 3), (-2, 8)], (4, 4))
+    >>> plan.pos_transient
+    array([[2, 3],
+           [0, 8]])
+    >>> plan.padding[1]
+    array([[2, 0],
+           [0, 2]])
+    '''
+    image_shape = np.asarray(image_shape)
+    pos = np.asarray(positions)
+    tile_shape = np.asarray(tile_shape)
+
     padding_lower = np.maximum(0, -pos)
     padding_upper = np.maximum(0, pos - (image_shape - tile_shape))
-    padding = np.vstack([padding_lower, padding_upper]).T
+    padding = np.stack([padding_lower, padding_upper], axis=-1)
 
     pos_tile = np.maximum(0, pos + padding_upper - image_shape)
     pos_out = pos + padding_lower - pos_tile
@@ -661,7 +1421,33 @@ def inner_tile_size(image_shape, pos, tile_shape):
     size_new_2 = np.minimum(tile_shape, image_shape - pos_out)
     size_out = np.minimum(size_new_1, size_new_2)
 
-    return tuple(pos_out), tuple(size_out), tuple(pos_tile), tuple(padding)
+    return TilePlan(pos_out, size_out, pos_tile, padding)
+
+
+@lru_cache(maxsize=1024)
+def _padding_index(size_transient, pos_inside_transient, pad_size,
+                   tile_shape):
+    '''
+    Index arrays for cutting an out of bounds tile from the transient tile
+    (see inner_tile_size) with mirrored edges. Indexing is identical to
+    symmetric padding with np.pad followed by cutting out the tile, but
+    only the tile is copied.
+
+    Padding is applied independently in each dimension, so the index is
+    the outer product of one mirrored index range per dimension. It only
+    depends on the padding plan, i.e. is shared by all tiles at the
+    same image edge.
+    '''
+    padded_shape = np.add(size_transient, np.sum(pad_size, axis=1))
+    ut.assert_valid_image_subset(padded_shape, pos_inside_transient,
+                                 tile_shape)
+
+    index = [np.pad(np.arange(size), pad, mode='symmetric')[pos:pos + n]
+             for size, pos, pad, n in zip(size_transient,
+                                          pos_inside_transient,
+                                          pad_size,
+                                          tile_shape)]
+    return np.ix_(*index)
 
 
 def _augment_tile(img_shape,
@@ -669,42 +1455,64 @@ def _augment_tile(img_shape,
                   tile_shape,
                   get_tile_func,
                   augment_params=None,
+                  warp_cache=None,
+                  plan=None,
                   **kwargs):
     '''
     fetch tile and augment it
-    if rotation and shear is activated, a 3 times larger tile
-    is fetched and the final tile is cut out from that after
-    rotation/shear.
+    if rotation and shear is activated, the tile is fetched with a margin
+    in x and y that covers the source region of the transform (see
+    transformations.warp_margin). Only the final tile is warped, with
+    indices from warp_cache if given (see transformations.WarpIndexCache).
+    plan is the precomputed result of inner_tile_size for pos and
+    tile_shape. It is ignored for rotation and shear, which need a margin.
     '''
     augment_params = augment_params or {}
     rotation_angle = augment_params.get('rotation_angle', 0)
     shear_angle = augment_params.get('shear_angle', 0)
+    rot90 = augment_params.get('rot90', 0)
 
     pos = np.array(pos)
-    orig_tile_shape = np.array(tile_shape)
     tile_shape = np.array(tile_shape)
 
     augment_fast = (tile_shape[-2:] > 1).any()
     augment_slow = augment_fast and (rotation_angle > 0 or shear_angle > 0)
 
     if augment_slow:
-        pos -= tile_shape
-        tile_shape *= 3
-
-    res = inner_tile_size(img_shape, pos, tile_shape)
-    pos_transient, size_transient, pos_inside_transient, pad_size = res
+        orig_shape_xy = tile_shape[-2:]
+        margin_xy = trafo.warp_margin(orig_shape_xy, rotation_angle,
+                                      shear_angle)
+        if rot90 % 2 == 1:
+            # x and y of the fetched tile are swapped by rot90
+            x, y = orig_shape_xy
+            margin_xy = -(-(2 * margin_xy[::-1] + (y - x, x - y)) // 2)
+            margin_xy = np.maximum(margin_xy, 0)
+        # the margin is symmetric, i.e. flipping the tile with margin
+        # flips the tile itself
+        margin = np.zeros(len(tile_shape), dtype=int)
+        margin[-2:] = margin_xy
+        pos = pos - margin
+        tile_shape = tile_shape + 2 * margin
+
+    if plan is None or augment_slow:
+        plan = inner_tile_size(img_shape, pos, tile_shape)
+    pos_transient, size_transient, pos_inside_transient, pad_size = plan
 
     tile = get_tile_func(pos=pos_transient, size=size_transient, **kwargs)
 
-    tile = np.pad(tile, pad_size, mode='symmetric')
-    mesh = ut.get_tile_meshgrid(tile.shape, pos_inside_transient, tile_shape)
-    tile = tile[tuple(mesh)]
+    if np.any(pad_size):
+        # out of bounds tile: mirrored edges in one gather, tiles inside
+        # of the image are used as read
+        index = _padding_index(tuple(size_transient),
+                               tuple(pos_inside_transient),
+                               tuple(tuple(p) for p in pad_size),
+                               tuple(tile_shape))
+        tile = tile[index]
 
     if augment_fast:
         # if the requested tile is only of size 1 in x and y,
         # augmentation can be omitted, since rotation and flipping always
         # occurs around the center axis.
-        rot90 = augment_params.get('rot90', 0)
         flipud = augment_params.get('flipud', False)
         fliplr = augment_params.get('fliplr', False)
 
@@ -712,9 +1520,10 @@ def _augment_tile(img_shape,
                                          flipud=flipud, rot90=rot90)
 
     if augment_slow:
-        tile = trafo.warp_image_2d_stack(tile, rotation_angle, shear_angle)
-        mesh = ut.get_tile_meshgrid(tile.shape, orig_tile_shape,
-                                    orig_tile_shape)
-        tile = tile[tuple(mesh)]
+        origin_xy = (np.array(tile.shape[-2:]) - orig_shape_xy) // 2
+        warp = trafo.warp_tile_2d_stack if warp_cache is None \
+            else warp_cache.warp_tile_2d_stack
+        tile = warp(tile, rotation_angle, shear_angle, origin_xy,
+                    shape_xy=orig_shape_xy)
 
     return tile
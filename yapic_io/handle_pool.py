@@ -0,0 +1,189 @@
+import collections
+import logging
+import os
+import threading
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DEFAULT_MAX_HANDLES = 256
+
+
+def default_max_handles():
+    '''
+    Default nr of open file handles per pool: a quarter of the soft limit
+    of open file descriptors of the process, at most `DEFAULT_MAX_HANDLES`.
+    '''
+    if resource is None:
+        return DEFAULT_MAX_HANDLES
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return DEFAULT_MAX_HANDLES
+    return max(1, min(DEFAULT_MAX_HANDLES, soft // 4))
+
+
+def default_max_bytes():
+    '''
+    Default nr of mapped bytes per pool: half of the address space limit
+    of the process, None (unlimited) if the address space is not limited.
+    '''
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_AS)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return soft // 2
+
+
+def handle_nbytes(handle):
+    '''
+    Nr of bytes occupied by an open handle: an array, an object array of
+    arrays (e.g. the memmapped planes of a tiff file) or None.
+    '''
+    if handle is None:
+        return 0
+    if handle.dtype == object:
+        return sum(handle_nbytes(s) for s in handle.flat)
+    return handle.nbytes
+
+
+class HandlePool(object):
+    '''
+    Pool of open file handles (e.g. memmapped tiff files) of a connector.
+
+    Handles are identified by a key and opened on first request. If the
+    pool exceeds its budget of open handles or mapped bytes, the least
+    recently used handles are released. Each connector owns one pool,
+    shared by pixel images, label images and probability maps. Handles are
+    released when the pool (or the connector) is closed.
+
+    Parameters
+    ----------
+    max_handles : int, optional
+        Maximum nr of open handles. Default is derived from the limit of
+        open file descriptors of the process (see `default_max_handles`).
+    max_bytes : int, optional
+        Maximum nr of mapped bytes of all open handles. Default is derived
+        from the address space limit of the process
+        (see `default_max_bytes`). None means unlimited.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.handle_pool import HandlePool
+    >>> pool = HandlePool(max_handles=2)
+    >>> a = pool.get('a', lambda: np.zeros(3))
+    >>> a = pool.get('a', lambda: np.zeros(3))
+    >>> b = pool.get('b', lambda: np.zeros(3))
+    >>> c = pool.get('c', lambda: np.zeros(3))
+    >>> pool.hits, pool.misses, len(pool)
+    (1, 3, 2)
+    >>> 'a' in pool
+    False
+    >>> pool.close()
+    >>> len(pool)
+    0
+    '''
+
+    def __init__(self, max_handles=None, max_bytes=None):
+        self.max_handles = max_handles if max_handles is not None \
+            else default_max_handles()
+        self.max_bytes = max_bytes if max_bytes is not None \
+            else default_max_bytes()
+        assert self.max_handles > 0, 'max_handles must be positive'
+
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._handles = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return ('HandlePool ({} of {} handles open, {} bytes mapped, '
+                '{} hits, {} misses)').format(len(self), self.max_handles,
+                                              self.nbytes, self.hits,
+                                              self.misses)
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, key):
+        return key in self._handles
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, key, open_func):
+        '''
+        Get an open handle from the pool.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifier of the handle.
+        open_func : callable
+            Called without arguments to open the handle if it is not
+            in the pool.
+
+        Returns
+        -------
+        object
+            The open handle.
+        '''
+        with self._lock:
+            if key in self._handles:
+                self._handles.move_to_end(key)
+                self.hits += 1
+                return self._handles[key][0]
+            self.misses += 1
+
+        # opening is done outside the lock, so that other threads are
+        # not blocked by slow file systems
+        handle = open_func()
+        nbytes = handle_nbytes(handle)
+
+        with self._lock:
+            if key in self._handles:
+                # opened concurrently by another thread
+                return self._handles[key][0]
+            self._handles[key] = (handle, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+        return handle
+
+    def release(self, key):
+        '''
+        Remove a handle from the pool. The file is closed as soon as it is
+        not referenced anymore.
+        '''
+        with self._lock:
+            if key in self._handles:
+                _, nbytes = self._handles.pop(key)
+                self.nbytes -= nbytes
+
+    def _evict(self):
+        # the most recently opened handle is always kept
+        while len(self._handles) > 1 and self._over_budget():
+            key, (_, nbytes) = self._handles.popitem(last=False)
+            self.nbytes -= nbytes
+            logger.debug('Released handle %s', key)
+
+    def _over_budget(self):
+        if len(self._handles) > self.max_handles:
+            return True
+        return self.max_bytes is not None and self.nbytes > self.max_bytes
+
+    def close(self):
+        '''
+        Release all handles.
+        '''
+        with self._lock:
+            self._handles.clear()
+            self.nbytes = 0
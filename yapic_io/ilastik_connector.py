@@ -1,12 +1,13 @@
-from itertools import zip_longest
 import os
 import logging
-from functools import lru_cache
 import numpy as np
 import pyilastik
+import yapic_io.utils as ut
+from yapic_io.coordinate_index import LabelCoordinateIndex
 from yapic_io.tiff_connector import TiffConnector
 from pathlib import Path
 import collections
+import threading
 
 FilePair = collections.namedtuple('FilePair', ['img', 'lbl'])
 logger = logging.getLogger(os.path.basename(__file__))
@@ -32,6 +33,24 @@ class IlastikConnector(TiffConnector):
     savepath : str, optional
         Directory to save pixel classifiaction results as probability
         images.
+    label_index_path : str, optional
+        Path to a sidecar file for persisting label statistics (see
+        TiffConnector). Entries are only valid as long as the project file
+        is unchanged.
+    workers : int, optional
+        Nr of threads for reading label values and label counts of all
+        images at construction. Default is 1 (no parallelization).
+    lazy : bool, optional
+        If True, label values are read the first time they are needed
+        instead of at construction.
+    max_open_files : int, optional
+        Maximum nr of image and probability map files kept open at the
+        same time (see TiffConnector).
+    max_mapped_bytes : int, optional
+        Maximum nr of bytes of all open files (see TiffConnector).
+    max_buffered_bytes : int, optional
+        Budget of the write-back buffer for probability map tiles
+        (see TiffConnector).
 
     Notes
     -----
@@ -65,6 +84,14 @@ class IlastikConnector(TiffConnector):
     yapic_io.tiff_connector.TiffConnector
     '''
 
+    def __init__(self, *args, **kwargs):
+        # label tiles of the most recently requested regions, see label_tile()
+        self.max_label_tiles = 20
+        self._label_tiles = collections.OrderedDict()
+        self._label_tile_lock = threading.RLock()
+
+        super().__init__(*args, **kwargs)
+
     def _assemble_filenames(self, pairs):
         self.filenames = [FilePair(Path(img), Path(lbl))
                           for img, lbl in pairs if lbl]
@@ -75,6 +102,9 @@ class IlastikConnector(TiffConnector):
         label_path = label_filepath
         self.ilp = pyilastik.read_project(label_filepath, skip_image=True)
         lbl_filenames = self.ilp.image_path_list()
+        # image order of the project file may differ from self.filenames
+        self._ilp_image_nrs = {fname: i
+                               for i, fname in enumerate(lbl_filenames)}
 
         return label_path, lbl_filenames
 
@@ -87,7 +117,7 @@ class IlastikConnector(TiffConnector):
             'labelvalue_mapping: {}'.format(self.img_path,
                                             self.label_path,
                                             self.image_count(),
-                                            self.labelvalue_mapping)
+                                            self._labelvalue_mapping_repr())
         return infostring
 
     def _new_label(self, label_value):
@@ -118,7 +148,13 @@ class IlastikConnector(TiffConnector):
         tiff_sel = [self.img_path / pair.img for pair in pairs]
 
         return IlastikConnector(tiff_sel, self.label_path,
-                                savepath=self.savepath)
+                                savepath=self.savepath,
+                                label_index_path=self.label_index_path,
+                                workers=self.workers,
+                                lazy=self.lazy,
+                                max_open_files=self.handle_pool.max_handles,
+                                max_mapped_bytes=self.handle_pool.max_bytes,
+                                max_buffered_bytes=self.write_buffer.max_bytes)
 
     def split(self, fraction, random_seed=42):
         '''
@@ -130,7 +166,7 @@ class IlastikConnector(TiffConnector):
         Parameters
         ----------
         fraction : float
-        random_seed : float, optional
+        random_seed : int, numpy.random.SeedSequence or Generator, optional
 
         Returns
         -------
@@ -141,9 +177,23 @@ class IlastikConnector(TiffConnector):
             fraction, random_seed=random_seed)
 
         conn1 = IlastikConnector(img_fnames1, self.label_path,
-                                 savepath=self.savepath)
+                                 savepath=self.savepath,
+                                 label_index_path=self.label_index_path,
+                                 workers=self.workers,
+                                 lazy=self.lazy,
+                                 max_open_files=self.handle_pool.max_handles,
+                                 max_mapped_bytes=self.handle_pool.max_bytes,
+                                 max_buffered_bytes=(
+                                     self.write_buffer.max_bytes))
         conn2 = IlastikConnector(img_fnames2, self.label_path,
-                                 savepath=self.savepath)
+                                 savepath=self.savepath,
+                                 label_index_path=self.label_index_path,
+                                 workers=self.workers,
+                                 lazy=self.lazy,
+                                 max_open_files=self.handle_pool.max_handles,
+                                 max_mapped_bytes=self.handle_pool.max_bytes,
+                                 max_buffered_bytes=(
+                                     self.write_buffer.max_bytes))
 
         # ensures that both resulting connectors have the same
         # labelvalue mapping (issue #1)
@@ -152,7 +202,6 @@ class IlastikConnector(TiffConnector):
 
         return conn1, conn2
 
-    @lru_cache(maxsize=20)
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
         '''
         Get 3d zxy boolean matrix where positions of the requested label
@@ -175,28 +224,65 @@ class IlastikConnector(TiffConnector):
             3D subsection of labelmatrix as boolean mask in dimension order
             (z, x, y)
         '''
-
+        key = (image_nr, tuple(pos_zxy), tuple(size_zxy), label_value)
+        with self._label_tile_lock:
+            if key in self._label_tiles:
+                self._label_tiles.move_to_end(key)
+                return self._label_tiles[key]
+
+        lbl = self._original_label_tile(image_nr, pos_zxy, size_zxy)
+        if lbl is None:  # no labels in image
+            tile = np.zeros(size_zxy) > 0
+        else:
+            C, original_label_value = self._mapped_label_value_to_original(
+                                             label_value)
+            tile = lbl == original_label_value
+
+        with self._label_tile_lock:
+            self._label_tiles[key] = tile
+            while len(self._label_tiles) > self.max_label_tiles:
+                self._label_tiles.popitem(last=False)
+        return tile
+
+    def label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+
+        out = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
+
+        # the label region is read only once for all labels
+        lbl = self._original_label_tile(image_nr, pos_zxy, size_zxy)
+        if lbl is None:  # no labels in image
+            return out
+
+        for i, label_value in enumerate(label_values):
+            C, original_label_value = self._mapped_label_value_to_original(
+                                             label_value)
+            np.equal(lbl, original_label_value, out=out[i])
+        return out
+
+    def _original_label_tile(self, image_nr, pos_zxy, size_zxy):
+        '''
+        Get 3d zxy matrix of original label values, None if the image
+        has no labels.
+        '''
         slices = np.array([[pos_zxy[0], pos_zxy[0] + size_zxy[0]],  # z
                            [pos_zxy[2], pos_zxy[2] + size_zxy[2]],  # y
                            [pos_zxy[1], pos_zxy[1] + size_zxy[1]],  # x
                            [0, 1]])  # c
 
-        if self.ilp.n_dims(image_nr) == 0:  # no labels in image
-            return np.zeros(size_zxy) > 0
+        ilp_nr = self._ilp_image_nrs[str(self.filenames[image_nr].lbl)]
+
+        if self.ilp.n_dims(ilp_nr) == 0:  # no labels in image
+            return None
 
-        elif self.ilp.n_dims(image_nr) == 4:  # z-stacks
-            lbl = self.ilp.tile(image_nr, slices)
+        elif self.ilp.n_dims(ilp_nr) == 4:  # z-stacks
+            lbl = self.ilp.tile(ilp_nr, slices)
 
-        elif self.ilp.n_dims(image_nr) == 3:  # 2d images
-            lbl = self.ilp.tile(image_nr, slices[1:, :])
+        elif self.ilp.n_dims(ilp_nr) == 3:  # 2d images
+            lbl = self.ilp.tile(ilp_nr, slices[1:, :])
             lbl = np.expand_dims(lbl, axis=0)  # add z axis
 
         # zyxc to czxy
         lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
-        C, original_label_value = self._mapped_label_value_to_original(
-                                         label_value)
-        lbl = (lbl == original_label_value)
-
         return lbl[0, :, :, :]
 
     def check_label_matrix_dimensions(self):
@@ -209,74 +295,67 @@ class IlastikConnector(TiffConnector):
         '''
         return True
 
-    @lru_cache(maxsize=1)
-    def original_label_values_for_all_images(self):
+    def _load_original_label_counts(self, image_nr):
         '''
-        Get all unique label values per image.
+        Get counts of original label values per label channel.
+
+        Label statistics are taken from the label index if available and the
+        project file is unchanged. Otherwise the labels are read from the
+        project file (and the result is added to the label index).
 
         Returns
         -------
         list
-            List of sets. Each set corresponds to 1 label channel.
-            each set contains the label values of that channel.
-            E.g. `[{91, 109, 150}, {90, 100}]` for two label channels
+            List of dicts, one for each label channel, with original label
+            values as keys and label counts as values.
         '''
-        labels_per_channel = []
-
-        for image_nr in range(self.image_count()):
-            label_filename = str(self.filenames[image_nr].lbl)
-
-            if label_filename is None:
-                msg = 'No label matrix file found for image file #{}.'
-                logger.warning(msg.format(image_nr))
-                return None
-            print('label filename')
-            print(label_filename)
-            _, (img, lbl, _) = self.ilp[label_filename]
-            lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
+        label_filename = str(self.filenames[image_nr].lbl)
+        if self.label_index is not None:
+            stats = self.label_index.get(self.label_path, name=label_filename)
+            if stats is not None:
+                return stats['counts']
 
-            C = lbl.shape[0]
-            labels = [np.unique(lbl[c, ...]) for c in range(C)]
-            labels = [set(labels) - {0} for labels in labels]
+        # label dimension order is zyxc
+        _, (img, lbl, _) = self.ilp[label_filename]
+        lbl = lbl.astype(int)
+        if lbl.ndim == 3:  # 2d images
+            lbl = np.expand_dims(lbl, axis=0)  # add z axis
 
-            labels_per_channel = [l1.union(l2)
-                                  for l1, l2 in zip_longest(labels_per_channel,
-                                                            labels,
-                                                            fillvalue=set())]
+        C = lbl.shape[-1]
+        counts = [ut.count_label_values([lbl[..., c]]) for c in range(C)]
 
-        return labels_per_channel
+        if self.label_index is not None:
+            Z, Y, X, C = lbl.shape
+            self.label_index.put(self.label_path, (C, Z, X, Y), counts,
+                                 name=label_filename)
+        return counts
 
-    @lru_cache(maxsize=1500)
-    def label_count_for_image(self, image_nr):
+    def _load_label_coordinate_index(self, image_nr):
         '''
-        Get number of labels per labelvalue for an image.
-
-        Parameters
-        ----------
-        image_nr : int
-            index of image
-
-        Returns
-        -------
-        dict
+        Notes
+        -----
+        Overloads method from tiff connector.
+        Label images are read from the ilastik project file, persisted
+        indices are keyed on the project file and the image path.
         '''
         label_filename = str(self.filenames[image_nr].lbl)
-
-        if label_filename is None:
-            msg = 'No label matrix file found for image file #{}.'
-            logger.warning(msg.format(image_nr))
-            return None
-
+        directory = self.coordinate_index_path
+        if directory is not None:
+            index = LabelCoordinateIndex.load(directory, self.label_path,
+                                              name=label_filename)
+            if index is not None:
+                return index
+
+        # label dimension order is zyxc
         _, (img, lbl, _) = self.ilp[label_filename]
-        lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
+        lbl = lbl.astype(int)
+        if lbl.ndim == 3:  # 2d images
+            lbl = np.expand_dims(lbl, axis=0)  # add z axis
 
-        C = lbl.shape[0]
-        labels = [np.unique(lbl[c, ...]) for c in range(C)]
+        C = lbl.shape[-1]
+        index = LabelCoordinateIndex.from_planes(
+            [[s.T for s in lbl[..., c]] for c in range(C)])
 
-        original_label_count = [{l: np.count_nonzero(lbl[c, ...] == l)
-                                 for l in labels[c] if l > 0}
-                                for c in range(C)]
-        label_count = {self.labelvalue_mapping[c][l]: count
-                       for c, orig in enumerate(original_label_count)
-                       for l, count in orig.items()}
-        return label_count
+        if directory is not None:
+            index.save(directory, self.label_path, name=label_filename)
+        return index
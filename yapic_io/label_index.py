@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class LabelIndex(object):
+    '''
+    Persistent on-disk index of label statistics (sidecar file).
+
+    For each label file the index stores the shape of the label matrix and,
+    for each label channel, the occurring label values with their counts.
+    Entries are keyed on the absolute path of the label file (and the name
+    of the label image for files with several label images, e.g. ilastik
+    projects) and are only valid as long as size and modification time of
+    that file are unchanged. Changed files are rescanned, all other files
+    are taken from the index.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the index file (json format). If the file does not exist,
+        it is created on the first call of ``save()``.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> from yapic_io.tiff_connector import TiffConnector
+    >>> pixel_image_dir = 'yapic_io/test_data/tiffconnector_1/im/*.tif'
+    >>> label_image_dir = 'yapic_io/test_data/tiffconnector_1/labels/*.tif'
+    >>> tmpdir = tempfile.TemporaryDirectory()
+    >>> index_path = tmpdir.name + '/label_index.json'
+    >>>
+    >>> # first connector scans all label files and writes the index
+    >>> c = TiffConnector(pixel_image_dir, label_image_dir,
+    ...                   label_index_path=index_path)
+    >>>
+    >>> # second connector loads label statistics from the index
+    >>> c = TiffConnector(pixel_image_dir, label_image_dir,
+    ...                   label_index_path=index_path)
+    >>> c.label_count_for_image(2)
+    {2: 11, 3: 3}
+    '''
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self.entries = {}
+        self.is_modified = False
+        self.load()
+
+    def __repr__(self):
+        return 'LabelIndex ({} entries, {})'.format(len(self.entries),
+                                                    self.path)
+
+    def load(self):
+        '''
+        Load index entries from file. Outdated or unreadable index files
+        are ignored.
+        '''
+        if not self.path.exists():
+            return
+
+        try:
+            with open(str(self.path)) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            msg = 'Could not read label index {}: {}'
+            logger.warning(msg.format(self.path, e))
+            return
+
+        if data.get('version') != self.version:
+            msg = 'Label index {} has incompatible version {}, ignored'
+            logger.warning(msg.format(self.path, data.get('version')))
+            return
+
+        self.entries = data.get('entries', {})
+        logger.debug('Loaded %s entries from label index %s',
+                     len(self.entries), self.path)
+
+    def save(self):
+        '''
+        Write index to file if it has been modified. The file is replaced
+        atomically, so concurrent readers never see a half written index.
+        Each writer uses its own temporary file, so concurrent writers do
+        not interfere.
+        '''
+        if not self.is_modified:
+            return
+
+        data = {'version': self.version, 'entries': self.entries}
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent),
+                                        prefix=self.path.name + '.',
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, str(self.path))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.is_modified = False
+        logger.debug('Saved %s entries to label index %s',
+                     len(self.entries), self.path)
+
+    @staticmethod
+    def _key_and_stat(fname, name=''):
+        fname = Path(fname).expanduser().resolve()
+        stat = fname.stat()
+        key = '{}|{}'.format(fname, name) if name else str(fname)
+        return key, stat.st_size, stat.st_mtime_ns
+
+    def get(self, fname, name=''):
+        '''
+        Get label statistics of a label file.
+
+        Parameters
+        ----------
+        fname : str or pathlib.Path
+            Path to label file.
+        name : str, optional
+            Name of the label image within the label file (if the file
+            contains several label images).
+
+        Returns
+        -------
+        dict or None
+            Dict with keys `shape` (list) and `counts` (list of dicts,
+            one for each label channel, mapping original label values to
+            counts). None if the file is not indexed or has changed.
+        '''
+        key, size, mtime = self._key_and_stat(fname, name)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+        if entry['size'] != size or entry['mtime'] != mtime:
+            logger.debug('Label file %s changed, index entry is outdated',
+                         key)
+            return None
+
+        return {'shape': entry['shape'],
+                'counts': [{int(value): count for value, count in channel}
+                           for channel in entry['counts']]}
+
+    def put(self, fname, shape, counts, name=''):
+        '''
+        Add or update label statistics of a label file.
+
+        Parameters
+        ----------
+        fname : str or pathlib.Path
+            Path to label file.
+        shape : array_like
+            Shape of the label matrix.
+        counts : list of dicts
+            One dict for each label channel, mapping original label values
+            to counts.
+        name : str, optional
+            Name of the label image within the label file (see `get`).
+        '''
+        key, size, mtime = self._key_and_stat(fname, name)
+        self.entries[key] = {
+            'size': size,
+            'mtime': mtime,
+            'shape': [int(s) for s in shape],
+            'counts': [[[int(value), int(count)]
+                        for value, count in sorted(channel.items())]
+                       for channel in counts]}
+        self.is_modified = True
@@ -0,0 +1,156 @@
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DEFAULT_MAX_CELLS = 2 ** 20
+
+
+class LabelIntegral(object):
+    '''
+    Summed-area table (3D integral image) of the pixels of one label in
+    one image.
+
+    The nr of labeled pixels within any tile is looked up in O(1), i.e.
+    tiles without labels can be skipped before reading any pixels. For
+    large images the table is computed on a downsampled grid (cells of
+    `factors` pixels). Then, lookups return the nr of labeled pixels in all
+    grid cells touched by the tile, i.e. an upper bound of the exact count.
+    A lookup of 0 always means that the tile contains no labels.
+
+    Parameters
+    ----------
+    table : numpy.ndarray
+        Summed-area table with shape (grid_z + 1, grid_x + 1, grid_y + 1).
+    factors : (z, x, y)
+        Size of grid cells in pixels.
+
+    Examples
+    --------
+    >>> from yapic_io.label_integral import LabelIntegral
+    >>> positions_zxy = [(0, 1, 1), (0, 1, 2), (1, 5, 5)]
+    >>> integral = LabelIntegral.from_positions(positions_zxy, (2, 6, 6))
+    >>> integral.count((0, 0, 0), (1, 2, 2))
+    1
+    >>> integral.counts([(0, 0, 0), (0, 3, 3), (0, 4, 4)], (2, 2, 2))
+    array([1, 0, 1])
+    >>> integral.bounding_box()
+    (array([0, 1, 1]), array([2, 6, 6]))
+    '''
+
+    def __init__(self, table, factors):
+        self.table = table
+        self.factors = np.array(factors)
+        self.grid_shape = np.array(table.shape) - 1
+
+    def __repr__(self):
+        return 'LabelIntegral ({} labeled pixels, cell size {})'.format(
+            self.table[-1, -1, -1], tuple(self.factors))
+
+    @property
+    def exact(self):
+        '''
+        True if lookups are exact (no downsampling).
+        '''
+        return bool((self.factors == 1).all())
+
+    @classmethod
+    def from_positions(cls, positions_zxy, shape_zxy,
+                       max_cells=DEFAULT_MAX_CELLS):
+        '''
+        Compute summed-area table from positions of labeled pixels.
+
+        Parameters
+        ----------
+        positions_zxy : array_like
+            Positions of labeled pixels with shape (nr_of_pixels, 3).
+        shape_zxy : (nr_zslices, nr_x, nr_y)
+            Image shape.
+        max_cells : int, optional
+            Maximum nr of grid cells. The largest grid dimension is
+            downsampled by factors of 2 until the grid fits.
+
+        Returns
+        -------
+        LabelIntegral
+        '''
+        shape_zxy = np.array(shape_zxy)
+        factors = np.ones(3, dtype=np.int64)
+        grid = shape_zxy
+        while np.prod(grid) > max_cells:
+            factors[np.argmax(grid)] *= 2
+            grid = -(-shape_zxy // factors)  # ceil division
+
+        positions_zxy = np.asarray(positions_zxy, dtype=np.int64)
+        cells = (positions_zxy // factors).reshape(-1, 3)
+        flat = np.ravel_multi_index(tuple(cells.T), grid)
+        counts = np.bincount(flat, minlength=np.prod(grid)).reshape(grid)
+
+        dtype = np.int32 if len(flat) < 2 ** 31 else np.int64
+        table = np.zeros(grid + 1, dtype=dtype)
+        table[1:, 1:, 1:] = counts.cumsum(0).cumsum(1).cumsum(2)
+
+        logger.debug('Label integral with cell size %s and %s labels',
+                     factors, len(flat))
+        return cls(table, factors)
+
+    def counts(self, positions_zxy, size_zxy):
+        '''
+        Nr of labeled pixels in tiles (upper bound if not `exact`).
+
+        Parameters
+        ----------
+        positions_zxy : array_like
+            Upper left positions of tiles with shape (nr_of_tiles, 3).
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Tile size.
+
+        Returns
+        -------
+        numpy.ndarray
+            Label counts, one for each tile.
+        '''
+        positions_zxy = np.asarray(positions_zxy, dtype=np.int64)
+        start = np.clip(positions_zxy // self.factors, 0, self.grid_shape)
+        stop = -(-(positions_zxy + size_zxy) // self.factors)
+        stop = np.clip(stop, 0, self.grid_shape)
+
+        total = 0
+        # inclusion-exclusion over the 8 corners of the tile
+        for corner in np.ndindex(2, 2, 2):
+            idx = np.where(corner, stop, start)
+            sign = (-1) ** (3 - sum(corner))
+            total = total + sign * self.table[tuple(idx.T)].astype(np.int64)
+        return total
+
+    def bounding_box(self):
+        '''
+        Bounding box of all labeled pixels, aligned to grid cells if the
+        table is downsampled.
+
+        Returns
+        -------
+        (start_zxy, stop_zxy) or None
+            Upper left position and (exclusive) lower right position of the
+            box in pixels. None if there are no labels.
+        '''
+        if self.table[-1, -1, -1] == 0:
+            return None
+
+        start = np.zeros(3, dtype=np.int64)
+        stop = np.zeros(3, dtype=np.int64)
+        for axis in range(3):
+            # cumulative label count along one axis
+            idx = [-1, -1, -1]
+            idx[axis] = slice(None)
+            cells = np.flatnonzero(np.diff(self.table[tuple(idx)]))
+            start[axis] = cells[0]
+            stop[axis] = cells[-1] + 1
+        return start * self.factors, stop * self.factors
+
+    def count(self, pos_zxy, size_zxy):
+        '''
+        Nr of labeled pixels in one tile (see `counts`).
+        '''
+        return int(self.counts([pos_zxy], size_zxy)[0])
@@ -40,7 +40,8 @@ class Minibatch(object):
         self._batch_size = batch_size
         self.normalize_mode = None
         self.global_norm_minmax = None
-        self.float_data_type = np.float32  # type of pixel and weight data
+        # type of pixel and weight data
+        self.float_data_type = dataset.float_data_type
 
         if size_zxy:
             np.testing.assert_equal(len(size_zxy), 3,
@@ -55,8 +56,22 @@ class Minibatch(object):
         # imports all available channels by default
         nr_channels = self.dataset.image_dimensions(0)[0]
         self.channels = set(range(nr_channels))
-        # imports all available labels by default
-        self.labels = set(self.dataset.label_values())
+        # imports all available labels by default, see labels
+        self._labels = None
+
+    @property
+    def labels(self):
+        '''
+        Set of label values, all labels of the dataset by default. Label
+        values of the dataset are loaded on first access.
+        '''
+        if self._labels is None:
+            self._labels = set(self.dataset.label_values())
+        return self._labels
+
+    @labels.setter
+    def labels(self, labels):
+        self._labels = labels
 
     def set_pixel_dimension_order(self, s):
         '''
@@ -144,6 +159,9 @@ class Minibatch(object):
         if self.normalize_mode in ('off', None):
             return pixels
 
+        # raw (e.g. integer) pixels are converted not before normalization
+        pixels = pixels.astype(self.float_data_type, copy=False)
+
         if self.normalize_mode == 'global':
             if _is_twotuple_of_numerics(self.global_norm_minmax):
                 # same reference for all channels
@@ -168,6 +186,8 @@ class Minibatch(object):
             center_ref = pixels.mean(axis=(0, 2, 3, 4))
             scale_ref = pixels.std(axis=(0, 2, 3, 4))
 
+        center_ref = np.asarray(center_ref, dtype=self.float_data_type)
+        scale_ref = np.asarray(scale_ref, dtype=self.float_data_type)
         pixels_centered = (pixels.swapaxes(1, 4) - center_ref)
 
         if (scale_ref == 0).all():
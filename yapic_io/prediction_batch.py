@@ -1,9 +1,11 @@
+import bisect
 import yapic_io.utils as ut
 import numpy as np
 from numpy.testing import assert_equal
 import os
 import logging
 from yapic_io.minibatch import Minibatch
+from yapic_io.dataset import TilePlan
 
 logger = logging.getLogger(os.path.basename(__file__))
 
@@ -16,6 +18,9 @@ class PredictionBatch(Minibatch):
       4D images ``(channels, z, x, y)`` that fit into your neural network
       input layer.
     * Pixel data is loaded lazily to support arbitrary large image datasets.
+      Tile positions are computed image by image as batches are requested,
+      i.e. the first batch is available without reading the dimensions of
+      all images.
     * Provides ``put_probmap_data()`` method to transfer classification
       results of your neural network back to the data source.
     * Flexible data binding through the Dataset object.
@@ -102,47 +107,123 @@ class PredictionBatch(Minibatch):
 
     def set_tile_size(self, size_zxy):
         super().set_tile_size(size_zxy)
-        self._all_tile_positions = self._compute_pos_zxy()
+        # zxy tile positions of the images processed so far and cumulative
+        # nr of tiles (first tile index of each image), see _tile_count()
+        self._image_tile_positions = []
+        self._tile_offsets = [0]
+
+    @property
+    def _all_tile_positions(self):
+        '''
+        All possible tile positions for the whole dataset
+        for tile_size = self._size_zxy (size of output layer).
+
+        Returns
+        -------
+        list
+            Tile positions
+            e.g.
+            ``[(image_nr, zpos, xpos, ypos),
+               (image_nr, zpos, xpos, ypos), ...]``
+        '''
+        self._tile_count()
+        return [self._tile_position(i) for i in range(self._tile_offsets[-1])]
 
     def pixels(self):
         load_img = self.dataset.multichannel_pixel_tile
+        tile_positions = self.current_tile_positions
+
+        # read and padding plans of all tiles in one vectorized call
+        plans = self.dataset.pixel_tile_plans(
+                    [im_nr for im_nr, _ in tile_positions],
+                    [pos_zxy for _, pos_zxy in tile_positions],
+                    self.tile_size_zxy,
+                    self.padding_zxy)
 
         pixels = [load_img(im_nr, pos_zxy,
                            self.tile_size_zxy,
                            self.channels,
-                           self.padding_zxy)
-                  for im_nr, pos_zxy in self.current_tile_positions]
+                           self.padding_zxy,
+                           plan=TilePlan(*plan))
+                  for (im_nr, pos_zxy), plan in zip(tile_positions,
+                                                    zip(*plans))]
         pixels = np.array(pixels)
         pixels = np.moveaxis(pixels, [0, 1, 2, 3, 4],
                              self.pixel_dimension_order)
 
-        return self._normalize(pixels).astype(self.float_data_type)
+        return self._normalize(pixels).astype(self.float_data_type,
+                                              copy=False)
 
     def __len__(self):
         '''
-        Return the number of batches.
+        Return the number of batches. Requires the tile positions (i.e. the
+        dimensions) of all images.
         '''
-        n = len(self._all_tile_positions)  # nr of single tiles
+        n = self._tile_count()  # nr of single tiles
         return int(np.ceil(n / self._batch_size))
 
     def __getitem__(self, position):
         '''
         Implements list-like operations of element selection and slicing.
         '''
-        if position >= len(self):
+        if not self._has_batch(position):
             raise IndexError('index out of bounds')
 
         self.current_batch_pos = position
         return self
 
+    def __iter__(self):
+        '''
+        Iterate over all batches. Probability map tiles buffered by the
+        connector are flushed at the end of the iteration (also if the
+        loop is left early).
+        '''
+        try:
+            position = 0
+            while self._has_batch(position):
+                yield self[position]
+                position += 1
+        finally:
+            self.dataset.pixel_connector.flush()
+
     @property
     def current_tile_positions(self):
-        total = len(self._all_tile_positions)
         start = self.current_batch_pos * self._batch_size
-        size = np.minimum(self._batch_size, total - start)
+        stop = min(start + self._batch_size,
+                   self._tile_count(start + self._batch_size))
 
-        return [self._all_tile_positions[x]
-                for x in range(start, start + size)]
+        return [self._tile_position(x) for x in range(start, stop)]
+
+    def _has_batch(self, position):
+        start = position * self._batch_size
+        return self._tile_count(start + 1) > start
+
+    def _tile_count(self, n=None):
+        '''
+        Computes tile positions of the next images until at least n tile
+        positions are known (of all images if n is None).
+
+        Returns
+        -------
+        int
+            Nr of known tile positions.
+        '''
+        while (n is None or self._tile_offsets[-1] < n) and \
+                len(self._image_tile_positions) < self.dataset.n_images:
+            img_nr = len(self._image_tile_positions)
+            img_shape_zxy = self.dataset.image_dimensions(img_nr)[1:]
+            pos = ut.compute_pos(img_shape_zxy, self.tile_size_zxy)
+            self._image_tile_positions.append(pos)
+            self._tile_offsets.append(self._tile_offsets[-1] + len(pos))
+        return self._tile_offsets[-1]
+
+    def _tile_position(self, i):
+        '''
+        Tile position (image_nr, pos_zxy) of the i-th tile, see _tile_count().
+        '''
+        img_nr = bisect.bisect_right(self._tile_offsets, i) - 1
+        pos = self._image_tile_positions[img_nr]
+        return img_nr, pos[i - self._tile_offsets[img_nr]]
 
     def put_probmap_data(self, probmap_batch):
         '''
@@ -163,7 +244,13 @@ class PredictionBatch(Minibatch):
         Notes
         -----
         The order of the labels list (acessed with ``self.labels``) defines
-        the order of the labels layer in the probability map.
+        the order of the labels layer in the probability map. If
+        ``self.labels`` has not been accessed yet, labels 1 to nr_labels
+        are used (label values of a dataset are always numbered from 1),
+        i.e. no label data is read for prediction.
+
+        Probability maps are buffered by the connector and written to disk
+        after the last batch (see ``Connector.flush()``).
 
         To pass 3D probmaps for a certain label, use
         ``put_probmap_data_for_label()``.
@@ -179,42 +266,18 @@ class PredictionBatch(Minibatch):
 
         assert_equal(len(probmap_batch.shape), 5, '5-dim (B,L,Z,X,Y) expected')
         B, L, *ZXY = probmap_batch.shape
-        self.labels = np.arange(L) + 1 if len(self.labels) == 0 \
-            else self.labels
+        if self._labels is None or len(self._labels) == 0:
+            self.labels = np.arange(L) + 1
 
         assert_equal(B, len(self.current_tile_positions))
         assert_equal(L, len(self.labels))
         assert_equal(ZXY, self.tile_size_zxy)
 
-        for probmap, (image_nr, pos_zxy) in zip(probmap_batch,
-                                                self.current_tile_positions):
-
-            for label_ch, label in zip(probmap, self.labels):
-                self.dataset.pixel_connector.put_tile(
-                    label_ch,
-                    pos_zxy,
-                    image_nr,
-                    label,
-                    multichannel=nr_classes)
-
-    def _compute_pos_zxy(self):
-        '''
-        Compute all possible tile positions for the whole dataset
-        for tile_size = self._size_zxy (size of output layer).
-
-        Returns
-        -------
-        list
-            Tile positions
-            e.g.
-            ``[(image_nr, zpos, xpos, ypos),
-               (image_nr, zpos, xpos, ypos), ...]``
-        '''
-        tile_pos = []
-        for img_nr in list(range(self.dataset.n_images)):
-            img_shape_zxy = self.dataset.image_dimensions(img_nr)[1:]
-            tile_pos = tile_pos + [(img_nr, pos) for pos
-                                   in ut.compute_pos(img_shape_zxy,
-                                                     self.tile_size_zxy)]
+        self.dataset.pixel_connector.put_tiles(probmap_batch,
+                                               self.current_tile_positions,
+                                               list(self.labels),
+                                               multichannel=nr_classes)
 
-        return tile_pos
+        if not self._has_batch(self.current_batch_pos + 1):
+            # last batch
+            self.dataset.pixel_connector.flush()
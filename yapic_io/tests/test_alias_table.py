@@ -0,0 +1,43 @@
+from unittest import TestCase
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+from yapic_io.alias_table import AliasTable
+
+
+class TestAliasTable(TestCase):
+
+    def test_probabilities(self):
+        rng = np.random.default_rng(42)
+        for n in (1, 2, 7, 100):
+            weights = rng.choice([0, 1, 5, 100], size=n)
+            weights[0] = 3
+            table = AliasTable(weights)
+            assert_array_almost_equal(table.probabilities(),
+                                      weights / weights.sum())
+
+    def test_draw(self):
+        rng = np.random.default_rng(42)
+        weights = [0, 2, 0, 6, 2]
+        table = AliasTable(weights)
+
+        idx = table.draw(size=100000, rng=rng)
+        freq = np.bincount(idx, minlength=5) / len(idx)
+        assert_array_almost_equal(freq, [0, 0.2, 0, 0.6, 0.2], decimal=2)
+        # zero weights are never drawn
+        self.assertEqual(freq[0], 0)
+        self.assertEqual(freq[2], 0)
+
+        self.assertIsInstance(table.draw(rng=rng), int)
+        self.assertIsInstance(table.draw(), int)
+
+        # same seed gives same indices
+        assert_array_equal(table.draw(10, rng=np.random.default_rng(1)),
+                           table.draw(10, rng=np.random.default_rng(1)))
+
+    def test_invalid_weights(self):
+        with self.assertRaises(AssertionError):
+            AliasTable([0, 0])
+        with self.assertRaises(AssertionError):
+            AliasTable([1, -1])
+        with self.assertRaises(AssertionError):
+            AliasTable([])
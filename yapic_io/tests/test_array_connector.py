@@ -0,0 +1,137 @@
+from unittest import TestCase
+import os
+import tempfile
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.array_connector import ArrayConnector
+from yapic_io.tiff_connector import TiffConnector
+from yapic_io.dataset import Dataset
+from yapic_io.training_batch import TrainingBatch
+from yapic_io.prediction_batch import PredictionBatch
+
+base_path = os.path.dirname(__file__)
+
+
+def arrays_from_connector(c):
+    images = []
+    labels = []
+    for image_nr in range(c.image_count()):
+        dims = c.image_dimensions(image_nr)
+        images.append(c.get_tile(image_nr, (0, 0, 0, 0), dims))
+
+        slices = c._open_label_file(image_nr)
+        if slices is None:
+            labels.append(None)
+        else:
+            labels.append(np.array([[s.T for s in slices[0, ch]]
+                                    for ch in range(slices.shape[1])]))
+    return images, labels
+
+
+class TestArrayConnector(TestCase):
+
+    def setUp(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        lbl_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel/*.tif')
+        self.tiff_connector = TiffConnector(img_path, lbl_path)
+        self.images, self.labels = arrays_from_connector(self.tiff_connector)
+
+    def test_same_as_tiff_connector(self):
+        t = self.tiff_connector
+        c = ArrayConnector(self.images, self.labels)
+
+        self.assertEqual(c.image_count(), t.image_count())
+        self.assertEqual(c.labelvalue_mapping, t.labelvalue_mapping)
+        for image_nr in range(c.image_count()):
+            assert_array_equal(c.image_dimensions(image_nr),
+                               t.image_dimensions(image_nr))
+            self.assertEqual(c.label_count_for_image(image_nr),
+                             t.label_count_for_image(image_nr))
+
+        pos_zxy, size_zxy = (1, 1, 2), (2, 3, 2)
+        assert_array_equal(c.get_tile(2, (1,) + pos_zxy, (2,) + size_zxy),
+                           t.get_tile(2, (1,) + pos_zxy, (2,) + size_zxy))
+        assert_array_equal(
+            c.get_multichannel_tile(2, [2, 0], pos_zxy, size_zxy),
+            t.get_multichannel_tile(2, [2, 0], pos_zxy, size_zxy))
+        for label_value in (1, 2, 3, 4):
+            assert_array_equal(c.label_tile(2, pos_zxy, size_zxy, label_value),
+                               t.label_tile(2, pos_zxy, size_zxy, label_value))
+
+    def test_tiles_are_views(self):
+        c = ArrayConnector(self.images, self.labels)
+
+        tile = c.get_tile(0, (0, 0, 0, 0), (2, 1, 4, 4))
+        self.assertTrue(np.shares_memory(tile, self.images[0]))
+        self.assertFalse(tile.flags.writeable)
+
+        tile = c.get_multichannel_tile(0, [0, 1], (0, 0, 0), (1, 4, 4),
+                                       dtype=None)
+        self.assertTrue(np.shares_memory(tile, self.images[0]))
+
+    def test_npy_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = []
+            for i, img in enumerate(self.images):
+                paths.append(os.path.join(tmpdir, '{}.npy'.format(i)))
+                np.save(paths[-1], img)
+
+            c = ArrayConnector(paths, self.labels)
+            self.assertIsInstance(c.images[0], np.memmap)
+            assert_array_equal(c.get_tile(2, (0, 0, 0, 0), (3, 3, 6, 4)),
+                               self.images[2])
+
+    def test_put_tile(self):
+        c = ArrayConnector(self.images, self.labels)
+        pixels = np.random.rand(1, 2, 3).astype(np.float32)
+
+        c.put_tile(pixels, (1, 2, 1), 2, 3)
+        probmap = c.probability_map(2, 3)
+        self.assertEqual(probmap.shape, (1, 3, 6, 4))
+        assert_array_equal(probmap[0, 1:2, 2:4, 1:4], pixels)
+        self.assertAlmostEqual(probmap.sum(), pixels.sum(), places=5)
+
+        c.put_tile(pixels, (1, 2, 1), 2, 3, multichannel=4)
+        probmap = c.probability_map(2)
+        self.assertEqual(probmap.shape, (4, 3, 6, 4))
+        assert_array_equal(probmap[2, 1:2, 2:4, 1:4], pixels)
+
+    def test_put_tile_savepath(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            c = ArrayConnector(self.images, self.labels, savepath=tmpdir)
+            pixels = np.random.rand(1, 2, 3).astype(np.float32)
+            c.put_tile(pixels, (1, 2, 1), 2, 3)
+            c.flush()
+
+            probmap = np.load(os.path.join(tmpdir, 'image_2_class_3.npy'))
+            assert_array_equal(probmap[0, 1:2, 2:4, 1:4], pixels)
+
+    def test_split(self):
+        c = ArrayConnector(self.images, self.labels)
+        c1, c2 = c.split(0.5)
+
+        self.assertEqual(c1.image_count() + c2.image_count(), 3)
+        self.assertEqual(c1.labelvalue_mapping, c.labelvalue_mapping)
+        self.assertEqual(c2.labelvalue_mapping, c.labelvalue_mapping)
+        self.assertEqual(c.filter_labeled().image_count(), 2)
+
+    def test_training_and_prediction(self):
+        c = ArrayConnector(self.images, self.labels)
+        d = Dataset(c)
+
+        m = TrainingBatch(d, (1, 3, 4), padding_zxy=(0, 1, 1))
+        m.augment_by_rotation(True)
+        pixels = next(m).pixels()
+        # one tile for each of the 6 labels, 3 channels
+        self.assertEqual(pixels.shape, (6, 3, 1, 5, 6))
+
+        p = PredictionBatch(d, 2, (1, 3, 4))
+        for item in p:
+            item.put_probmap_data(np.ones((len(item.current_tile_positions),
+                                           len(p.labels), 1, 3, 4)))
+
+        for label in p.labels:
+            self.assertTrue(np.all(c.probability_map(0, label) == 1))
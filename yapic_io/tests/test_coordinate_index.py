@@ -0,0 +1,75 @@
+from unittest import TestCase
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.coordinate_index import LabelCoordinateIndex
+
+base_path = os.path.dirname(__file__)
+
+
+class TestLabelCoordinateIndex(TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        # 2 label channels with dimensions (z, x, y)
+        self.lbl = np.random.choice([0, 0, 0, 3, 7], size=(2, 3, 5, 4))
+
+    def test_from_planes(self):
+        index = LabelCoordinateIndex.from_planes(self.lbl)
+
+        self.assertEqual(index.shape_zxy, (3, 5, 4))
+        self.assertEqual(index.positions.dtype, np.uint32)
+        self.assertEqual(len(index.positions), (self.lbl > 0).sum())
+
+        for c in range(2):
+            for value in (3, 7):
+                count = index.count(c, value)
+                self.assertEqual(count, (self.lbl[c] == value).sum())
+
+                czxy = index.coordinates(c, value, np.arange(count))
+                assert_array_equal(czxy[:, 0], c)
+                assert_array_equal(self.lbl[tuple(czxy.T)], value)
+                # all pixels are enumerated, each once
+                self.assertEqual(len(np.unique(czxy, axis=0)), count)
+
+        self.assertEqual(index.count(0, 5), 0)
+        with self.assertRaises(AssertionError):
+            index.coordinate(0, 3, index.count(0, 3))
+
+    def test_from_planes_without_labels(self):
+        index = LabelCoordinateIndex.from_planes([])
+        self.assertEqual(len(index.positions), 0)
+        self.assertEqual(index.count(0, 1), 0)
+
+        index = LabelCoordinateIndex.from_planes(np.zeros((1, 2, 3, 3)))
+        self.assertEqual(len(index.positions), 0)
+        self.assertEqual(index.shape_zxy, (2, 3, 3))
+
+    def test_save_and_load(self):
+        index = LabelCoordinateIndex.from_planes(self.lbl)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = Path(tmpdir) / 'labels.tif'
+            fname.write_bytes(b'label data')
+            directory = Path(tmpdir) / 'coordinates'
+
+            self.assertIsNone(
+                LabelCoordinateIndex.load(directory, fname))
+            index.save(directory, fname)
+            index.save(directory, fname, name='other')
+
+            loaded = LabelCoordinateIndex.load(directory, fname)
+            self.assertIsInstance(loaded.positions, np.memmap)
+            self.assertEqual(loaded.shape_zxy, index.shape_zxy)
+            self.assertEqual(loaded.table, index.table)
+            assert_array_equal(loaded.coordinates(1, 7, [0, 2]),
+                               index.coordinates(1, 7, [0, 2]))
+            self.assertEqual(len(list(directory.glob('*.npy'))), 2)
+            del loaded
+
+            # indices of changed label files are not loaded
+            fname.write_bytes(b'changed label data')
+            self.assertIsNone(
+                LabelCoordinateIndex.load(directory, fname))
@@ -2,13 +2,15 @@ from unittest import TestCase
 import os
 import numpy as np
 from yapic_io.tiff_connector import TiffConnector
+from yapic_io.array_connector import ArrayConnector
 from yapic_io.ilastik_connector import IlastikConnector
 from yapic_io.cellvoy_connector import CellvoyConnector
 from yapic_io.connector import io_connector
 from yapic_io.dataset import Dataset
-from yapic_io.utils import get_tile_meshgrid
+from yapic_io.utils import get_tile_meshgrid, compute_pos
 import yapic_io.dataset as ds
 from pprint import pprint
+from unittest import mock
 import logging
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 logger = logging.getLogger(os.path.basename(__file__))
@@ -292,6 +294,75 @@ class TestDataset(TestCase):
         np.testing.assert_array_equal(pos_tile, (0, 0))
         np.testing.assert_array_equal(pd, [(0, 0), (0, 0)])
 
+    def test_tile_plans(self):
+        np.random.seed(42)
+        image_shape = np.array((3, 7, 11))
+        positions = np.random.randint(-6, 10, size=(50, 3))
+        tile_shape = np.array((2, 5, 4))
+
+        plan = ds.tile_plans(image_shape, positions, tile_shape)
+        for i, pos in enumerate(positions):
+            val = ds.inner_tile_size(image_shape, pos, tile_shape)
+            assert_array_equal(plan.pos_transient[i], val[0])
+            assert_array_equal(plan.size_transient[i], val[1])
+            assert_array_equal(plan.pos_inside[i], val[2])
+            assert_array_equal(plan.padding[i], val[3])
+
+    def test_pixel_tile_plans(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        c = TiffConnector(img_path, 'path/to/nowhere/')
+        d = Dataset(c)
+
+        image_nrs = [0, 2, 2]
+        positions = [(0, 0, 0), (1, 2, 1), (0, 3, 2)]
+        size_zxy = (2, 3, 2)
+        padding = (1, 2, 2)
+
+        plans = d.pixel_tile_plans(image_nrs, positions, size_zxy, padding)
+        self.assertEqual(plans.padding.shape, (3, 3, 2))
+        for image_nr, pos, plan in zip(image_nrs, positions, zip(*plans)):
+            tile = d.multichannel_pixel_tile(image_nr, pos, size_zxy, [0, 1],
+                                             pixel_padding=padding,
+                                             plan=ds.TilePlan(*plan))
+            val = d.multichannel_pixel_tile(image_nr, pos, size_zxy, [0, 1],
+                                            pixel_padding=padding)
+            assert_array_equal(tile, val)
+
+        self.assertRaises(AssertionError, d.pixel_tile_plans,
+                          [2], [(0, 5, 0)], size_zxy)
+
+    def test_padding_index(self):
+        np.random.seed(42)
+        im = np.random.rand(6, 9)
+
+        for pos, size in [((-3, 2), (5, 4)),
+                          ((4, -2), (4, 6)),
+                          ((-2, 6), (10, 5))]:
+            pos_out, size_out, pos_tile, pd = \
+                ds.inner_tile_size(np.array(im.shape), np.array(pos),
+                                   np.array(size))
+            transient = im[tuple(get_tile_meshgrid(im.shape, pos_out,
+                                                   size_out))]
+            padded = np.pad(transient, pd, mode='symmetric')
+            val = padded[tuple(get_tile_meshgrid(padded.shape, pos_tile,
+                                                 size))]
+
+            index = ds._padding_index(size_out, pos_tile,
+                                      tuple(tuple(p) for p in pd), size)
+            assert_array_equal(transient[index], val)
+
+    def test__augment_tile_inside_of_image(self):
+        im = np.random.rand(2, 1, 10, 12)
+
+        def get_tile_func(pos=None, size=None):
+            return im[tuple(get_tile_meshgrid(im.shape, pos, size))]
+
+        with mock.patch('numpy.pad') as m:
+            tile = ds._augment_tile(im.shape, (0, 0, 2, 3), (2, 1, 4, 5),
+                                    get_tile_func)
+            m.assert_not_called()
+        assert_array_equal(tile, im[:, :, 2:6, 3:8])
+
     def test_is_padding(self):
         self.assertTrue(np.any([(2, 3), (0, 0)]))
         self.assertTrue(np.any([(2, 3), (20, 3)]))
@@ -335,7 +406,7 @@ class TestDataset(TestCase):
         mat = d._get_weights_tile(img_nr,
                                   pos_czxy, size_czxy, label_value)
 
-        val = np.zeros(size_czxy)
+        val = np.zeros(size_czxy, dtype=np.float32)
         print('valshae')
         print(val.shape)
         val[0, 0, 1] = 1.2
@@ -346,6 +417,54 @@ class TestDataset(TestCase):
         pprint(val)
         self.assertTrue((val == mat).all())
 
+    def test_training_tile_labels_in_one_pass(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels_multichannel/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+        d.label_weights[3] = 1.5
+
+        pos_zxy = (0, 1, 1)
+        size_zxy = (2, 4, 3)
+        labels = [1, 2, 3, 4]
+        augment_params = {'fliplr': True, 'rot90': 1,
+                          'rotation_angle': 20, 'shear_angle': 5}
+
+        with mock.patch.object(c, 'label_tile') as m:
+            tile = d.training_tile(2, pos_zxy, size_zxy, [0], labels,
+                                   augment_params=augment_params)
+            m.assert_not_called()
+
+        shape_zxy = d.image_dimensions(2)[1:]
+        val = [ds._augment_tile(shape_zxy, pos_zxy, size_zxy,
+                                d._get_weights_tile,
+                                augment_params=augment_params,
+                                image_nr=2, label_value=label)
+               for label in labels]
+
+        self.assertEqual(tile.weights.shape, (4, 2, 4, 3))
+        self.assertEqual(tile.weights.dtype, np.float32)
+        assert_array_almost_equal(tile.weights, val)
+
+    def test_training_tile_label_masks(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+        d.label_weights[3] = 1.5
+
+        args = (2, (0, 1, 1), (2, 4, 3), [0], [1, 2, 3])
+        augment_params = {'fliplr': True, 'rotation_angle': 20}
+        tile = d.training_tile(*args, augment_params=augment_params)
+        masks = d.training_tile(*args, augment_params=augment_params,
+                                label_masks=True)
+
+        self.assertEqual(masks.weights.dtype, bool)
+        assert_array_equal(masks.weights, tile.weights != 0)
+        assert_array_equal(masks.pixels, tile.pixels)
+
     def test_load_label_counts_from_ilastik(self):
         img_path = os.path.join(base_path, '../test_data/ilastik')
         lbl_path = os.path.join(
@@ -384,6 +503,33 @@ class TestDataset(TestCase):
         assert_array_equal(expected_3, t[3])
         self.assertTrue(sorted(list(t.keys())), [1, 2, 3])
 
+    def test_load_label_counts_parallel(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path, workers=3)
+        d = Dataset(c, workers=3)
+
+        t = d.load_label_counts()
+
+        assert_array_equal(np.array([4, 0, 0]), t[1])
+        assert_array_equal(np.array([3, 0, 11]), t[2])
+        assert_array_equal(np.array([3, 0, 3]), t[3])
+        self.assertEqual(c.labelvalue_mapping, [{91: 1, 109: 2, 150: 3}])
+
+    def test_lazy(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path, lazy=True)
+
+        with mock.patch.object(c, 'label_count_for_image') as m:
+            d = Dataset(c, lazy=True)
+            m.assert_not_called()
+
+        assert_array_equal(d.label_counts[2], np.array([3, 0, 11]))
+        self.assertEqual(d.label_weights, {1: 1, 2: 1, 3: 1})
+
     def test_sync_label_counts(self):
         img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
         label_path = os.path.join(
@@ -707,6 +853,44 @@ class TestDataset(TestCase):
 
         self.assertTrue((tile == val).all())
 
+    def test_multichannel_pixel_tile_dtype(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        c = TiffConnector(img_path, 'path/to/nowhere/')
+        d = Dataset(c)
+
+        tile = d.multichannel_pixel_tile(2, (0, 1, 1), (2, 3, 2), [0, 1],
+                                         pixel_padding=(1, 2, 2))
+        self.assertEqual(tile.dtype, np.float32)
+
+        d.raw_pixels = True
+        tile_raw = d.multichannel_pixel_tile(2, (0, 1, 1), (2, 3, 2), [0, 1],
+                                             pixel_padding=(1, 2, 2))
+        self.assertEqual(tile_raw.dtype, np.uint8)
+        assert_array_equal(tile, tile_raw)
+
+    def test_multichannel_pixel_tile_in_one_pass(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        c = TiffConnector(img_path, 'path/to/nowhere/')
+        d = Dataset(c)
+
+        pos_zxy = (0, 1, 1)
+        size_zxy = (2, 3, 2)
+        channels = [2, 0]
+        augment_params = {'fliplr': True, 'rotation_angle': 20}
+
+        with mock.patch.object(c, 'get_multichannel_tile',
+                               wraps=c.get_multichannel_tile) as m:
+            tile = d.multichannel_pixel_tile(2, pos_zxy, size_zxy, channels,
+                                             pixel_padding=(1, 2, 2),
+                                             augment_params=augment_params)
+            m.assert_called_once()
+
+        val = [d.multichannel_pixel_tile(2, pos_zxy, size_zxy, [ch],
+                                         pixel_padding=(1, 2, 2),
+                                         augment_params=augment_params)
+               for ch in channels]
+        assert_array_equal(tile, np.vstack(val))
+
     def test_channels_are_consistent(self):
 
         data_dir = os.path.join(base_path, '../test_data/cellvoyager')
@@ -803,32 +987,18 @@ class TestDataset(TestCase):
         np.testing.assert_array_equal(tile.weights.shape, weight_shape_val)
         np.testing.assert_array_equal(tile.labels, labels_val)
 
-    def test_get_label_probs(self):
-        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
-        label_path = os.path.join(
-            base_path, '../test_data/tiffconnector_1/labels/')
-        c = TiffConnector(img_path, label_path)
-        d = Dataset(c)
-
-        res = d._get_label_probs(label_value=None)
-        assert_array_almost_equal(res, [0.416667, 0., 0.583333])
-
-        res = d._get_label_probs(label_value=1)
-        assert_array_almost_equal(res, [1., 0., 0.])
-
     def test_random_pos_izxy(self):
         img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
         label_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/labels/')
         c = TiffConnector(img_path, label_path)
-        d = Dataset(c)
+        d = Dataset(c, random_seed=42)
 
-        np.random.seed(42)
         img_nr, pos_zxy = d._random_pos_izxy(label_value=1,
                                              tile_size_zxy=(1, 2, 2))
 
         assert_array_equal(img_nr, 0)
-        assert_array_equal(pos_zxy, [2, 7, 20])
+        assert_array_equal(pos_zxy, [2, 16, 21])
 
         # this tile has same size as image, pos must always be 0
         img_nr, pos_zxy = d._random_pos_izxy(label_value=1,
@@ -840,7 +1010,137 @@ class TestDataset(TestCase):
         with self.assertRaises(AssertionError):
             d._random_pos_izxy(label_value=1,
                                tile_size_zxy=(3, 40, 27))
-        np.random.seed(None)
+
+    def test_label_samplers(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c, random_seed=42)
+
+        assert_array_equal(d.label_count_matrix(), [[4, 0, 0],
+                                                    [3, 0, 11],
+                                                    [3, 0, 3]])
+        state = np.random.get_state()
+        img_nrs = [d._random_image_nr(2) for _ in range(200)]
+        self.assertEqual(set(img_nrs), {0, 2})
+        label_values = [d._random_label_value() for _ in range(200)]
+        self.assertEqual(set(label_values), {1, 2, 3})
+        # draws only depend on the random seed of the dataset
+        assert_array_equal(np.random.get_state()[1], state[1])
+        d_same_seed = Dataset(c, random_seed=42)
+        self.assertEqual(
+            [d_same_seed._random_image_nr(2) for _ in range(200)], img_nrs)
+
+        # tables are rebuilt if label counts are set
+        d.label_counts = {1: np.array([0, 5, 0])}
+        assert_array_equal(d.label_count_matrix(), [[0, 5, 0]])
+        self.assertEqual(d._random_image_nr(1), 1)
+        self.assertEqual(d._random_label_value(), 1)
+        with self.assertRaises(AssertionError):
+            d._random_image_nr(2)
+
+    def test_random_seed(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+
+        def draw(d):
+            return [d._random_pos_izxy(None, (1, 2, 2))[1]
+                    for _ in range(10)]
+
+        state = np.random.get_state()
+        assert_array_equal(draw(Dataset(c, random_seed=1)),
+                           draw(Dataset(c, random_seed=1)))
+        # global random state is not touched
+        assert_array_equal(np.random.get_state()[1], state[1])
+
+        # spawned generators are reproducible and independent
+        d1 = Dataset(c, random_seed=1)
+        d2 = Dataset(c, random_seed=1)
+        rngs_1 = d1.spawn_rngs(2)
+        rngs_2 = d2.spawn_rngs(2)
+        assert_array_equal(rngs_1[0].random(5), rngs_2[0].random(5))
+        assert_array_equal(rngs_1[1].random(5), rngs_2[1].random(5))
+        self.assertFalse(np.array_equal(d1.spawn_rngs(1)[0].random(5),
+                                        rngs_1[0].random(5)))
+
+    def test_random_tile_requests(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        size_zxy = (1, 3, 3)
+        rng = np.random.default_rng(42)
+        requests = d.random_tile_requests(
+            300, size_zxy, augmentation={'flip', 'rotate'},
+            rotation_range=(-10, 10), rng=rng)
+
+        self.assertEqual(requests.dtype, ds.TILE_REQUEST_DTYPE)
+        self.assertEqual(set(requests['label_value']), {1, 2, 3})
+        self.assertTrue(set(requests['rot90']) <= {0, 1, 2, 3})
+        self.assertTrue((np.abs(requests['rotation_angle']) <= 10).all())
+        assert_array_equal(requests['shear_angle'], 0)
+
+        for request in requests:
+            image_nr = request['image_nr']
+            label_value = request['label_value']
+            self.assertTrue(d.label_counts[label_value][image_nr] > 0)
+            # each tile contains its label
+            self.assertTrue(c.label_tile(image_nr, request['pos_zxy'],
+                                         size_zxy, label_value).any())
+
+        # same generator state gives same requests
+        requests_1 = d.random_tile_requests(
+            10, size_zxy, rng=np.random.default_rng(1))
+        requests_2 = d.random_tile_requests(
+            10, size_zxy, rng=np.random.default_rng(1))
+        assert_array_equal(requests_1, requests_2)
+
+    def test_random_training_tiles(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        d = Dataset(TiffConnector(img_path, label_path))
+
+        size_zxy = (1, 4, 3)
+        labels = [1, 2, 3]
+        tiles = d.random_training_tiles(
+            6, size_zxy, [0, 1, 2], labels=labels,
+            pixel_padding=(0, 1, 1), ensure_labelvalues=[1, 2, 3, 3, 2, 1],
+            augmentation={'flip'}, rng=np.random.default_rng(42))
+
+        self.assertEqual(len(tiles), 6)
+        for tile, label_value in zip(tiles, [1, 2, 3, 3, 2, 1]):
+            self.assertEqual(tile.pixels.shape, (3, 1, 6, 5))
+            self.assertEqual(tile.weights.shape, (3, 1, 4, 3))
+            self.assertTrue(tile.weights[labels.index(label_value)].any())
+            self.assertEqual(set(tile.augmentation),
+                             {'fliplr', 'flipud', 'rot90'})
+
+    def test_random_pos_izxy_in_label_region(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        size_zxy = np.array((1, 2, 2))
+        for label_value in [1, 2, 3, None]:
+            for _ in range(50):
+                img_nr, pos_zxy = d._random_pos_izxy(label_value, size_zxy,
+                                                     in_label_region=True)
+                labels = d.label_values() if label_value is None \
+                    else [label_value]
+                start, stop = d.label_bounding_box(img_nr, labels)
+                # tile intersects the bounding box
+                self.assertTrue((pos_zxy + size_zxy > start).all())
+                self.assertTrue((pos_zxy < stop).all())
+
+        self.assertIsNone(d.label_bounding_box(1, d.label_values()))
 
     def test_init_dataset_ilastik(self):
         p = os.path.join(base_path, '../test_data/ilastik/dimensionstest')
@@ -867,9 +1167,8 @@ class TestDataset(TestCase):
         ensure_labelvalue = 2
 
         c = IlastikConnector(img_path, label_path)
-        d = Dataset(c)
+        d = Dataset(c, random_seed=43)
 
-        np.random.seed(43)
         training_tile = d._random_training_tile_by_polling(
                                         size,
                                         channels,
@@ -880,6 +1179,116 @@ class TestDataset(TestCase):
         weights_val = np.array([[[[0.]]], [[[1.]]]])
         assert_array_equal(training_tile.weights, weights_val)
 
+    def test_label_coordinate(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        d = Dataset(TiffConnector(img_path, label_path))
+
+        for label_value, counts in d.label_counts.items():
+            for i in range(counts.sum()):
+                img_nr, c, *pos_zxy = d.label_coordinate(label_value, i)
+                self.assertTrue(counts[img_nr] > 0)
+                self.assertTrue(d.pixel_connector.label_tile(
+                    img_nr, pos_zxy, (1, 1, 1), label_value))
+
+        with self.assertRaises(AssertionError):
+            d.label_coordinate(1, d.label_counts[1].sum())
+
+    def test_label_count_in_tile(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        size_zxy = (1, 4, 3)
+        for img_nr in range(d.n_images):
+            shape_zxy = d.image_dimensions(img_nr)[1:]
+            for pos_zxy in compute_pos(shape_zxy, size_zxy):
+                for label_value in d.label_values():
+                    mask = c.label_tile(img_nr, pos_zxy, size_zxy,
+                                        label_value)
+                    self.assertEqual(
+                        d.label_count_in_tile(img_nr, pos_zxy, size_zxy,
+                                              [label_value]),
+                        mask.sum())
+
+            self.assertEqual(
+                d.label_count_in_tile(img_nr, (0, 0, 0), shape_zxy,
+                                      d.label_values()),
+                sum(d.label_counts[lbl][img_nr] for lbl in d.label_values()))
+
+    def test_label_integral(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+
+        # label files are scanned only once at construction, label
+        # integrals and coordinate indices are computed on first use
+        with mock.patch('yapic_io.tiff_connector.LabelCoordinateIndex'
+                        '.from_planes') as m:
+            d = Dataset(c)
+            m.assert_not_called()
+        self.assertEqual(len(d._label_integrals), 0)
+        self.assertEqual(len(c._label_coordinate_indices), 0)
+
+        # only for present labels
+        self.assertIsNone(d.label_integral(1, 2))
+        self.assertIsNone(d.label_integral(0, 4))
+        self.assertEqual(d.label_integral(2, 2).count(
+            (0, 0, 0), d.image_dimensions(2)[1:]), 11)
+
+        # cache is bounded, dropped integrals are recomputed
+        d.max_label_integrals = 2
+        d._label_integrals.clear()
+        for img_nr, label_value in [(0, 1), (0, 2), (0, 3), (0, 1)]:
+            integral = d.label_integral(img_nr, label_value)
+            self.assertEqual(integral.count((0, 0, 0),
+                                            d.image_dimensions(0)[1:]),
+                             d.label_counts[label_value][0])
+        self.assertEqual(list(d._label_integrals.keys()), [(0, 3), (0, 1)])
+
+        # coordinate indices are kept for the most recently used images
+        c.max_coordinate_indices = 1
+        c._label_coordinate_indices.clear()
+        d._label_integrals.clear()
+        d.label_integral(0, 2)
+        d.label_integral(2, 3)
+        self.assertEqual(list(c._label_coordinate_indices.keys()), [2])
+
+    def test_random_training_tile_by_coordinate(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c, random_seed=42)
+        # TiffConnector is a CoordinateConnector
+        self.assertTrue(d.coordinate_sampling)
+
+        size = (1, 3, 4)
+        channels = [0, 1, 2]
+        labels = [1, 2, 3]
+
+        coord_func = mock.patch.object(c, 'label_index_to_coordinate',
+                                       wraps=c.label_index_to_coordinate)
+        with mock.patch.object(d, '_random_training_tile_by_polling') as m, \
+                coord_func as m_coord:
+            for _ in range(20):
+                for i, ensure_labelvalue in enumerate(labels):
+                    tile = d.random_training_tile(
+                        size, channels, labels=labels,
+                        ensure_labelvalue=ensure_labelvalue)
+                    self.assertEqual(tile.weights.shape, (3, 1, 3, 4))
+                    self.assertTrue(tile.weights[i].any())
+            m.assert_not_called()
+            self.assertEqual(m_coord.call_count, 60)
+
+        arr_c = ArrayConnector([np.zeros((1, 1, 4, 4))],
+                               [np.ones((1, 1, 4, 4), dtype=np.uint8)])
+        self.assertTrue(Dataset(arr_c).coordinate_sampling)
+
     def test_random_training_tile_by_polling(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/')
@@ -892,7 +1301,7 @@ class TestDataset(TestCase):
         ensure_labelvalue = 2
 
         c = TiffConnector(img_path, label_path)
-        d = Dataset(c)
+        d = Dataset(c, random_seed=43)
 
         # weights_val = np.array(
 
@@ -900,18 +1309,15 @@ class TestDataset(TestCase):
                                   [0., 0., 0.],
                                   [0., 0., 0.],
                                   [0., 0., 0.]]],
-                                [[[0., 0., 0.],
-                                  [0., 0., 0.],
-                                  [1., 1., 1.],
-                                  [1., 1., 1.]]],
-
-
-                                [[[1., 0., 0.],
+                                [[[0., 1., 1.],
+                                  [0., 1., 1.],
                                   [0., 0., 0.],
+                                  [0., 0., 0.]]],
+                                [[[0., 0., 0.],
                                   [0., 0., 0.],
-                                  [0., 0., 0.]]]])
+                                  [0., 1., 0.],
+                                  [0., 1., 0.]]]])
 
-        np.random.seed(43)
         training_tile = d._random_training_tile_by_polling(
                             size, channels, labels,
                             ensure_labelvalue=ensure_labelvalue)
@@ -923,17 +1329,16 @@ class TestDataset(TestCase):
                                   [0., 0., 0.],
                                   [0., 0., 0.]]],
                                 [[[0., 0., 0.],
-                                  [0., 1., 1.],
-                                  [0., 1., 1.],
+                                  [0., 1., 0.],
+                                  [0., 0., 0.],
                                   [0., 0., 0.]]],
                                 [[[0., 0., 0.],
                                   [0., 0., 0.],
                                   [0., 0., 0.],
-                                  [0., 1., 0.]]]])
+                                  [0., 0., 0.]]]])
 
         training_tile = d._random_training_tile_by_polling(
                             size, channels, labels,
                             ensure_labelvalue=None)
 
         assert_array_equal(training_tile.weights, weights_val)
-        np.random.seed(None)
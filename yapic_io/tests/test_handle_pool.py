@@ -0,0 +1,126 @@
+from unittest import TestCase
+import os
+import threading
+import numpy as np
+from yapic_io.handle_pool import HandlePool
+from yapic_io.tiff_connector import TiffConnector
+
+base_path = os.path.dirname(__file__)
+
+
+class TestHandlePool(TestCase):
+
+    def test_hits_and_misses(self):
+        pool = HandlePool(max_handles=2)
+        opened = []
+
+        def open_func():
+            opened.append(1)
+            return np.zeros(4)
+
+        a = pool.get('a', open_func)
+        self.assertIs(pool.get('a', open_func), a)
+
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(pool.hits, 1)
+        self.assertEqual(pool.misses, 1)
+
+    def test_evicts_least_recently_used(self):
+        pool = HandlePool(max_handles=2)
+
+        pool.get('a', lambda: np.zeros(4))
+        pool.get('b', lambda: np.zeros(4))
+        pool.get('a', lambda: np.zeros(4))
+        pool.get('c', lambda: np.zeros(4))
+
+        self.assertIn('a', pool)
+        self.assertNotIn('b', pool)
+        self.assertIn('c', pool)
+        self.assertEqual(len(pool), 2)
+
+    def test_byte_budget(self):
+        pool = HandlePool(max_handles=10, max_bytes=100)
+
+        pool.get('a', lambda: np.zeros(8))  # 64 bytes
+        pool.get('b', lambda: np.zeros(4))  # 32 bytes
+        self.assertEqual(pool.nbytes, 96)
+
+        pool.get('c', lambda: np.zeros(8))
+        self.assertEqual(list(pool._handles.keys()), ['b', 'c'])
+        self.assertEqual(pool.nbytes, 96)
+
+        # a single handle exceeding the budget is kept
+        pool.get('d', lambda: np.zeros(100))
+        self.assertEqual(list(pool._handles.keys()), ['d'])
+
+    def test_object_array_nbytes(self):
+        pool = HandlePool(max_handles=10)
+        planes = np.empty((1, 2), dtype=object)
+        planes[0, 0] = np.zeros((2, 2), dtype=np.uint8)
+        planes[0, 1] = np.zeros((2, 2), dtype=np.uint8)
+
+        pool.get('a', lambda: planes)
+        pool.get('b', lambda: None)
+        self.assertEqual(pool.nbytes, 8)
+
+    def test_close(self):
+        with HandlePool(max_handles=10) as pool:
+            pool.get('a', lambda: np.zeros(4))
+            self.assertEqual(len(pool), 1)
+
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.nbytes, 0)
+
+    def test_concurrent_open(self):
+        pool = HandlePool(max_handles=10)
+        results = []
+
+        def get():
+            results.append(pool.get('a', lambda: np.zeros(4)))
+
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(pool.hits + pool.misses, 8)
+        handle = pool._handles['a'][0]
+        self.assertTrue(all(r is handle for r in results))
+
+
+class TestConnectorHandlePool(TestCase):
+
+    def setUp(self):
+        self.img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        self.lbl_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+
+    def test_budget(self):
+        c = TiffConnector(self.img_path, self.lbl_path, max_open_files=2)
+
+        for image_nr in range(3):
+            c.get_tile(image_nr, (0, 0, 0, 0), (1, 1, 2, 2))
+
+        self.assertEqual(c.handle_pool.max_handles, 2)
+        self.assertEqual(len(c.handle_pool), 2)
+
+        c1, c2 = c.split(0.5)
+        self.assertEqual(c1.handle_pool.max_handles, 2)
+        self.assertIsNot(c1.handle_pool, c.handle_pool)
+
+    def test_context_manager(self):
+        with TiffConnector(self.img_path, self.lbl_path) as c:
+            tile = c.get_tile(2, (0, 0, 0, 0), (1, 1, 2, 2))
+            misses = c.handle_pool.misses
+            c.get_tile(2, (0, 0, 0, 0), (1, 1, 2, 2))
+            self.assertEqual(c.handle_pool.misses, misses)
+            self.assertGreater(len(c.handle_pool), 0)
+
+        self.assertEqual(len(c.handle_pool), 0)
+
+        # files are reopened on demand
+        np.testing.assert_array_equal(
+            c.get_tile(2, (0, 0, 0, 0), (1, 1, 2, 2)), tile)
@@ -1,6 +1,9 @@
+import gc
 import os
 import logging
-from unittest import TestCase
+import weakref
+import tempfile
+from unittest import TestCase, mock
 from yapic_io.ilastik_connector import IlastikConnector
 from numpy.testing import assert_array_equal
 import numpy as np
@@ -59,6 +62,13 @@ class TestIlastikConnector(TestCase):
         lbl_tile = c.label_tile(0, pos_czxy[1:], size_czxy[1:], lbl_value)
         assert_array_equal(lbl_tile, val)
 
+        # project image order is looked up once, not for each tile
+        with mock.patch.object(c.ilp, 'image_path_list') as m:
+            lbl_tiles = c.label_tiles(0, pos_czxy[1:], size_czxy[1:],
+                                      [lbl_value])
+            m.assert_not_called()
+        assert_array_equal(lbl_tiles[0], val)
+
     def test_label_count(self):
         c = self.setup_storage_version_12()
 
@@ -67,6 +77,25 @@ class TestIlastikConnector(TestCase):
 
         self.assertEqual(actual_counts, expected_counts)
 
+    def test_label_index(self):
+        img_path = os.path.join(base_path, '../test_data/ilastik')
+        lbl_path = os.path.join(
+            base_path, '../test_data/ilastik/ilastik-1.2.ilp')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_path = os.path.join(tmpdir, 'label_index.json')
+            c = IlastikConnector(img_path, lbl_path,
+                                 label_index_path=index_path)
+            self.assertTrue(os.path.isfile(index_path))
+
+            # label counts are loaded from the index
+            c2 = IlastikConnector(img_path, lbl_path,
+                                  label_index_path=index_path, lazy=True)
+            with mock.patch.object(c2, 'ilp') as m:
+                self.assertEqual(c2.label_count_for_image(0),
+                                 c.label_count_for_image(0))
+                m.__getitem__.assert_not_called()
+
     def test_constructor(self):
         img_path = os.path.join(
             base_path, '../test_data/ilastik/pixels_ilastik-multiim-1.2')
@@ -161,6 +190,27 @@ class TestIlastikConnector(TestCase):
         lbl = c.label_tile(0, (0, 0, 0), (1, 14, 9), 1)
         assert_array_equal(lbl[0, :13, 1:8], mat_val != 0)
 
+        lbls = c.label_tiles(0, (0, 0, 0), (1, 19, 17), [2, 1])
+        self.assertEqual(lbls.shape, (2, 1, 19, 17))
+        assert_array_equal(lbls[0], c.label_tile(0, (0, 0, 0), (1, 19, 17), 2))
+        assert_array_equal(lbls[1], c.label_tile(0, (0, 0, 0), (1, 19, 17), 1))
+
+        # label tiles are cached per connector
+        with mock.patch.object(c, '_original_label_tile') as m:
+            c.label_tile(0, (0, 0, 0), (1, 19, 17), 2)
+            m.assert_not_called()
+
+        c.max_label_tiles = 1
+        c.label_tile(0, (0, 0, 0), (1, 14, 9), 2)
+        self.assertEqual(list(c._label_tiles.keys()),
+                         [(0, (0, 0, 0), (1, 14, 9), 2)])
+
+        # the cache does not keep the connector alive
+        ref = weakref.ref(c)
+        del c
+        gc.collect()
+        self.assertIsNone(ref())
+
     def test_labels_for_ilastik_versions_12_133_are_equal(self):
 
         img_path = os.path.join(
@@ -189,7 +239,8 @@ class TestIlastikConnector(TestCase):
         print(c.filenames)
         print(c.image_count)
 
-        image_id = 0  # 769_cerebellum_5M41_subset_1.tif
+        image_id = [f.img.name for f in c.filenames].index(
+            '769_cerebellum_5M41_subset_1.tif')
         pos_zxy = (0, 309, 212)
         size_zxy = (1, 4, 5)
 
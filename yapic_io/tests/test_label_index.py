@@ -0,0 +1,128 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+import numpy as np
+from yapic_io.label_index import LabelIndex
+from yapic_io.tiff_connector import TiffConnector
+
+base_path = os.path.dirname(__file__)
+
+
+class TestLabelIndex(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmpdir.name, 'label_index.json')
+        self.img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        self.lbl_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_get(self):
+        fname = os.path.join(self.tmpdir.name, 'lbl.tif')
+        Path(fname).write_bytes(b'1234')
+
+        index = LabelIndex(self.index_path)
+        self.assertIsNone(index.get(fname))
+
+        index.put(fname, (1, 2, 4, 3), [{91: 3, 150: 2}, {5: 1}])
+        index.save()
+
+        index = LabelIndex(self.index_path)
+        stats = index.get(fname)
+        self.assertEqual(stats['shape'], [1, 2, 4, 3])
+        self.assertEqual(stats['counts'], [{91: 3, 150: 2}, {5: 1}])
+
+    def test_save_replaces_index_file(self):
+        fname = os.path.join(self.tmpdir.name, 'lbl.tif')
+        Path(fname).write_bytes(b'1234')
+
+        index = LabelIndex(self.index_path)
+        index.put(fname, (1, 1, 1, 1), [{1: 1}])
+        index.save()
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)),
+                         ['label_index.json', 'lbl.tif'])
+
+        # a failed write keeps the old index and removes the temporary file
+        index.put(fname, (1, 1, 1, 1), [{1: 2}])
+        with mock.patch('json.dump', side_effect=OSError):
+            with self.assertRaises(OSError):
+                index.save()
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)),
+                         ['label_index.json', 'lbl.tif'])
+        self.assertEqual(LabelIndex(self.index_path).get(fname)['counts'],
+                         [{1: 1}])
+
+    def test_changed_file_is_outdated(self):
+        fname = os.path.join(self.tmpdir.name, 'lbl.tif')
+        Path(fname).write_bytes(b'1234')
+
+        index = LabelIndex(self.index_path)
+        index.put(fname, (1, 1, 1, 1), [{1: 1}])
+
+        Path(fname).write_bytes(b'123456')
+        self.assertIsNone(index.get(fname))
+
+    def test_invalid_index_file_is_ignored(self):
+        Path(self.index_path).write_text('no json')
+
+        index = LabelIndex(self.index_path)
+        self.assertEqual(index.entries, {})
+
+    def test_connector_writes_index(self):
+        c = TiffConnector(self.img_path, self.lbl_path,
+                          label_index_path=self.index_path)
+
+        self.assertTrue(os.path.isfile(self.index_path))
+        self.assertEqual(len(c.label_index.entries), 2)
+
+    def test_connector_uses_index(self):
+        c = TiffConnector(self.img_path, self.lbl_path,
+                          label_index_path=self.index_path)
+        counts = [c.label_count_for_image(i) for i in range(3)]
+
+        with mock.patch.object(TiffConnector, '_open_label_file') as m:
+            c = TiffConnector(self.img_path, self.lbl_path,
+                              label_index_path=self.index_path)
+            counts_indexed = [c.label_count_for_image(i) for i in range(3)]
+            m.assert_not_called()
+
+        self.assertEqual(counts, counts_indexed)
+        self.assertEqual(c.labelvalue_mapping, [{91: 1, 109: 2, 150: 3}])
+        np.testing.assert_array_equal(c.label_matrix_dimensions(2),
+                                      (1, 3, 6, 4))
+
+    def test_connector_rescans_changed_files(self):
+        lbl_dir = os.path.join(self.tmpdir.name, 'labels')
+        shutil.copytree(os.path.dirname(self.lbl_path), lbl_dir)
+
+        c = TiffConnector(self.img_path, lbl_dir,
+                          label_index_path=self.index_path)
+        self.assertEqual(c.label_count_for_image(2), {2: 11, 3: 3})
+
+        # touch one label file
+        fname = os.path.join(lbl_dir, '6width4height3slices_rgb.tif')
+        stat = os.stat(fname)
+        os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        opened = []
+        open_label_file = TiffConnector._open_label_file
+
+        def _open_label_file(self, image_nr):
+            opened.append(image_nr)
+            return open_label_file(self, image_nr)
+
+        with mock.patch.object(TiffConnector, '_open_label_file',
+                               _open_label_file):
+            c = TiffConnector(self.img_path, lbl_dir,
+                              label_index_path=self.index_path)
+            self.assertEqual(c.label_count_for_image(2), {2: 11, 3: 3})
+
+        self.assertEqual(set(opened), {2})
+        self.assertFalse(c.label_index.is_modified)
@@ -0,0 +1,72 @@
+from unittest import TestCase
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.label_integral import LabelIntegral
+from yapic_io.utils import compute_pos
+
+
+class TestLabelIntegral(TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        # label mask with dimensions (z, x, y)
+        self.mask = np.random.choice([False] * 9 + [True], size=(3, 20, 17))
+        self.positions_zxy = np.argwhere(self.mask)
+
+    def test_counts(self):
+        integral = LabelIntegral.from_positions(self.positions_zxy,
+                                                self.mask.shape)
+        self.assertTrue(integral.exact)
+
+        size_zxy = (2, 4, 5)
+        positions = compute_pos(self.mask.shape, size_zxy, sliding=(1, 2, 2))
+        expected = [self.mask[z:z+2, x:x+4, y:y+5].sum()
+                    for z, x, y in positions]
+        assert_array_equal(integral.counts(positions, size_zxy), expected)
+
+    def test_count_of_whole_image(self):
+        integral = LabelIntegral.from_positions(self.positions_zxy,
+                                                self.mask.shape)
+        self.assertEqual(integral.count((0, 0, 0), self.mask.shape),
+                         self.mask.sum())
+        # tiles reaching out of the image are clipped
+        self.assertEqual(integral.count((1, 10, 10), (5, 50, 50)),
+                         self.mask[1:, 10:, 10:].sum())
+
+    def test_counts_downsampled(self):
+        integral = LabelIntegral.from_positions(self.positions_zxy,
+                                                self.mask.shape,
+                                                max_cells=100)
+        self.assertFalse(integral.exact)
+        self.assertTrue(np.prod(integral.grid_shape) <= 100)
+        self.assertEqual(integral.count((0, 0, 0), self.mask.shape),
+                         self.mask.sum())
+
+        size_zxy = (1, 3, 3)
+        positions = compute_pos(self.mask.shape, size_zxy, sliding=(1, 1, 1))
+        expected = np.array([self.mask[z:z+1, x:x+3, y:y+3].sum()
+                             for z, x, y in positions])
+        counts = integral.counts(positions, size_zxy)
+
+        # counts are upper bounds, 0 means no labels
+        self.assertTrue((counts >= expected).all())
+        self.assertTrue((expected[counts == 0] == 0).all())
+
+    def test_bounding_box(self):
+        positions_zxy = [(1, 4, 9), (1, 7, 3), (2, 5, 5)]
+        integral = LabelIntegral.from_positions(positions_zxy, (3, 20, 17))
+        start, stop = integral.bounding_box()
+        assert_array_equal(start, (1, 4, 3))
+        assert_array_equal(stop, (3, 8, 10))
+
+        # downsampled boxes contain the exact box
+        integral = LabelIntegral.from_positions(positions_zxy, (3, 20, 17),
+                                                max_cells=100)
+        start_ds, stop_ds = integral.bounding_box()
+        self.assertTrue((start_ds <= start).all())
+        self.assertTrue((stop_ds >= stop).all())
+
+    def test_without_labels(self):
+        integral = LabelIntegral.from_positions(np.zeros((0, 3)), (2, 5, 5))
+        self.assertEqual(integral.count((0, 0, 0), (2, 5, 5)), 0)
+        self.assertIsNone(integral.bounding_box())
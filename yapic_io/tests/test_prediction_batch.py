@@ -1,5 +1,5 @@
 import tempfile
-from unittest import TestCase
+from unittest import TestCase, mock
 import os
 from yapic_io.connector import io_connector
 import numpy as np
@@ -7,6 +7,7 @@ from numpy.testing import assert_array_almost_equal, assert_array_equal
 from yapic_io import TiffConnector, Dataset, PredictionBatch
 from bigtiff import Tiff
 from yapic_io.ilastik_connector import IlastikConnector
+from yapic_io.utils import compute_pos
 
 
 base_path = os.path.dirname(__file__)
@@ -135,6 +136,54 @@ class TestPredictionBatch(TestCase):
             assert_array_equal(pos[1], np.array(valpos[1]))
             self.assertEqual(pos[0], valpos[0])
 
+    def test_lazy_tile_positions(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path, '/path/to/nowhere')
+
+        c = TiffConnector(img_path, label_path, lazy=True)
+        d = Dataset(c, lazy=True)
+        p = PredictionBatch(d, 4, (1, 2, 2))
+
+        # first batch is computed from the dimensions of the first image
+        with mock.patch.object(d, 'image_dimensions',
+                               wraps=d.image_dimensions) as m:
+            positions = p[0].current_tile_positions
+            m.assert_called_once_with(0)
+        self.assertEqual([img_nr for img_nr, _ in positions], [0] * 4)
+
+        # batches span image borders
+        n_batches = len([item.current_tile_positions for item in p])
+        self.assertEqual(n_batches, len(p))
+        all_pos = [(img_nr, tuple(pos))
+                   for item in p for img_nr, pos in item.current_tile_positions]
+        val = [(img_nr, tuple(pos))
+               for img_nr in range(3)
+               for pos in compute_pos(d.image_dimensions(img_nr)[1:],
+                                      (1, 2, 2))]
+        self.assertEqual(all_pos, val)
+
+        with self.assertRaises(IndexError):
+            p[len(p)]
+
+    def test_lazy_prediction_does_not_read_labels(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        savepath = tempfile.TemporaryDirectory()
+
+        c = TiffConnector(img_path, label_path, savepath=savepath.name,
+                          lazy=True)
+        with mock.patch.object(c, '_open_label_file') as m:
+            p = PredictionBatch(Dataset(c, lazy=True), 4, (1, 2, 2))
+            for item in p:
+                pixels = item.pixels()
+                item.put_probmap_data(np.ones((len(pixels), 3, 1, 2, 2)))
+            m.assert_not_called()
+
+        self.assertIsNone(c._labelvalue_mapping)
+        self.assertTrue(os.path.isfile(os.path.join(
+            savepath.name, '6width4height3slices_rgb_class_3.tif')))
+
 
 
     def test_put_probmap_data(self):
@@ -1,13 +1,17 @@
+import gc
 import itertools
+import weakref
 from unittest import TestCase
 import os
 import numpy as np
 from numpy.testing import assert_array_equal
 from yapic_io.tiff_connector import TiffConnector
+from yapic_io.connector import Connector
 import yapic_io.tiff_connector as tc
 import logging
 import tempfile
 from pathlib import Path
+from unittest import mock
 logger = logging.getLogger(os.path.basename(__file__))
 
 base_path = os.path.dirname(__file__)
@@ -206,6 +210,41 @@ class TestTiffConnector(TestCase):
             v = c * 2 ** 3 + z * 2 ** 2 + y * 2 ** 1 + x * 2 ** 0
             np.testing.assert_array_equal(tile, [[[[v]]]])
 
+    def test_get_multichannel_tile(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/c2z2y2x2.tif')
+        conn = TiffConnector(img_path, 'path/to/nowhere/')
+
+        tile = conn.get_multichannel_tile(0, [1, 0], (0, 1, 0), (2, 1, 2))
+        expected = [[[[c * 2 ** 3 + z * 2 ** 2 + y * 2 ** 1 + x * 2 ** 0
+                       for y in range(2)]
+                      for x in range(1, 2)]
+                     for z in range(2)]
+                    for c in [1, 0]]
+        np.testing.assert_array_equal(tile, expected)
+
+        out = np.zeros((2, 2, 1, 2), dtype=np.float32)
+        res = conn.get_multichannel_tile(0, [1, 0], (0, 1, 0), (2, 1, 2),
+                                         out=out)
+        self.assertIs(res, out)
+        np.testing.assert_array_equal(out, expected)
+
+    def test_get_multichannel_tile_default(self):
+        # default implementation of the connector interface
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        conn = TiffConnector(img_path, 'path/to/nowhere/')
+
+        pos_zxy = (1, 2, 1)
+        size_zxy = (2, 3, 2)
+        expected = conn.get_multichannel_tile(2, [0, 2], pos_zxy, size_zxy)
+        res = Connector.get_multichannel_tile(conn, 2, [0, 2],
+                                              pos_zxy, size_zxy)
+
+        np.testing.assert_array_equal(res, expected)
+        np.testing.assert_array_equal(
+            res[1:], conn.get_tile(2, (2,) + pos_zxy, (1,) + size_zxy))
+
     def test_load_label_filenames(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -220,6 +259,64 @@ class TestTiffConnector(TestCase):
         self.assertEqual(c.filenames[2][1],
                          Path('6width4height3slices_rgb.tif'))
 
+    def test_label_tiles(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel/*.tif')
+        c = TiffConnector(img_path, label_path)
+
+        pos_zxy = (0, 1, 0)
+        size_zxy = (3, 4, 4)
+        label_values = [4, 2, 1, 6]
+
+        with mock.patch.object(c, '_open_label_file',
+                               wraps=c._open_label_file) as m:
+            tiles = c.label_tiles(2, pos_zxy, size_zxy, label_values)
+            m.assert_called_once_with(2)
+
+        self.assertEqual(tiles.shape, (4, 3, 4, 4))
+        self.assertEqual(tiles.dtype, bool)
+        for tile, label_value in zip(tiles, label_values):
+            assert_array_equal(
+                tile, c.label_tile(2, pos_zxy, size_zxy, label_value))
+
+        # default implementation of the connector interface
+        assert_array_equal(
+            tiles, Connector.label_tiles(c, 2, pos_zxy, size_zxy,
+                                         label_values))
+
+        # image without labels
+        self.assertFalse(c.label_tiles(1, pos_zxy, size_zxy, [1, 2]).any())
+
+    def test_label_index_to_coordinate(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel/*.tif')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_path = os.path.join(tmpdir, 'label_index.json')
+            c = TiffConnector(img_path, label_path,
+                              label_index_path=index_path)
+
+            for label_value, count in c.label_count_for_image(2).items():
+                for i in range(count):
+                    czxy = c.label_index_to_coordinate(2, label_value, i)
+                    self.assertTrue(
+                        c.label_tile(2, czxy[1:], (1, 1, 1), label_value))
+
+            # index is persisted and loaded by the next connector
+            self.assertTrue(c.coordinate_index_path.is_dir())
+            c2 = TiffConnector(img_path, label_path,
+                               label_index_path=index_path)
+            with mock.patch.object(c2, '_open_label_file') as m:
+                assert_array_equal(c2.label_index_to_coordinate(2, 2, 1),
+                                   c.label_index_to_coordinate(2, 2, 1))
+                m.assert_not_called()
+
     def test_label_tile(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -295,6 +392,21 @@ class TestTiffConnector(TestCase):
 
         self.assertEqual(count, {2: 11, 3: 3})
 
+        # label counts are loaded once per connector
+        with mock.patch.object(c, '_load_original_label_counts') as m:
+            self.assertEqual(c._original_label_counts(2),
+                             [{109: 11, 150: 3}])
+            self.assertIsNone(c._original_label_counts(1))
+            m.assert_not_called()
+
+        # label values and counts are cached per connector only
+        self.assertIs(c.original_label_values_for_all_images(),
+                      c.original_label_values_for_all_images())
+        ref = weakref.ref(c)
+        del c
+        gc.collect()
+        self.assertIsNone(ref())
+
     def test_put_tile_multichannel(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -481,6 +593,92 @@ class TestTiffConnector(TestCase):
         except FileNotFoundError:
             pass
 
+    def test_put_tiles(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        pixels = np.random.rand(2, 3, 2, 3, 2).astype(np.float32)
+        positions = [(2, (0, 1, 1)), (2, (1, 3, 2))]
+        labels = [1, 2, 3]
+
+        for multichannel in (False, 3):
+            with tempfile.TemporaryDirectory() as path_1, \
+                    tempfile.TemporaryDirectory() as path_2:
+                c = TiffConnector(img_path, 'path/to/nowhere/',
+                                  savepath=path_1)
+                c.put_tiles(pixels, positions, labels,
+                            multichannel=multichannel)
+
+                # default implementation of the connector interface
+                c_ref = TiffConnector(img_path, 'path/to/nowhere/',
+                                      savepath=path_2)
+                Connector.put_tiles(c_ref, pixels, positions, labels,
+                                    multichannel=multichannel)
+
+                for label in labels:
+                    C = label - 1 if multichannel else 0
+                    res = c._open_probability_map_file(2, label,
+                                                       multichannel)
+                    val = c_ref._open_probability_map_file(2, label,
+                                                           multichannel)
+                    for z in range(3):
+                        assert_array_equal(res[0, C, z], val[0, C, z])
+
+                assert_array_equal(res[0, C, 1][2:4, 3:6], pixels[1, 2, 0].T)
+                c.close()
+                c_ref.close()
+
+    def test_original_label_values_parallel(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel/*.tif')
+
+        c = TiffConnector(img_path, label_path, workers=2)
+
+        res = c.original_label_values_for_all_images()
+        self.assertEqual(res, [{91, 109, 150}, {91, 109, 150}])
+        self.assertEqual(c.labelvalue_mapping, [{91: 1, 109: 2, 150: 3},
+                                                {91: 4, 109: 5, 150: 6}])
+
+        c1, c2 = c.split(0.5)
+        self.assertEqual(c1.workers, 2)
+
+    def test_lazy(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel/*.tif')
+
+        with mock.patch.object(TiffConnector, '_open_label_file') as m1, \
+                mock.patch.object(TiffConnector, '_open_image_file') as m2:
+            c = TiffConnector(img_path, label_path, lazy=True)
+            m1.assert_not_called()
+            m2.assert_not_called()
+
+        self.assertIn('labelvalue_mapping: not loaded (lazy)', repr(c))
+        self.assertEqual(c.label_count_for_image(2),
+                         {2: 11, 3: 3, 5: 11, 6: 3})
+        self.assertEqual(c.labelvalue_mapping, [{91: 1, 109: 2, 150: 3},
+                                                {91: 4, 109: 5, 150: 6}])
+
+        c1, c2 = c.split(0.5)
+        self.assertTrue(c1.lazy)
+        self.assertEqual(c1.labelvalue_mapping, c.labelvalue_mapping)
+
+    def test_lazy_check_label_matrix_dimensions(self):
+        img_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel_not_valid/')
+
+        c = TiffConnector(img_path, label_path, lazy=True)
+        with self.assertRaises(AssertionError):
+            c.labelvalue_mapping
+
     def test_original_label_values(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
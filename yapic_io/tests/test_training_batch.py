@@ -1,11 +1,13 @@
 from unittest import TestCase
+from unittest import mock
 import os
 from yapic_io.tiff_connector import TiffConnector
 from yapic_io.ilastik_connector import IlastikConnector
 from yapic_io.cellvoy_connector import CellvoyConnector
 from yapic_io.dataset import Dataset
 
-from yapic_io.training_batch import TrainingBatch
+from yapic_io.training_batch import TrainingBatch, PrefetchingBatch
+from yapic_io.transformations import WarpIndexCache
 from pprint import pprint
 import numpy as np
 import tempfile
@@ -87,7 +89,25 @@ class TestTrainingBatch(TestCase):
         m = TrainingBatch(d, size, padding_zxy=pad)
         mini = next(m)
         p = mini._pixels
-        self.assertTrue(np.issubdtype(p.dtype, np.float))
+        self.assertTrue(np.issubdtype(p.dtype, np.floating))
+
+    def test_pixel_format_raw_pixels(self):
+        img_path = os.path.join(base_path,
+                                '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+        d.raw_pixels = True
+
+        m = TrainingBatch(d, (1, 3, 4), padding_zxy=(0, 1, 1))
+        m.set_normalize_mode('global', minmax=(0, 255))
+        mini = next(m)
+
+        self.assertEqual(mini._pixels.dtype, np.uint8)
+        self.assertEqual(mini.pixels().dtype, np.float32)
+        self.assertEqual(mini.weights().dtype, np.float32)
+        assert_array_almost_equal(mini.pixels(), mini._pixels / 255.)
 
     def test_random_tile(self):
 
@@ -105,6 +125,28 @@ class TestTrainingBatch(TestCase):
 
         m._random_tile(for_label=1)
 
+    def test_rng(self):
+        img_path = os.path.join(base_path,
+                                '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+
+        def batch_weights(random_seed):
+            d = Dataset(c, random_seed=random_seed)
+            m = TrainingBatch(d, (1, 3, 4), padding_zxy=(1, 2, 2))
+            m.augment_by_rotation(True)
+            return [next(m).weights() for _ in range(3)]
+
+        assert_array_equal(batch_weights(3), batch_weights(3))
+
+        d = Dataset(c)
+        rngs = d.spawn_rngs(2)
+        m1 = TrainingBatch(d, (1, 3, 4), rng=rngs[0])
+        m2 = TrainingBatch(d, (1, 3, 4), rng=rngs[1])
+        self.assertIs(m1.rng, rngs[0])
+        self.assertIs(m2.rng, rngs[1])
+
     def test_random_tile_cellvoy(self):
 
         data_dir = os.path.join(base_path, '../test_data/cellvoyager')
@@ -389,6 +431,57 @@ class TestTrainingBatch(TestCase):
         m.augment_by_flipping(False)
         self.assertEqual(m.augmentation, {'rotate', 'shear'})
 
+    def test_quantized_augmentation_with_warp_cache(self):
+
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+
+        def batches(warp_cache):
+            d = Dataset(c, random_seed=42)
+            d.warp_cache = warp_cache
+            m = TrainingBatch(d, (1, 3, 3), padding_zxy=(0, 2, 2))
+            m.augment_by_rotation(True, rotation_range=(1, 4), angle_step=1)
+            m.augment_by_shear(True, shear_range=(0, 2), angle_step=0.5)
+            return [next(m) for _ in range(5)]
+
+        cache = WarpIndexCache()
+        for mini, val in zip(batches(cache), batches(None)):
+            for params in mini.augmentations:
+                self.assertIn(params['rotation_angle'], [1, 2, 3, 4])
+                self.assertIn(params['shear_angle'], [0, 0.5, 1, 1.5, 2])
+            assert_array_equal(mini.pixels(), val.pixels())
+            assert_array_equal(mini.weights(), val.weights())
+        self.assertTrue(cache.hits > 0)
+
+    def test_label_masks(self):
+
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c, random_seed=42)
+        d.label_weights[2] = 2.5
+
+        m = TrainingBatch(d, (1, 3, 4), padding_zxy=(0, 2, 2))
+        m.augment_by_rotation(True, rotation_range=(10, 30))
+        next(m)
+
+        masks = m.label_masks()
+        self.assertEqual(masks.dtype, bool)
+        self.assertEqual(masks.shape, (3, 3, 1, 3, 4))
+        assert_array_equal(m.label_weights(), [1, 2.5, 1])
+
+        weights = m.weights()
+        self.assertEqual(weights.dtype, np.float32)
+        assert_array_equal(
+            weights, masks * m.label_weights()[:, None, None, None])
+
+        packed = m.label_masks(packed=True)
+        self.assertEqual(packed.shape, (3, 3, 1, 3, 1))
+        assert_array_equal(np.unpackbits(packed, axis=-1, count=4), masks)
+
     def test_set_pixel_dimension_order(self):
 
         img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
@@ -549,3 +642,63 @@ class TestTrainingBatch(TestCase):
         m = TrainingBatch(d, size, padding_zxy=pad)
 
         m.split(0.001)
+
+
+class TestPrefetchingBatch(TestCase):
+
+    def setUp(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        self.connector = TiffConnector(img_path, label_path)
+
+    def training_batch(self):
+        d = Dataset(self.connector, random_seed=42)
+        m = TrainingBatch(d, (1, 3, 4), padding_zxy=(0, 2, 2))
+        m.augment_by_rotation(True, rotation_range=(5, 20))
+        return m
+
+    def test_one_worker_equals_training_batch(self):
+        val = self.training_batch()
+        m = self.training_batch()
+        state = m.rng.bit_generator.state
+        with PrefetchingBatch(m, depth=3) as batches:
+            for _ in range(5):
+                mini = next(batches)
+                next(val)
+                assert_array_equal(mini.pixels(), val.pixels())
+                assert_array_equal(mini.weights(), val.weights())
+                self.assertEqual(mini.augmentations, val.augmentations)
+                self.assertIsNot(mini, m)
+
+        # workers do not use the source batch
+        self.assertEqual(m.rng.bit_generator.state, state)
+
+    def test_several_workers_are_reproducible(self):
+        runs = []
+        for _ in range(2):
+            with PrefetchingBatch(self.training_batch(), workers=3,
+                                  depth=2) as batches:
+                runs.append([next(batches).pixels() for _ in range(7)])
+
+        for pixels, val in zip(*runs):
+            assert_array_equal(pixels, val)
+        # workers draw different tiles
+        self.assertFalse(all((runs[0][0] == pixels).all()
+                             for pixels in runs[0][1:3]))
+
+    def test_worker_error(self):
+        m = self.training_batch()
+        with mock.patch.object(m, '_random_tile',
+                               side_effect=ValueError('broken')):
+            batches = PrefetchingBatch(m, workers=1, depth=2)
+            self.assertRaises(ValueError, next, batches)
+
+        self.assertFalse(any(t.is_alive() for t in batches._threads))
+        self.assertRaises(AssertionError, next, batches)
+
+    def test_close(self):
+        batches = PrefetchingBatch(self.training_batch(), workers=2, depth=1)
+        next(batches)
+        batches.close()
+        self.assertFalse(any(t.is_alive() for t in batches._threads))
@@ -196,3 +196,74 @@ class TestTransformations(TestCase):
         assert_array_equal(lr, lr_val)
         assert_array_equal(udlr, udlr_val)
         assert_array_equal(rot90, rot90val)
+
+    def test_warp_margin(self):
+        assert_array_equal(tf.warp_margin((100, 100), 0, 0), (0, 0))
+        margin = tf.warp_margin((100, 100), 45, 0)
+        # half the diagonal of the tile
+        self.assertTrue((margin >= 21).all())
+        self.assertTrue((margin < 100).all())
+
+    def test_warp_tile_2d_stack(self):
+        np.random.seed(42)
+        im = np.random.rand(2, 3, 30, 30)
+        tile_shape = np.array((10, 10))
+
+        margin = tf.warp_margin(tile_shape, 20, 3)
+        mx, my = margin
+        tile = tf.warp_tile_2d_stack(im[:, :, 10-mx:20+mx, 10-my:20+my],
+                                     20, 3, margin)
+        self.assertEqual(tile.shape, (2, 3, 10, 10))
+
+        # equal to warping the 3 times larger tile and cropping the center
+        val = tf.warp_image_2d_stack(im, 20, 3)[:, :, 10:20, 10:20]
+        assert_array_equal(tile, val)
+
+    def test_warp_tile_2d_stack_with_shape(self):
+        np.random.seed(42)
+        im = np.random.rand(1, 12, 9)
+
+        tile = tf.warp_tile_2d_stack(im, 10, 0, (4, 3), shape_xy=(4, 3))
+        self.assertEqual(tile.shape, (1, 4, 3))
+        # source pixels are taken from the region around the tile
+        self.assertTrue(np.isin(tile, im[:, 2:10, 1:8]).all())
+
+    def test_warp_image_2d_stack_equals_slices(self):
+        np.random.seed(42)
+        im = np.random.rand(2, 3, 11, 8)
+
+        warped = tf.warp_image_2d_stack(im, 30, 5)
+        self.assertEqual(warped.shape, im.shape)
+        self.assertEqual(warped.dtype, im.dtype)
+        for c in range(2):
+            for z in range(3):
+                assert_array_equal(warped[c, z],
+                                   tf.warp_image_2d(im[c, z], 30, 5))
+
+    def test_warp_index_cache(self):
+        np.random.seed(42)
+        im = np.random.rand(2, 3, 30, 26)
+        cache = tf.WarpIndexCache()
+
+        for angle in (10, 20, 10):
+            assert_array_equal(
+                cache.warp_tile_2d_stack(im, angle, 2, (8, 6)),
+                tf.warp_tile_2d_stack(im, angle, 2, (8, 6)))
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_warp_index_cache_max_bytes(self):
+        im = np.zeros((1, 30, 30))
+        nbytes = tf.WarpIndexCache().flat_indices((30, 30), 10, 0, (5, 5),
+                                                  (20, 20)).nbytes
+        cache = tf.WarpIndexCache(max_bytes=2 * nbytes)
+
+        for angle in (10, 20, 30):
+            cache.warp_tile_2d_stack(im, angle, 0, (5, 5))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 2 * nbytes)
+
+        # least recently used indices are dropped
+        cache.warp_tile_2d_stack(im, 10, 0, (5, 5))
+        self.assertEqual(cache.misses, 4)
@@ -191,3 +191,76 @@ class TestUtils(TestCase):
 
         pairs = ut.find_best_matching_pairs(a, b)
         self.assertEqual(pairs, val)
+
+    def test_count_label_values(self):
+        lbl = np.array([[[0, 3, 3],
+                         [1, 0, 3]],
+                        [[0, 0, 1],
+                         [0, 0, 0]]], dtype=np.uint16)
+
+        self.assertEqual(ut.count_label_values(lbl), {1: 2, 3: 3})
+        self.assertEqual(ut.count_label_values(lbl.astype(np.int32)),
+                         {1: 2, 3: 3})
+        self.assertEqual(ut.count_label_values(lbl.astype(float)),
+                         {1: 2, 3: 3})
+        self.assertEqual(ut.count_label_values(lbl.astype(np.uint64)),
+                         {1: 2, 3: 3})
+        self.assertEqual(ut.count_label_values([]), {})
+
+    def test_count_label_values_fallback(self):
+        lbl = np.array([[[0, 3, 2 ** 30],
+                         [-1, 0, 3]],
+                        [[0, 0, 2 ** 30],
+                         [0, 0, 0]]], dtype=np.int64)
+
+        res = ut.count_label_values(lbl)
+        self.assertEqual(res, {3: 2, 2 ** 30: 2})
+
+        # mixed bincount and fallback slices
+        lbl[0, 0, 2] = 3
+        lbl[0, 1, 0] = 0
+        res = ut.count_label_values(lbl)
+        self.assertEqual(res, {3: 3, 2 ** 30: 1})
+
+        # negative values are not counted, also not in bincount slices
+        lbl = np.array([[[-2, 1, 1], [0, -2, 2]]], dtype=np.int32)
+        self.assertEqual(ut.count_label_values(lbl), {1: 2, 2: 1})
+
+    def test_parallel_map(self):
+        items = [3, 1, 2, 5, 4]
+
+        def func(x):
+            return x ** 2
+
+        self.assertEqual(ut.parallel_map(func, items), [9, 1, 4, 25, 16])
+        self.assertEqual(ut.parallel_map(func, items, workers=3),
+                         [9, 1, 4, 25, 16])
+        self.assertEqual(ut.parallel_map(func, [], workers=3), [])
+
+    def test_parallel_map_raises(self):
+
+        def func(x):
+            raise ValueError(x)
+
+        with self.assertRaises(ValueError):
+            ut.parallel_map(func, [1, 2], workers=2)
+
+    def test_random_split_mask(self):
+        state = np.random.get_state()
+        mask = ut.random_split_mask(20, 0.25, random_seed=42)
+        self.assertEqual(mask.dtype, bool)
+        self.assertEqual(len(mask), 20)
+        # global random state is not touched
+        assert_array_equal(np.random.get_state()[1], state[1])
+
+        # integer seeds give the same split as np.random.seed
+        np.random.seed(42)
+        expected = np.random.choice([True, False], size=20, p=[0.75, 0.25])
+        np.random.set_state(state)
+        assert_array_equal(mask, expected)
+
+        rng_mask_1 = ut.random_split_mask(
+            20, 0.25, random_seed=np.random.SeedSequence(1))
+        rng_mask_2 = ut.random_split_mask(
+            20, 0.25, random_seed=np.random.default_rng(1))
+        assert_array_equal(rng_mask_1, rng_mask_2)
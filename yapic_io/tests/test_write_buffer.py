@@ -0,0 +1,135 @@
+from unittest import TestCase
+import os
+import tempfile
+import numpy as np
+from numpy.testing import assert_array_equal
+from bigtiff import Tiff
+from yapic_io.write_buffer import WriteBuffer, write_tiles
+from yapic_io.tiff_connector import TiffConnector
+from yapic_io.dataset import Dataset
+from yapic_io.prediction_batch import PredictionBatch
+
+base_path = os.path.dirname(__file__)
+
+
+class TestWriteBuffer(TestCase):
+
+    def test_write_tiles(self):
+        plane = np.zeros((4, 6))
+        tiles = [((0, 0), np.ones((2, 3))),
+                 ((0, 3), 2 * np.ones((2, 3))),
+                 ((2, 0), 3 * np.ones((2, 3)))]
+        write_tiles(plane, tiles)
+
+        val = [[1, 1, 1, 2, 2, 2],
+               [1, 1, 1, 2, 2, 2],
+               [3, 3, 3, 0, 0, 0],
+               [3, 3, 3, 0, 0, 0]]
+        assert_array_equal(plane, val)
+
+    def test_write_tiles_keeps_order_and_gaps(self):
+        plane = np.full((3, 5), -1.)
+        tiles = [((0, 0), np.ones((2, 2))),
+                 ((1, 1), 2 * np.ones((2, 2))),
+                 ((0, 3), 3 * np.ones((1, 2)))]
+        write_tiles(plane, tiles)
+
+        val = [[1, 1, -1, 3, 3],
+               [1, 2, 2, -1, -1],
+               [-1, 2, 2, -1, -1]]
+        assert_array_equal(plane, val)
+
+    def test_write_sparse_tiles(self):
+        plane = np.zeros((100, 100))
+        tiles = [((0, 0), np.ones((2, 2))),
+                 ((98, 98), 2 * np.ones((2, 2)))]
+        write_tiles(plane, tiles)
+
+        self.assertEqual(plane.sum(), 12)
+        self.assertEqual(plane[99, 99], 2)
+
+    def test_flush(self):
+        out = {'a': np.zeros((2, 2, 2)), 'b': np.zeros((2, 2, 2))}
+        buf = WriteBuffer(max_bytes=64)
+
+        buf.put('a', (0,), (0, 0), np.ones((2, 2)))
+        buf.put('b', (1,), (0, 0), np.ones((2, 2)))
+        self.assertEqual(len(buf), 2)
+        self.assertEqual(buf.nbytes, 64)
+        self.assertFalse(buf.is_full())
+
+        buf.put('b', (1,), (0, 0), np.ones((1, 1)))
+        self.assertTrue(buf.is_full())
+
+        buf.flush(out.get, 'a')
+        self.assertFalse(buf.pending('a'))
+        self.assertTrue(buf.pending('b'))
+        self.assertEqual(out['a'].sum(), 4)
+        self.assertEqual(out['b'].sum(), 0)
+
+        buf.flush(out.get)
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(buf.nbytes, 0)
+        self.assertEqual(out['b'].sum(), 4)
+
+
+class TestConnectorWriteBuffer(TestCase):
+
+    def setUp(self):
+        self.img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read_probmap(self, fname):
+        slices = Tiff.memmap_tcz(os.path.join(self.tmpdir.name, fname))
+        return np.array([[s for s in slices[0, 0]]])
+
+    def test_put_tile_is_buffered(self):
+        c = TiffConnector(self.img_path, 'some/path',
+                          savepath=self.tmpdir.name)
+        pixels = np.ones((1, 2, 3), dtype=np.float32)
+        c.put_tile(pixels, pos_zxy=(0, 1, 1), image_nr=2, label_value=1)
+
+        fname = '6width4height3slices_rgb_class_1.tif'
+        self.assertEqual(self.read_probmap(fname).sum(), 0)
+        self.assertEqual(len(c.write_buffer), 1)
+
+        c.flush()
+        self.assertEqual(self.read_probmap(fname).sum(), 6)
+        self.assertEqual(len(c.write_buffer), 0)
+
+    def test_put_tile_unbuffered(self):
+        c = TiffConnector(self.img_path, 'some/path',
+                          savepath=self.tmpdir.name, max_buffered_bytes=0)
+        pixels = np.ones((1, 2, 3), dtype=np.float32)
+        c.put_tile(pixels, pos_zxy=(0, 1, 1), image_nr=2, label_value=1)
+
+        fname = '6width4height3slices_rgb_class_1.tif'
+        self.assertEqual(self.read_probmap(fname).sum(), 6)
+
+    def test_close_flushes(self):
+        with TiffConnector(self.img_path, 'some/path',
+                           savepath=self.tmpdir.name) as c:
+            pixels = np.ones((1, 2, 3), dtype=np.float32)
+            c.put_tile(pixels, pos_zxy=(0, 1, 1), image_nr=2, label_value=1)
+
+        fname = '6width4height3slices_rgb_class_1.tif'
+        self.assertEqual(self.read_probmap(fname).sum(), 6)
+
+    def test_prediction_batch_flushes(self):
+        c = TiffConnector(self.img_path, 'some/path',
+                          savepath=self.tmpdir.name)
+        p = PredictionBatch(Dataset(c), 2, (1, 2, 2))
+        p.multichannel_output_on()
+
+        for i, item in enumerate(p):
+            item.put_probmap_data(np.ones((2, 2, 1, 2, 2)))
+            if i == 3:
+                break
+
+        self.assertEqual(len(c.write_buffer), 0)
+        fname = '40width26height3slices_rgb.tif'
+        self.assertEqual(self.read_probmap(fname).sum(), 4 * 2 * 4)
@@ -1,15 +1,19 @@
 import logging
 import os
 import collections
-from functools import lru_cache
 import yapic_io.utils as ut
 import numpy as np
 import itertools
+import threading
 import warnings
 from itertools import zip_longest
 from pathlib import Path
 from bigtiff import Tiff, PlaceHolder
-from yapic_io.connector import Connector
+from yapic_io.coordinate_connector import CoordinateConnector
+from yapic_io.coordinate_index import LabelCoordinateIndex
+from yapic_io.handle_pool import HandlePool
+from yapic_io.label_index import LabelIndex
+from yapic_io.write_buffer import WriteBuffer
 
 logger = logging.getLogger(os.path.basename(__file__))
 
@@ -61,7 +65,7 @@ def _handle_img_filenames(img_filepath):
     return folder, filenames
 
 
-class TiffConnector(Connector):
+class TiffConnector(CoordinateConnector):
     '''
     Implementation of Connector for tiff images up to 4 dimensions and
     corresponding label masks up to 4 dimensions in tiff format.
@@ -77,6 +81,34 @@ class TiffConnector(Connector):
     savepath : str, optional
         Directory to save pixel classifiaction results as probability
         images.
+    label_index_path : str, optional
+        Path to a sidecar file for persisting label statistics (label values,
+        label counts and label matrix shapes). If given, label files are
+        only scanned if they are not yet indexed or have changed since
+        indexing. Label coordinate indices (see
+        `label_index_to_coordinate`) are persisted in the directory
+        `<label_index_path>.coordinates`.
+    workers : int, optional
+        Nr of threads for reading label values, label counts and image
+        dimensions of all images at construction. At most `workers` images
+        are read at the same time. Default is 1 (no parallelization).
+    lazy : bool, optional
+        If True, only filenames are resolved at construction. Label values,
+        the labelvalue mapping and the label matrix dimension check are
+        computed the first time they are needed (e.g. when accessing
+        `labelvalue_mapping`, label counts or label tiles). Useful for
+        prediction jobs on large image collections.
+    max_open_files : int, optional
+        Maximum nr of image, label and probability map files kept open
+        (memmapped) at the same time. Default is derived from the limit of
+        open file descriptors of the process.
+    max_mapped_bytes : int, optional
+        Maximum nr of bytes of all open files. Default is derived from the
+        address space limit of the process (unlimited if the address space
+        is not limited).
+    max_buffered_bytes : int, optional
+        Budget of the write-back buffer for probability map tiles
+        (see `put_tile`). Default is 256 MiB, 0 disables buffering.
 
     Notes
     -----
@@ -88,6 +120,10 @@ class TiffConnector(Connector):
     output layer. Different labels from different channels can overlap
     (can share identical xyz positions).
 
+    Open files are managed by the connector's `handle_pool`. Use the
+    connector as a context manager (or call `close()`) to release
+    all files.
+
     Examples
     --------
     Create a TiffConnector object with pixel and label data.
@@ -103,12 +139,22 @@ class TiffConnector(Connector):
     nr of images: 3
     labelvalue_mapping: [{91: 1, 109: 2, 150: 3}]
 
+    Files are released when leaving the context.
+
+    >>> with TiffConnector(pixel_image_dir, label_image_dir) as t:
+    ...     tile = t.get_tile(0, (0, 0, 0, 0), (1, 1, 2, 2))
+    >>> len(t.handle_pool)
+    0
+
     See Also
     --------
     yapic_io.ilastik_connector.IlastikConnector
     '''
 
-    def __init__(self, img_filepath, label_filepath, savepath=None):
+    def __init__(self, img_filepath, label_filepath, savepath=None,
+                 label_index_path=None, workers=1, lazy=False,
+                 max_open_files=None, max_mapped_bytes=None,
+                 max_buffered_bytes=None):
 
         self.img_path, img_filenames = _handle_img_filenames(img_filepath)
         self.label_path, lbl_filenames = self._handle_lbl_filenames(
@@ -129,12 +175,54 @@ class TiffConnector(Connector):
                               for pair in self.filenames))
 
         self.savepath = Path(savepath) if savepath is not None else None
+        self.workers = workers
+        self.lazy = lazy
+        self.handle_pool = HandlePool(max_handles=max_open_files,
+                                      max_bytes=max_mapped_bytes)
+        self.write_buffer = WriteBuffer(max_bytes=max_buffered_bytes)
+        self.label_index = LabelIndex(label_index_path) \
+            if label_index_path is not None else None
+
+        # per image label counts, see _original_label_counts()
+        self._label_count_cache = {}
+        # see original_label_values_for_all_images()
+        self._original_label_values = None
+        # label coordinate indices of the most recently used images, see
+        # _label_coordinate_index()
+        self.max_coordinate_indices = 16
+        self._label_coordinate_indices = collections.OrderedDict()
+        self._coordinate_index_lock = threading.RLock()
+
+        self._labelvalue_mapping = None
+        self._label_metadata_lock = threading.RLock()
+        if not lazy:
+            self._load_label_metadata()
+
+    def _load_label_metadata(self):
+        with self._label_metadata_lock:
+            if self._labelvalue_mapping is not None:
+                return
+
+            original_labels = self.original_label_values_for_all_images()
+            mapping = self.calc_label_values_mapping(original_labels)
+
+            self.check_label_matrix_dimensions()
+            self._labelvalue_mapping = mapping
+
+    @property
+    def labelvalue_mapping(self):
+        '''
+        Mapping of original label values to unique label values, see
+        calc_label_values_mapping(). For lazy connectors, label values are
+        read from the label files on first access.
+        '''
+        if self._labelvalue_mapping is None:
+            self._load_label_metadata()
+        return self._labelvalue_mapping
 
-        original_labels = self.original_label_values_for_all_images()
-        self.labelvalue_mapping = self.calc_label_values_mapping(
-                                            original_labels)
-
-        self.check_label_matrix_dimensions()
+    @labelvalue_mapping.setter
+    def labelvalue_mapping(self, mapping):
+        self._labelvalue_mapping = mapping
 
     def _assemble_filenames(self, pairs):
         self.filenames = [FilePair(Path(img), Path(lbl) if lbl else None)
@@ -143,6 +231,24 @@ class TiffConnector(Connector):
     def _handle_lbl_filenames(self, label_filepath):
         return _handle_img_filenames(label_filepath)
 
+    @property
+    def label_index_path(self):
+        if self.label_index is None:
+            return None
+        return self.label_index.path
+
+    @property
+    def coordinate_index_path(self):
+        if self.label_index is None:
+            return None
+        path = self.label_index.path
+        return path.with_name(path.name + '.coordinates')
+
+    def _labelvalue_mapping_repr(self):
+        if self._labelvalue_mapping is None:
+            return 'not loaded (lazy)'
+        return self._labelvalue_mapping
+
     def __repr__(self):
 
         infostring = \
@@ -153,7 +259,7 @@ class TiffConnector(Connector):
             'labelvalue_mapping: {}'.format(self.img_path,
                                             self.label_path,
                                             self.image_count(),
-                                            self.labelvalue_mapping)
+                                            self._labelvalue_mapping_repr())
         return infostring
 
     def filter_labeled(self):
@@ -172,18 +278,20 @@ class TiffConnector(Connector):
                       for img, lbl in self.filenames
                       if lbl is not None]
 
-        return TiffConnector(img_fnames, lbl_fnames, savepath=self.savepath)
+        return TiffConnector(img_fnames, lbl_fnames, savepath=self.savepath,
+                             label_index_path=self.label_index_path,
+                             workers=self.workers,
+                             lazy=self.lazy,
+                             max_open_files=self.handle_pool.max_handles,
+                             max_mapped_bytes=self.handle_pool.max_bytes,
+                             max_buffered_bytes=self.write_buffer.max_bytes)
 
     def _split_img_fnames(self, fraction, random_seed=42):
         # i took this out from the split method to be used in split method
         # of child methods (e.g. IlasikConnector)
         N = len(self.filenames)
 
-        state = np.random.get_state()
-        np.random.seed(random_seed)
-        mask = np.random.choice([True, False], size=N, p=[
-                                1 - fraction, fraction])
-        np.random.set_state(state)
+        mask = ut.random_split_mask(N, fraction, random_seed=random_seed)
 
         img_fnames1 = [self.img_path / img
                        for img, lbl in itertools.compress(self.filenames,
@@ -215,7 +323,7 @@ class TiffConnector(Connector):
         Parameters
         ----------
         fraction : float
-        random_seed : float, optional
+        random_seed : int, numpy.random.SeedSequence or Generator, optional
 
         Returns
         -------
@@ -233,8 +341,20 @@ class TiffConnector(Connector):
                        for img, lbl in itertools.compress(self.filenames,
                                                           ~mask)]
 
-        conn1 = TiffConnector(img_fnames1, lbl_fnames1, savepath=self.savepath)
-        conn2 = TiffConnector(img_fnames2, lbl_fnames2, savepath=self.savepath)
+        conn1 = TiffConnector(img_fnames1, lbl_fnames1, savepath=self.savepath,
+                              label_index_path=self.label_index_path,
+                              workers=self.workers,
+                              lazy=self.lazy,
+                              max_open_files=self.handle_pool.max_handles,
+                              max_mapped_bytes=self.handle_pool.max_bytes,
+                              max_buffered_bytes=self.write_buffer.max_bytes)
+        conn2 = TiffConnector(img_fnames2, lbl_fnames2, savepath=self.savepath,
+                              label_index_path=self.label_index_path,
+                              workers=self.workers,
+                              lazy=self.lazy,
+                              max_open_files=self.handle_pool.max_handles,
+                              max_mapped_bytes=self.handle_pool.max_bytes,
+                              max_buffered_bytes=self.write_buffer.max_bytes)
 
         # ensures that both resulting tiff_connectors have the same
         # labelvalue mapping (issue #1)
@@ -247,12 +367,46 @@ class TiffConnector(Connector):
     def image_count(self):
         return len(self.filenames)
 
-    @lru_cache(maxsize=10)
+    def _progress_msg(self, msg):
+        # progress is only shown for parallel reading of large collections
+        return msg if self.workers > 1 else None
+
+    def close(self):
+        '''
+        Write buffered probability map tiles and release all open image,
+        label and probability map files.
+        '''
+        self.flush()
+        self.handle_pool.close()
+
+    def flush(self):
+        '''
+        Write all buffered probability map tiles to disk.
+        '''
+        self.write_buffer.flush(self._probability_map_handle)
+
     def _open_probability_map_file(self,
                                    image_nr,
                                    label_value,
                                    multichannel=False):
-        # memmap is slow, so we must cache it to be fast!
+        # buffered tiles are written first, so the returned probability
+        # map is up to date
+        target = self._probability_map_target(image_nr, label_value,
+                                              multichannel)
+        if self.write_buffer.pending(target):
+            self.write_buffer.flush(self._probability_map_handle, target)
+        return self._probability_map_handle(target)
+
+    @staticmethod
+    def _probability_map_target(image_nr, label_value, multichannel):
+        # all labels share one file in multichannel mode
+        if multichannel:
+            return image_nr, None, multichannel
+        return image_nr, label_value, False
+
+    def _probability_map_handle(self, target):
+        # memmap is slow, so we must keep it open to be fast!
+        image_nr, label_value, multichannel = target
         fname = self.filenames[image_nr].img
         T = 1  # time frame in output probmap
         if multichannel:
@@ -265,12 +419,14 @@ class TiffConnector(Connector):
 
         path = self.savepath / fname
 
-        if not path.exists():
-            _, Z, X, Y = self.image_dimensions(image_nr)
-            images = [PlaceHolder((Y, X, C), 'float32')] * Z
-            Tiff.write(images, io=str(path), imagej_shape=(T, C, Z))
+        def open_file():
+            if not path.exists():
+                _, Z, X, Y = self.image_dimensions(image_nr)
+                images = [PlaceHolder((Y, X, C), 'float32')] * Z
+                Tiff.write(images, io=str(path), imagej_shape=(T, C, Z))
+            return Tiff.memmap_tcz(path)
 
-        return Tiff.memmap_tcz(path)
+        return self.handle_pool.get(('probability_map', path), open_file)
 
     def put_tile(self,
                  pixels,
@@ -278,29 +434,91 @@ class TiffConnector(Connector):
                  image_nr,
                  label_value,
                  multichannel=False):
+        '''
+        Put probabilities for a certain label to the probability map.
 
-        assert self.savepath is not None
+        Tiles are collected in a write-back buffer and written to disk
+        in large contiguous blocks when the buffer is full, when
+        `flush()` or `close()` is called. Call `flush()` after the
+        last tile.
+
+        Parameters
+        ----------
+        pixels : numpy.ndarray
+            3D matrix of probability values with shape (z, x, y)
+        pos_zxy : (z, x, y)
+            Upper left position of pixels in source image_nr.
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label.
+        multichannel : int or bool, optional
+            Nr of classes if probabilities are saved in one multichannel
+            image, one channel for each label. False (default) for one
+            image per label.
+        '''
         np.testing.assert_equal(len(pos_zxy), 3)
         np.testing.assert_equal(len(pixels.shape), 3)
-        pixels = np.array(pixels, dtype=np.float32)
 
-        slices = self._open_probability_map_file(image_nr,
-                                                 label_value,
-                                                 multichannel=multichannel)
+        self.put_tiles(np.asarray(pixels)[np.newaxis, np.newaxis],
+                       [(image_nr, pos_zxy)],
+                       [label_value],
+                       multichannel=multichannel)
 
-        T = C = 0
-        if multichannel:
-            C = label_value - 1
-        Z, X, Y = pos_zxy
-        ZZ, XX, YY = np.array(pos_zxy) + pixels.shape
-        for z in range(Z, ZZ):
-            slices[T, C, z][Y:YY, X:XX] = pixels[z - Z, ...].T
+    def put_tiles(self, pixels, positions, label_values, multichannel=False):
+        '''
+        Put probabilities of several tiles and labels to the probability
+        maps.
+
+        All tiles are converted to float32 and transposed to the (y, x)
+        layout of the tiff planes at once and passed to the write-back
+        buffer (see `put_tile`).
+
+        Parameters
+        ----------
+        pixels : numpy.ndarray
+            5D matrix of probability values with shape
+            (nr_tiles, nr_labels, z, x, y).
+        positions : list of (image_nr, (z, x, y))
+            Image index and upper left position of each tile.
+        label_values : list of int
+            Ids of the labels, one for each label layer of `pixels`.
+        multichannel : int or bool, optional
+            Nr of classes if probabilities are saved in one multichannel
+            image, one channel for each label. False (default) for one
+            image per label.
+        '''
+        assert self.savepath is not None
+        np.testing.assert_equal(len(pixels.shape), 5)
+        np.testing.assert_equal(len(positions), pixels.shape[0])
+        np.testing.assert_equal(len(label_values), pixels.shape[1])
+
+        # one copy for all tiles, the buffer keeps references to it
+        pixels_yx = np.array(np.swapaxes(pixels, 3, 4), dtype=np.float32,
+                             order='C')
+
+        T = 0
+        for tile, (image_nr, (Z, X, Y)) in zip(pixels_yx, positions):
+            for label_tile, label_value in zip(tile, label_values):
+                C = label_value - 1 if multichannel else 0
+                target = self._probability_map_target(image_nr, label_value,
+                                                      multichannel)
+                # the output file is created at once, only writing is
+                # deferred
+                self._probability_map_handle(target)
+                for z, plane in enumerate(label_tile, start=Z):
+                    self.write_buffer.put(target, (T, C, z), (Y, X), plane)
+
+        if self.write_buffer.is_full():
+            self.flush()
 
-    @lru_cache(maxsize=10)
     def _open_image_file(self, image_nr):
-        # memmap is slow, so we must cache it to be fast!
-        path = self.img_path / self.filenames[image_nr].img
-        return Tiff.memmap_tcz(path)
+        # memmap is slow, so we must keep it open to be fast!
+        def open_file():
+            path = self.img_path / self.filenames[image_nr].img
+            return Tiff.memmap_tcz(path)
+
+        return self.handle_pool.get(('image', image_nr), open_file)
 
     def image_dimensions(self, image_nr):
 
@@ -323,10 +541,16 @@ class TiffConnector(Connector):
         (nr_channels, nr_zslices, nr_x, nr_y)
             Labelmatrix shape.
         '''
-        lbl = self._open_label_file(image_nr)
-        if lbl is None:
+        label_filename = self.filenames[image_nr].lbl
+        if label_filename is None:
             return
 
+        if self.label_index is not None:
+            stats = self.label_index.get(self.label_path / label_filename)
+            if stats is not None:
+                return np.array(stats['shape'])
+
+        lbl = self._open_label_file(image_nr)
         Y, X = lbl[0, 0, 0].shape
         return np.hstack([lbl.shape[1:], (X, Y)])
 
@@ -342,9 +566,17 @@ class TiffConnector(Connector):
         '''
         N_channels = None
 
-        for i, (img_fname, lbl_fname) in enumerate(self.filenames):
-            img_dim = self.image_dimensions(i)
-            lbl_dim = self.label_matrix_dimensions(i)
+        def dimensions(image_nr):
+            return (self.image_dimensions(image_nr),
+                    self.label_matrix_dimensions(image_nr))
+
+        dims = ut.parallel_map(dimensions,
+                               range(self.image_count()),
+                               workers=self.workers,
+                               msg=self._progress_msg('Check dimensions: '))
+
+        for i, ((img_fname, lbl_fname), (img_dim, lbl_dim)) in \
+                enumerate(zip(self.filenames, dims)):
 
             msg = 'Dimensions for image #{}: img.shape={}, lbl.shape={}'
             logger.debug(msg.format(i, img_dim, lbl_dim))
@@ -378,40 +610,65 @@ class TiffConnector(Connector):
         raise Exception(msg.format(label_value, self.labelvalue_mapping))
 
     def get_tile(self, image_nr, pos, size):
+        C, *pos_zxy = pos
+        CC = C + size[0]
+
+        return self.get_multichannel_tile(image_nr, range(C, CC),
+                                          pos_zxy, size[1:])
+
+    def get_multichannel_tile(self, image_nr, channels, pos_zxy, size_zxy,
+                              out=None, dtype=np.float32):
         T = 0
-        C, Z, X, Y = pos
-        CC, ZZ, XX, YY = np.array(pos) + size
+        Z, X, Y = pos_zxy
+        ZZ, XX, YY = np.array(pos_zxy) + size_zxy
 
         slices = self._open_image_file(image_nr)
-        tile = [[s[Y:YY, X:XX] for s in c[Z:ZZ]] for c in slices[T, C:CC, :]]
-        tile = np.stack(tile)
-        tile = np.moveaxis(tile, (0, 1, 2, 3), (0, 1, 3, 2))
 
-        return tile.astype('float')
+        if out is None:
+            if dtype is None:
+                dtype = slices[T, 0, 0].dtype
+            out = np.empty((len(channels),) + tuple(size_zxy), dtype=dtype)
+
+        # one strided copy (incl. transpose and type conversion) per
+        # memmapped yx-plane, directly into the output array
+        for i, c in enumerate(channels):
+            for j, s in enumerate(slices[T, c, Z:ZZ]):
+                out[i, j] = s[Y:YY, X:XX].T
+
+        return out
 
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
 
+        return self.label_tiles(image_nr, pos_zxy, size_zxy, [label_value])[0]
+
+    def label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+
         T = 0
         Z, X, Y = pos_zxy
         ZZ, XX, YY = np.array(pos_zxy) + size_zxy
-        C, original_label_value = self._mapped_label_value_to_original(
-                                        label_value)
+
+        # tile with False values
+        out = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
 
         slices = self._open_label_file(image_nr)
         if slices is None:
-            # return tile with False values
-            return np.zeros(size_zxy) != 0
-        tile = [s[Y:YY, X:XX] for s in slices[T, C, Z:ZZ]]
-        tile = np.stack(tile)
-        tile = np.moveaxis(tile, (0, 1, 2), (0, 2, 1))
+            return out
 
-        tile = (tile == original_label_value)
-        return tile
+        originals = [self._mapped_label_value_to_original(label_value)
+                     for label_value in label_values]
+
+        # the region of each label channel is read only once
+        for C in sorted({c for c, _ in originals}):
+            tile = np.stack([s[Y:YY, X:XX] for s in slices[T, C, Z:ZZ]])
+            tile = np.moveaxis(tile, (0, 1, 2), (0, 2, 1))
+
+            for i, (c, original_label_value) in enumerate(originals):
+                if c == C:
+                    np.equal(tile, original_label_value, out=out[i])
+        return out
 
-    @lru_cache(maxsize=10)
     def _open_label_file(self, image_nr):
-        # memmap is slow, so we must cache it to be fast!
-        path = self.img_path / self.filenames[image_nr].img
+        # memmap is slow, so we must keep it open to be fast!
         label_filename = self.filenames[image_nr].lbl
 
         if label_filename is None:
@@ -419,10 +676,109 @@ class TiffConnector(Connector):
                 'no label matrix file found for image file %s', str(image_nr))
             return None
 
+        def open_file():
+            path = self.label_path / label_filename
+            logger.debug('Trying to load labelmat %s', path)
+            return Tiff.memmap_tcz(path)
+
+        return self.handle_pool.get(('label', image_nr), open_file)
+
+    def label_index_to_coordinate(self, image_nr, label_value, label_index):
+        '''
+        Get image coordinate for specific label.
+
+        Coordinates are taken from a label coordinate index, which is built
+        with one scan of the label file on first access (and persisted if
+        `label_index_path` is set).
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label.
+        label_index: int
+            Value between 0 and count[label_value].
+            Label count can be retrieved with self.label_count_for_image
+            method.
+
+        Returns
+        -------
+        ndarray
+            czxy coordinate of a specific label (specified by the
+            label index) with labelvalue label_value (mapped label value).
+        '''
+        C, original_label_value = self._mapped_label_value_to_original(
+            label_value)
+        index = self._label_coordinate_index(image_nr)
+        assert index is not None, \
+            'no label matrix file found for image {}'.format(image_nr)
+        return index.coordinate(C, original_label_value, label_index)
+
+    def label_positions(self, image_nr, label_value):
+        '''
+        Get zxy positions of all pixels with a certain label, taken from
+        the label coordinate index (see `label_index_to_coordinate`).
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label.
+
+        Returns
+        -------
+        numpy.ndarray
+            Positions with shape (nr_of_pixels, 3).
+        '''
+        index = self._label_coordinate_index(image_nr)
+        if index is None:
+            return np.zeros((0, 3), dtype=np.int64)
+
+        C, original_label_value = self._mapped_label_value_to_original(
+            label_value)
+        return index.positions_zxy(C, original_label_value)
+
+    def _label_coordinate_index(self, image_nr):
+        '''
+        Label coordinate index of an image (see
+        _load_label_coordinate_index()). Indices of the
+        max_coordinate_indices most recently used images are kept.
+        '''
+        indices = self._label_coordinate_indices
+        with self._coordinate_index_lock:
+            if image_nr in indices:
+                indices.move_to_end(image_nr)
+                return indices[image_nr]
+
+        index = self._load_label_coordinate_index(image_nr)
+        with self._coordinate_index_lock:
+            indices[image_nr] = index
+            while len(indices) > self.max_coordinate_indices:
+                indices.popitem(last=False)
+        return index
+
+    def _load_label_coordinate_index(self, image_nr):
+        label_filename = self.filenames[image_nr].lbl
+        if label_filename is None:
+            return None
+
         path = self.label_path / label_filename
-        logger.debug('Trying to load labelmat %s', path)
+        directory = self.coordinate_index_path
+        if directory is not None:
+            index = LabelCoordinateIndex.load(directory, path)
+            if index is not None:
+                return index
 
-        return Tiff.memmap_tcz(path)
+        slices = self._open_label_file(image_nr)
+        T = 0
+        index = LabelCoordinateIndex.from_planes(
+            [[s.T for s in slices[T, c]] for c in range(slices.shape[1])])
+
+        if directory is not None:
+            index.save(directory, path)
+        return index
 
     @staticmethod
     def calc_label_values_mapping(original_labels):
@@ -463,7 +819,52 @@ class TiffConnector(Connector):
         logger.debug(label_mappings)
         return label_mappings
 
-    @lru_cache(maxsize=1)
+    def _original_label_counts(self, image_nr):
+        '''
+        Get counts of original label values per label channel, loaded
+        once per connector (see _load_original_label_counts()).
+        '''
+        if image_nr not in self._label_count_cache:
+            self._label_count_cache[image_nr] = \
+                self._load_original_label_counts(image_nr)
+        return self._label_count_cache[image_nr]
+
+    def _load_original_label_counts(self, image_nr):
+        '''
+        Get counts of original label values per label channel.
+
+        Label statistics are taken from the label index if available and up
+        to date. Otherwise the label file is scanned (and the result is
+        added to the label index).
+
+        Returns
+        -------
+        list or None
+            List of dicts, one for each label channel, with original label
+            values as keys and label counts as values. None if there is no
+            label file for the image.
+        '''
+        label_filename = self.filenames[image_nr].lbl
+        if label_filename is None:
+            return None
+
+        path = self.label_path / label_filename
+        if self.label_index is not None:
+            stats = self.label_index.get(path)
+            if stats is not None:
+                return stats['counts']
+
+        slices = self._open_label_file(image_nr)
+        T = 0
+        C = slices.shape[1]
+        counts = [ut.count_label_values(slices[T, c, :]) for c in range(C)]
+
+        if self.label_index is not None:
+            self.label_index.put(path,
+                                 self.label_matrix_dimensions(image_nr),
+                                 counts)
+        return counts
+
     def original_label_values_for_all_images(self):
         '''
         Get all unique label values per image.
@@ -475,28 +876,34 @@ class TiffConnector(Connector):
             each set contains the label values of that channel.
             E.g. `[{91, 109, 150}, {90, 100}]` for two label channels
         '''
+        if self._original_label_values is not None:
+            return self._original_label_values
+
         labels_per_channel = []
 
-        for image_nr in range(self.image_count()):
-            slices = self._open_label_file(image_nr)
-            if slices is None:
+        all_counts = ut.parallel_map(self._original_label_counts,
+                                     range(self.image_count()),
+                                     workers=self.workers,
+                                     msg=self._progress_msg('Scan labels: '))
+
+        for counts in all_counts:
+            if counts is None:
                 continue
 
-            T = 0
-            C = slices.shape[1]
-            labels = [np.unique(np.concatenate([np.unique(s)
-                                                for s in slices[T, c, :]]))
-                      for c in range(C)]
-            labels = [set(labels) - {0} for labels in labels]
+            labels = [set(counts_per_channel.keys())
+                      for counts_per_channel in counts]
 
             labels_per_channel = [l1.union(l2)
                                   for l1, l2 in zip_longest(labels_per_channel,
                                                             labels,
                                                             fillvalue=set())]
 
+        if self.label_index is not None:
+            self.label_index.save()
+
+        self._original_label_values = labels_per_channel
         return labels_per_channel
 
-    @lru_cache(maxsize=1500)
     def label_count_for_image(self, image_nr):
         '''
         Get number of labels per labelvalue for an image.
@@ -510,20 +917,10 @@ class TiffConnector(Connector):
         -------
         dict
         '''
-        slices = self._open_label_file(image_nr)
-        if slices is None:
+        original_label_count = self._original_label_counts(image_nr)
+        if original_label_count is None:
             return None
 
-        T = 0
-        C = slices.shape[1]
-        labels = [np.unique(np.concatenate([np.unique(s)
-                                            for s in slices[T, c, :]]))
-                  for c in range(C)]
-
-        original_label_count = [{l: sum(np.count_nonzero(s == l)
-                                        for s in slices[T, c, :])
-                                 for l in labels[c] if l > 0}
-                                for c in range(C)]
         label_count = {self.labelvalue_mapping[c][l]: count
                        for c, orig in enumerate(original_label_count)
                        for l, count in orig.items()}
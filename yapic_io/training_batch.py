@@ -1,4 +1,6 @@
-import random
+import copy
+import queue
+import threading
 import numpy as np
 from yapic_io.minibatch import Minibatch
 from yapic_io.utils import compute_pos, find_overlapping_tiles, progressbar
@@ -30,6 +32,11 @@ class TrainingBatch(Minibatch):
     equalized: bool
         If ``True``, less frequent labels are favored in randomized
         tile selection.
+    rng: numpy.random.Generator, optional
+        Random number generator for tile selection and augmentation. If
+        None, a new generator is spawned from the dataset (see
+        ``Dataset.spawn_rngs()``). Give each parallel worker its own
+        generator.
 
     Examples
     --------
@@ -70,7 +77,8 @@ class TrainingBatch(Minibatch):
                  dataset,
                  size_zxy,
                  padding_zxy=(0, 0, 0),
-                 equalized=False):
+                 equalized=False,
+                 rng=None):
 
         batch_size = len(dataset.label_values())
 
@@ -80,15 +88,21 @@ class TrainingBatch(Minibatch):
                          padding_zxy=padding_zxy)
 
         self.equalized = equalized
+        self.rng = rng if rng is not None else dataset.spawn_rngs(1)[0]
         self.augmentation = set()
         self.augment_by_flipping(True)
         self.rotation_range = None
         self.shear_range = None
+        self.rotation_step = None
+        self.shear_step = None
         self._pixels = None
-        self._weights = None
+        self._label_masks = None
+        self._label_mask_shape = None
 
         self.tile_pos_for_label = {key: self.tile_positions(sliding=True)
                                    for key in self.labels}
+        # labels with tile positions checked in label integrals
+        self._checked_labels = set()
 
     def __repr__(self):
         info = ('TrainingBatch (batch_size: {}, '
@@ -113,11 +127,37 @@ class TrainingBatch(Minibatch):
             augmentations.append(tile_data.augmentation)
 
         self._pixels = np.array(pixels)
-        self._weights = np.array(weights, self.float_data_type)
+        # label masks are kept bit packed, weights are expanded on request
+        label_masks = np.array(weights, dtype=bool)
+        self._label_mask_shape = label_masks.shape
+        self._label_masks = np.packbits(label_masks, axis=-1)
         self.augmentations = augmentations
 
         return self
 
+    def copy(self, rng=None):
+        '''
+        Copy of the TrainingBatch with its own list of tile positions,
+        e.g. for parallel loader workers (see PrefetchingBatch).
+
+        Parameters
+        ----------
+        rng: numpy.random.Generator, optional
+            Random number generator of the copy. If None, a new generator
+            is spawned from the dataset.
+
+        Returns
+        -------
+        TrainingBatch
+        '''
+        out = copy.copy(self)
+        out.rng = rng if rng is not None else self.dataset.spawn_rngs(1)[0]
+        out.augmentation = set(self.augmentation)
+        out.tile_pos_for_label = {label: list(pos) for label, pos
+                                  in self.tile_pos_for_label.items()}
+        out._checked_labels = set(self._checked_labels)
+        return out
+
     def augment_by_flipping(self, flip_on):
         '''
         Data augmentation setting. Advantage: fast.
@@ -132,7 +172,8 @@ class TrainingBatch(Minibatch):
         else:
             self.augmentation.discard('flip')
 
-    def augment_by_rotation(self, rot_on, rotation_range=(-45, 45)):
+    def augment_by_rotation(self, rot_on, rotation_range=(-45, 45),
+                            angle_step=None):
         '''
         Data augmentation setting. Slower than flipping, but you get more
         training data.
@@ -143,14 +184,21 @@ class TrainingBatch(Minibatch):
             If ``True``, tiles are randomly rotated.
         rotation_range: (min, max)
             Rotation angle range in degrees.
+        angle_step: float, optional
+            If given, rotation angles are rounded to multiples of
+            angle_step, e.g. 1 degree. Together with a warp index cache
+            (set Dataset.warp_cache to a transformations.WarpIndexCache),
+            warps of recurring angles are a single gather.
         '''
         self.rotation_range = rotation_range
+        self.rotation_step = angle_step
         if rot_on:
             self.augmentation.add('rotate')
         else:
             self.augmentation.discard('rotate')
 
-    def augment_by_shear(self, shear_on, shear_range=(-5, 5)):
+    def augment_by_shear(self, shear_on, shear_range=(-5, 5),
+                         angle_step=None):
         '''
         Data augmentation setting. Slower than flipping, but you get more
         training data.
@@ -161,23 +209,71 @@ class TrainingBatch(Minibatch):
             If ``True``, tiles are randomly sheared.
         shear_range: (min, max)
             Shear angle range in degrees.
+        angle_step: float, optional
+            If given, shear angles are rounded to multiples of angle_step
+            (see augment_by_rotation).
         '''
         self.shear_range = shear_range
+        self.shear_step = angle_step
         if shear_on:
             self.augmentation.add('shear')
         else:
             self.augmentation.discard('shear')
 
     def pixels(self):
-        pix = self._normalize(self._pixels).astype(self.float_data_type)
+        pix = self._normalize(self._pixels).astype(self.float_data_type,
+                                                   copy=False)
 
         return np.moveaxis(pix, [0, 1, 2, 3, 4],
                            self.pixel_dimension_order)
 
     def weights(self):
-        return np.moveaxis(self._weights, [0, 1, 2, 3, 4],
+        '''
+        Dense weights of the batch with dimensions (batch, label, z, x, y),
+        reordered by pixel_dimension_order. Weights are expanded from
+        label_masks() and label_weights(). To save memory, use these
+        instead and broadcast the weights in the classifier.
+        '''
+        weights = self._unpacked_label_masks() * \
+            self.label_weights()[:, np.newaxis, np.newaxis, np.newaxis]
+        return np.moveaxis(weights, [0, 1, 2, 3, 4],
+                           self.pixel_dimension_order)
+
+    def label_masks(self, packed=False):
+        '''
+        Boolean label masks of the batch with dimensions
+        (batch, label, z, x, y), reordered by pixel_dimension_order.
+
+        Parameters
+        ----------
+        packed : bool
+            If True, masks are returned as stored, i.e. packed with
+            np.packbits along y in (batch, label, z, x, y) order. Unpack
+            with np.unpackbits(masks, axis=-1, count=nr_y).
+
+        Returns
+        -------
+        numpy.ndarray
+        '''
+        if packed:
+            return self._label_masks
+        return np.moveaxis(self._unpacked_label_masks(), [0, 1, 2, 3, 4],
                            self.pixel_dimension_order)
 
+    def label_weights(self):
+        '''
+        Weight of each label in the order of the label dimension of
+        weights() and label_masks().
+        '''
+        return np.array([self.dataset.label_weights[label]
+                         for label in sorted(self.labels)],
+                        dtype=self.float_data_type)
+
+    def _unpacked_label_masks(self):
+        masks = np.unpackbits(self._label_masks, axis=-1,
+                              count=self._label_mask_shape[-1])
+        return masks.view(bool)
+
     # @lru_cache(maxsize=10)
     def tile_positions(self, sliding=True):
         '''
@@ -226,54 +322,99 @@ class TrainingBatch(Minibatch):
             _, x, y = self.tile_size_zxy
             is_square_tile = (x == y)
 
-            augment_params = {'fliplr': np.random.choice([True, False]),
-                              'flipud': np.random.choice([True, False]),
-                              'rot90': np.random.choice(4)
+            augment_params = {'fliplr': bool(self.rng.integers(2)),
+                              'flipud': bool(self.rng.integers(2)),
+                              'rot90': int(self.rng.integers(4))
                               if is_square_tile else 0}
 
         if 'rotate' in self.augmentation:
-            augment_params['rotation_angle'] = random.uniform(
-                                                   *self.rotation_range)
+            augment_params['rotation_angle'] = _quantize(
+                self.rng.uniform(*self.rotation_range), self.rotation_step)
 
         if 'shear' in self.augmentation:
-            augment_params['shear_angle'] = random.uniform(*self.shear_range)
+            augment_params['shear_angle'] = _quantize(
+                self.rng.uniform(*self.shear_range), self.shear_step)
 
         return augment_params
 
     def remove_unlabeled_tiles(self):
         '''
-        Scans all pixels and labels for all tiles. Removes all tile positions
-        that do not contain labels.
-        '''
+        Removes all tile positions that do not contain labels.
 
+        Label counts of all positions are looked up in the label integrals
+        of the dataset (see ``Dataset.label_integral()``). Only positions
+        that cannot be decided by the lookup (downsampled label integrals
+        of large images) are checked by reading the tiles.
+        '''
         labels = np.array(sorted(self.labels))
-        channels = np.array(sorted(self.channels))
 
         for label in labels:
             logger.info('scanning tiles for label {}...'.format(label))
             positions = self.tile_pos_for_label[label]
             n_pos = len(positions)
 
-            for i, pos in enumerate(positions):
-                image_nr = pos[0]
-                pos_zxy = pos[1:]
+            if self.dataset.use_label_integrals:
+                counts = self._label_counts_for_positions(positions, label)
+            else:
+                counts = np.ones(n_pos)
 
-                tile_data = self.dataset.training_tile(
-                                        image_nr,
-                                        pos_zxy,
-                                        self.tile_size_zxy,
-                                        channels,
-                                        labels,
-                                        pixel_padding=self.padding_zxy,
-                                        augment_params=None)
-
-                if not _are_weights_in_tile(tile_data, label):
-                    # remove tile position for the label, since no labels here
-                    self.tile_pos_for_label[label].pop(i)
+            self.tile_pos_for_label[label] = [
+                pos for pos, count in zip(positions, counts)
+                if count > 0 and (self._is_exact_count(pos[0], label) or
+                                  self._tile_has_label(pos, label))]
             n_pos_after = len(self.tile_pos_for_label[label])
 
             logger.info('removed {} tiles of {} for label {} ({}%)'.format(
-                n_pos_after, n_pos, label, round(n_pos_after/n_pos*100., 2)))
+                n_pos - n_pos_after, n_pos, label,
+                round((n_pos - n_pos_after)/n_pos*100., 2)))
+
+    def _label_counts_for_positions(self, positions, label):
+        '''
+        Label counts of tiles at positions (image_nr, z, x, y), looked up
+        in the label integrals of the dataset.
+        '''
+        positions = np.array(positions, dtype=np.int64).reshape(-1, 4)
+        counts = np.zeros(len(positions), dtype=np.int64)
+        for image_nr in np.unique(positions[:, 0]):
+            is_image = positions[:, 0] == image_nr
+            integral = self.dataset.label_integral(image_nr, label)
+            if integral is not None:
+                counts[is_image] = integral.counts(positions[is_image, 1:],
+                                                   self.tile_size_zxy)
+        return counts
+
+    def _remove_positions_without_labels(self, label):
+        '''
+        Removes tile positions of a label with a label count of 0 in the
+        label integrals of the dataset.
+        '''
+        positions = self.tile_pos_for_label[label]
+        counts = self._label_counts_for_positions(positions, label)
+        self.tile_pos_for_label[label] = [
+            pos for pos, count in zip(positions, counts) if count > 0]
+
+    def _is_exact_count(self, image_nr, label):
+        if not self.dataset.use_label_integrals:
+            return False
+        integral = self.dataset.label_integral(image_nr, label)
+        return integral is None or integral.exact
+
+    def _tile_has_label(self, pos, label):
+        '''
+        Check for label data by reading the tile at position
+        (image_nr, z, x, y).
+        '''
+        labels = np.array(sorted(self.labels))
+        channels = np.array(sorted(self.channels))
+        tile_data = self.dataset.training_tile(
+                                pos[0],
+                                pos[1:],
+                                self.tile_size_zxy,
+                                channels,
+                                labels,
+                                pixel_padding=self.padding_zxy,
+                                augment_params=None)
+        return _are_weights_in_tile(tile_data, label)
 
     def split(self, fraction):
         '''
@@ -318,7 +459,7 @@ class TrainingBatch(Minibatch):
             pos_out = []
             while curr_fraction < fraction:
                 # select tile positions randomly
-                choice = np.random.choice(range(len(pos)))
+                choice = self.rng.integers(len(pos))
                 a = pos.pop(choice)
                 pos_out.append(a)
 
@@ -357,6 +498,8 @@ class TrainingBatch(Minibatch):
         out.augmentation = self.augmentation
         out.rotation_range = self.rotation_range
         out.shear_range = self.shear_range
+        out.rotation_step = self.rotation_step
+        out.shear_step = self.shear_step
 
         out.tile_pos_for_label = tile_pos_for_label_out
 
@@ -367,6 +510,12 @@ class TrainingBatch(Minibatch):
         Pick random tile in image regions where label data is present.
         '''
 
+        if self.dataset.use_label_integrals and \
+           for_label not in self._checked_labels:
+            # drop positions without labels before reading any tile
+            self._remove_positions_without_labels(for_label)
+            self._checked_labels.add(for_label)
+
         # random pollng loop
         counter = 0
         while counter <= len(self.tile_pos_for_label[for_label]):
@@ -376,7 +525,7 @@ class TrainingBatch(Minibatch):
             msg = 'no label data for label {} in dataset'.format(for_label)
             assert len(pos) > 0, msg
 
-            choice = np.random.randint(0, len(pos))
+            choice = self.rng.integers(len(pos))
             pos_selected = pos[choice]
 
             image_nr = pos_selected[0]
@@ -391,9 +540,11 @@ class TrainingBatch(Minibatch):
                                     channels,
                                     labels,
                                     pixel_padding=self.padding_zxy,
-                                    augment_params=self._augment_params())
+                                    augment_params=self._augment_params(),
+                                    label_masks=True)
 
-            if _are_weights_in_tile(tile_data, for_label):
+            if _are_weights_in_tile(tile_data, for_label) and \
+               self.dataset.label_weights[for_label] != 0:
                 msg = ('Needed {} trials to fetch random tile containing ' +
                        'labelvalue {}').format(counter,
                                                for_label)
@@ -412,6 +563,156 @@ class TrainingBatch(Minibatch):
         return tile_data
 
 
+class PrefetchingBatch(object):
+    '''
+    Infinite iterator providing training batches that are built in
+    background threads.
+
+    Wraps a TrainingBatch. Worker threads build batches ahead of time and
+    keep them in bounded queues, so the classifier does not wait for
+    reading, padding and augmentation of the next batch.
+
+    Parameters
+    ----------
+    training_batch: TrainingBatch
+        Source of batches. Each worker uses its own copy (see
+        TrainingBatch.copy). The first worker continues the random number
+        stream of training_batch, further workers use generators spawned
+        from the dataset. training_batch itself is not used by the workers
+        and is not advanced.
+    workers: int, optional
+        Nr of worker threads.
+    depth: int, optional
+        Max nr of ready batches per worker.
+
+    Notes
+    -----
+    Batches are returned in a fixed round robin order of workers. With one
+    worker, batches are identical to iterating training_batch directly.
+    With several workers, batches are reproducible for the same random
+    seed of the dataset and the same nr of workers.
+
+    Errors of a worker are raised by the next call of ``next()``. All
+    workers are stopped then.
+
+    Workers are threads sharing the dataset. File reads and most numpy
+    operations release the GIL.
+
+    Examples
+    --------
+    >>> from yapic_io import TiffConnector, Dataset, TrainingBatch
+    >>> from yapic_io.training_batch import PrefetchingBatch
+    >>>
+    >>> pixel_img_dir = 'yapic_io/test_data/tiffconnector_1/im/*.tif'
+    >>> label_img_dir = 'yapic_io/test_data/tiffconnector_1/labels/*.tif'
+    >>> c = TiffConnector(pixel_img_dir, label_img_dir)
+    >>> m = TrainingBatch(Dataset(c), (1, 5, 4), padding_zxy=(0, 2, 2))
+    >>>
+    >>> with PrefetchingBatch(m, workers=2, depth=3) as batches:
+    ...     for counter, mini in enumerate(batches):
+    ...         pixels = mini.pixels()
+    ...         weights = mini.weights()
+    ...         # training on pixels and weights goes here
+    ...         if counter > 10:  # batches is infinite
+    ...             break
+    '''
+
+    def __init__(self, training_batch, workers=1, depth=2):
+        assert workers > 0, 'at least one worker needed'
+        assert depth > 0, 'depth must be at least 1'
+
+        self.workers = workers
+        self.depth = depth
+
+        # no worker shares its TrainingBatch with the caller
+        rngs = [copy.deepcopy(training_batch.rng)] + \
+            training_batch.dataset.spawn_rngs(workers - 1)
+        self._batches = [training_batch.copy(rng=rng) for rng in rngs]
+        self._queues = [queue.Queue(maxsize=depth) for _ in range(workers)]
+        self._next_worker = 0
+        self._stop = threading.Event()
+
+        self._threads = [threading.Thread(target=self._work,
+                                          args=(batch, q),
+                                          daemon=True)
+                         for batch, q in zip(self._batches, self._queues)]
+        for thread in self._threads:
+            thread.start()
+
+    def __repr__(self):
+        return 'PrefetchingBatch (workers: {}, depth: {})'.format(
+            self.workers, self.depth)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        assert not self._stop.is_set(), 'PrefetchingBatch is closed'
+
+        item = self._queues[self._next_worker].get()
+        self._next_worker = (self._next_worker + 1) % self.workers
+
+        if isinstance(item, _WorkerError):
+            self.close()
+            raise item.error
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        '''
+        Stops all workers. Batches not yet fetched are dropped.
+        '''
+        self._stop.set()
+        for q in self._queues:
+            _drain(q)
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def _work(self, batch, q):
+        try:
+            while not self._stop.is_set():
+                # TrainingBatch assigns new arrays for each batch, i.e. a
+                # shallow copy keeps the data of this batch
+                self._put(q, copy.copy(next(batch)))
+        except Exception as e:
+            logger.debug('worker error: {}'.format(e))
+            self._put(q, _WorkerError(e))
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+class _WorkerError(object):
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
+
+
+def _quantize(angle, step):
+    if step is None:
+        return angle
+    return float(np.round(angle / step) * step)
+
+
 def _are_weights_in_tile(tile_data, for_label):
     '''
     check if weights for specified label are present
@@ -2,6 +2,9 @@
 matrix transformation functions
 '''
 
+from collections import OrderedDict
+from functools import lru_cache
+import threading
 import numpy as np
 from skimage import transform as tf
 import logging
@@ -30,14 +33,253 @@ def get_transform(image, rotation_angle, shear_angle):
         msg = 'Image has {} dimensions, must have 2.'.format(image.ndim)
         raise ValueError(msg)
 
-    shift_y, shift_x = np.array(image.shape[:2]) / 2.
+    return _centered_transform(image.shape[:2], rotation_angle, shear_angle)
+
+
+def _centered_transform(shape_xy, rotation_angle, shear_angle):
+    shift_y, shift_x = np.array(shape_xy) / 2.
     tf_rotate_shear = tf.AffineTransform(rotation=np.deg2rad(rotation_angle),
                                          shear=np.deg2rad(shear_angle))
     tf_shift = tf.AffineTransform(translation=[-shift_x, -shift_y])
     tf_shift_inv = tf.AffineTransform(translation=[shift_x, shift_y])
-    tf_center_rot = (tf_shift + (tf_rotate_shear + tf_shift_inv)).inverse
+    return (tf_shift + (tf_rotate_shear + tf_shift_inv)).inverse
+
+
+@lru_cache(maxsize=16)
+def _warp_indices(frame_shape_xy, offset_xy, shape_xy, rotation_angle,
+                  shear_angle):
+    '''
+    Nearest source pixel in a frame for each pixel of a window of the
+    warped frame. Rotation and shear axis is in the frame center.
 
-    return tf_center_rot
+    The index map is computed once and shared by all slices, channels and
+    labels warped with the same parameters. Arguments must be hashable.
+    '''
+    t = _centered_transform(frame_shape_xy, rotation_angle, shear_angle)
+
+    x, y = np.indices(shape_xy).reshape(2, -1)
+    # skimage transforms work on (col, row), i.e. (y, x) coordinates
+    source = t(np.column_stack([y, x]) + offset_xy[::-1])[:, ::-1]
+    source = np.floor(source + 0.5).astype(int)
+    source = source.T.reshape((2,) + tuple(shape_xy))
+    source.setflags(write=False)
+    return source
+
+
+def _source_indices(shape_xy, rotation_angle, shear_angle):
+    '''
+    Nearest source pixel for each pixel of a warped tile, relative to the
+    upper left corner of the tile.
+
+    Coordinates are computed in the frame of the tile surrounded by a
+    margin of one tile size, i.e. they are identical to warping the
+    3 times larger tile with warp_image_2d() and cutting out the center.
+    '''
+    shape_xy = tuple(int(s) for s in shape_xy)
+    frame_shape_xy = tuple(3 * s for s in shape_xy)
+    # pixels are snapped in the large frame before shifting to the tile
+    # frame, so that ties are rounded as in the large tile
+    source = _warp_indices(frame_shape_xy, shape_xy, shape_xy,
+                           float(rotation_angle), float(shear_angle))
+    return source - np.array(shape_xy)[:, np.newaxis, np.newaxis]
+
+
+def warp_margin(shape_xy, rotation_angle, shear_angle):
+    '''
+    Nr of pixels needed around a tile to warp it with
+    warp_tile_2d_stack().
+
+    Parameters
+    ----------
+    shape_xy : (x, y)
+        Shape of the tile.
+    rotation_angle : float
+        Angle in degrees.
+    shear_angle: float
+        Angle in degrees.
+
+    Returns
+    -------
+    numpy.ndarray
+        Margin in x and y.
+
+    Examples
+    --------
+    >>> from yapic_io.transformations import warp_margin
+    >>> warp_margin((100, 100), 0, 0)
+    array([0, 0])
+    >>> warp_margin((100, 100), 5, 0)
+    array([4, 4])
+    >>> warp_margin((100, 100), 45, 0)
+    array([21, 21])
+    '''
+    source = _source_indices(shape_xy, rotation_angle, shear_angle)
+    low = source.reshape(2, -1).min(axis=1)
+    high = source.reshape(2, -1).max(axis=1) + 1
+    return np.maximum.reduce([np.zeros(2, dtype=int),
+                              -low,
+                              high - np.array(shape_xy)])
+
+
+def warp_tile_2d_stack(image, rotation_angle, shear_angle, margin_xy,
+                       shape_xy=None):
+    '''
+    Warps the center tile of a 3d or 4d matrix with affine transform.
+
+    Only the tile without margin is computed, with nearest neighbor
+    interpolation as in warp_image_2d(). The result is identical to warping
+    the 3 times larger tile with warp_image_2d_stack() and cutting out the
+    center. Transformation is applied to all 2D slices at once, rotation
+    and shear axis is in the tile center.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        3-dimensional or 4-dimensional matrix: a tile in x and y (last
+        dimensions) with margin_xy pixels on the upper left side.
+    rotation_angle : float
+        Angle in degrees.
+    shear_angle : float
+        Angle in degrees.
+    margin_xy : (x, y)
+        Position of the tile within image, see warp_margin().
+    shape_xy : (x, y), optional
+        Shape of the tile. By default, the tile is surrounded by margin_xy
+        pixels on each side.
+
+    Returns
+    -------
+    numpy.ndarray
+        Transformed tile with shape_xy in x and y.
+    '''
+    if image.ndim not in (3, 4):
+        msg = 'Image has {} dimensions, must have 3 or 4.'.format(image.ndim)
+        raise ValueError(msg)
+
+    margin_xy = np.array(margin_xy)
+    if shape_xy is None:
+        shape_xy = np.array(image.shape[-2:]) - 2 * margin_xy
+
+    x, y = _source_indices(shape_xy, rotation_angle, shear_angle)
+    # source pixels outside of image are mirrored, as in warp_image_2d()
+    x = _mirror(x + margin_xy[0], image.shape[-2])
+    y = _mirror(y + margin_xy[1], image.shape[-1])
+    return image[..., x, y]
+
+
+def _mirror(index, size):
+    index = np.mod(index, 2 * size)
+    return np.where(index < size, index, 2 * size - 1 - index)
+
+
+class WarpIndexCache(object):
+    '''
+    Memory capped LRU cache of flat gather indices for warping tiles
+    (see warp_tile_2d_stack).
+
+    Since warps use nearest neighbor interpolation, each warp is a pure
+    index gather. For quantized angles (see
+    TrainingBatch.augment_by_rotation) the same indices are needed again
+    and again. Cached indices are applied with a single np.take.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Max memory of all cached index arrays. Least recently used indices
+        are dropped first.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.transformations import WarpIndexCache
+    >>> cache = WarpIndexCache(max_bytes=2**20)
+    >>> image = np.arange(2 * 12 * 12).reshape((2, 12, 12))
+    >>> tile = cache.warp_tile_2d_stack(image, 10, 0, (2, 2))
+    >>> tile = cache.warp_tile_2d_stack(image, 10, 0, (2, 2))
+    >>> tile.shape
+    (2, 8, 8)
+    >>> cache.hits, cache.misses
+    (1, 1)
+    '''
+
+    def __init__(self, max_bytes=2**28):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._indices = OrderedDict()
+        # cache may be shared by parallel loader threads
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __repr__(self):
+        return 'WarpIndexCache ({} entries, {} of {} bytes)'.format(
+            len(self), self.nbytes, self.max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._indices.clear()
+            self.nbytes = 0
+
+    def flat_indices(self, image_shape_xy, rotation_angle, shear_angle,
+                     margin_xy, shape_xy):
+        '''
+        Flat indices of the source pixels in an xy image for each pixel of
+        the warped tile (see warp_tile_2d_stack).
+
+        Returns
+        -------
+        numpy.ndarray
+            Read only index array with shape_xy.
+        '''
+        key = (tuple(int(s) for s in image_shape_xy),
+               float(rotation_angle),
+               float(shear_angle),
+               tuple(int(m) for m in margin_xy),
+               tuple(int(s) for s in shape_xy))
+        with self._lock:
+            if key in self._indices:
+                self.hits += 1
+                self._indices.move_to_end(key)
+                return self._indices[key]
+            self.misses += 1
+
+        X, Y = key[0]
+        x, y = _source_indices(shape_xy, rotation_angle, shear_angle)
+        x = _mirror(x + key[3][0], X)
+        y = _mirror(y + key[3][1], Y)
+        indices = (x * Y + y).astype(np.intp)
+        indices.setflags(write=False)
+
+        with self._lock:
+            if indices.nbytes > self.max_bytes or key in self._indices:
+                return indices
+            while self.nbytes + indices.nbytes > self.max_bytes:
+                _, dropped = self._indices.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+            self._indices[key] = indices
+            self.nbytes += indices.nbytes
+        return indices
+
+    def warp_tile_2d_stack(self, image, rotation_angle, shear_angle,
+                           margin_xy, shape_xy=None):
+        '''
+        Same as warp_tile_2d_stack, using cached indices.
+        '''
+        if image.ndim not in (3, 4):
+            msg = 'Image has {} dimensions, must have 3 or 4.'.format(
+                image.ndim)
+            raise ValueError(msg)
+
+        if shape_xy is None:
+            shape_xy = np.array(image.shape[-2:]) - 2 * np.array(margin_xy)
+
+        indices = self.flat_indices(image.shape[-2:], rotation_angle,
+                                    shear_angle, margin_xy, shape_xy)
+        flat = image.reshape(image.shape[:-2] + (-1,))
+        return np.take(flat, indices, axis=-1)
 
 
 def warp_image_2d(image, rotation_angle, shear_angle):
@@ -65,15 +307,14 @@ def warp_image_2d(image, rotation_angle, shear_angle):
         msg = 'Image has {} dimensions, must have 2.'.format(image.ndim)
         raise ValueError(msg)
 
-    t = get_transform(image, rotation_angle, shear_angle)
-    return tf.warp(image, t, order=0, mode='symmetric', preserve_range=True)
+    return _warp_2d_stack(image, rotation_angle, shear_angle)
 
 def warp_image_2d_stack(image, rotation_angle, shear_angle):
     '''
     Warps a 3d or 4d matrix with affine transform.
 
-    Transformation is applied in 2D slice by sclice.
-    Rotation and shear axis is in image center.
+    Transformation is applied to all 2D slices at once with nearest
+    neighbor interpolation. Rotation and shear axis is in image center.
     Empty edges are filled by mirroring.
 
     Paramters
@@ -90,19 +331,20 @@ def warp_image_2d_stack(image, rotation_angle, shear_angle):
     nump.ndarray
         transformed 3d matrix
     '''
+    if image.ndim not in (3, 4):
+        msg = 'Image has {} dimensions, must have 3 or 4.'.format(image.ndim)
+        raise ValueError(msg)
+
+    return _warp_2d_stack(image, rotation_angle, shear_angle)
 
-    if image.ndim == 3:
-        return np.array([warp_image_2d(z_slice, rotation_angle, shear_angle)
-                         for z_slice in image])
 
-    elif image.ndim == 4:
-        out = []
-        for image_zxy in image:
-            out.append([warp_image_2d(z_slice, rotation_angle, shear_angle)
-                        for z_slice in image_zxy])
-        return np.array(out)
-    msg = 'Image has {} dimensions, must have 3 or 4.'.format(image.ndim)
-    raise ValueError(msg)
+def _warp_2d_stack(image, rotation_angle, shear_angle):
+    shape_xy = tuple(image.shape[-2:])
+    x, y = _warp_indices(shape_xy, (0, 0), shape_xy,
+                         float(rotation_angle), float(shear_angle))
+    # one gather for all slices, source pixels outside of image are
+    # mirrored
+    return image[..., _mirror(x, shape_xy[0]), _mirror(y, shape_xy[1])]
 
 
 def flip_image_2d_stack(image, fliplr=False, flipud=False, rot90=0):
@@ -2,14 +2,21 @@ import numpy as np
 import logging
 import os
 import itertools
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher
 from munkres import Munkres
 import sys
 logger = logging.getLogger(os.path.basename(__file__))
 
+# label values above are counted with np.unique instead of np.bincount
+# to keep the bincount array small
+BINCOUNT_MAX_LABEL_VALUE = 2 ** 20
 
-def progressbar(it, prefix="", size=60, file=sys.stdout):
-    count = len(it)
+
+def progressbar(it, prefix="", size=60, file=sys.stdout, count=None):
+    if count is None:
+        count = len(it)
 
     def show(j):
         x = int(size*j/count)
@@ -25,6 +32,48 @@ def progressbar(it, prefix="", size=60, file=sys.stdout):
     file.flush()
 
 
+def parallel_map(func, items, workers=1, msg=None):
+    '''
+    Applies func to all items, optionally in a pool of threads.
+
+    Parameters
+    ----------
+    func : callable
+        Function with one argument.
+    items : iterable
+        Arguments for func.
+    workers : int, optional
+        Nr of threads. At most `workers` items are processed at the same
+        time, which also limits the nr of simultaneously opened files if
+        func opens files. If 1, items are processed sequentially.
+    msg : str, optional
+        If given, progress is shown with a progressbar prefixed by msg.
+
+    Returns
+    -------
+    list
+        Results of func, in the same order as items (independent of
+        the order in which the items are processed).
+    '''
+    items = list(items)
+
+    if workers is None or workers <= 1:
+        executor = None
+        results = map(func, items)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        results = executor.map(func, items)
+
+    if msg is not None and len(items) > 0:
+        results = progressbar(results, msg, 40, count=len(items))
+
+    try:
+        return list(results)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
 def get_tile_meshgrid(image_shape, pos, size):
     '''
     Returns coordinates for selection of a sub matrix, given a certain
@@ -142,6 +191,100 @@ def compute_pos(img_shape, tile_shape, sliding=None):
     return pos_array
 
 
+def count_label_values(slices):
+    '''
+    Count all label values of a label matrix in a single pass.
+
+    The label matrix is given as a sequence of slices (e.g. the z-slices of
+    one label channel), each slice is read only once. Integer labels are
+    counted with ``np.bincount``. Negative, very large or non-integer label
+    values are counted with ``np.unique`` as fallback.
+
+    Parameters
+    ----------
+    slices : iterable of array_like
+        Slices of the label matrix.
+
+    Returns
+    -------
+    dict
+        Label values as keys and label counts as values. Only positive
+        label values are counted, unlabeled pixels (label value 0) and
+        negative values are ignored.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> import yapic_io.utils as ut
+    >>> lbl = np.array([[[0, 3, 3], [1, 0, 3]], [[0, 0, 1], [0, 0, 0]]])
+    >>> ut.count_label_values(lbl)
+    {1: 2, 3: 3}
+    '''
+    bincounts = np.zeros(0, dtype=np.int64)
+    other_counts = collections.Counter()
+
+    for s in slices:
+        s = np.ravel(s)
+        if s.size == 0:
+            continue
+
+        if s.dtype.kind == 'b' or \
+                (s.dtype.kind == 'u' and s.dtype.itemsize <= 2):
+            use_bincount = True
+        elif s.dtype.kind in 'ui':
+            use_bincount = (s.min() >= 0 and
+                            s.max() < BINCOUNT_MAX_LABEL_VALUE)
+        else:
+            use_bincount = False
+
+        if use_bincount:
+            # bincount does not accept uint64 input
+            counts = np.bincount(s.astype(np.intp, copy=False))
+            if len(counts) > len(bincounts):
+                bincounts = np.pad(bincounts,
+                                   (0, len(counts) - len(bincounts)),
+                                   mode='constant')
+            bincounts[:len(counts)] += counts
+        else:
+            values, counts = np.unique(s, return_counts=True)
+            other_counts.update(dict(zip(values.tolist(), counts.tolist())))
+
+    label_values = np.flatnonzero(bincounts)
+    other_counts.update(dict(zip(label_values.tolist(),
+                                 bincounts[label_values].tolist())))
+
+    # only positive label values are labels
+    return {value: count for value, count in sorted(other_counts.items())
+            if value > 0 and count > 0}
+
+
+def random_split_mask(n, fraction, random_seed=42):
+    '''
+    Random boolean mask for splitting n items into two subsets, the
+    first of size `(1-fraction)*n`, the other of size `fraction*n`.
+
+    Parameters
+    ----------
+    n : int
+        Nr of items.
+    fraction : float
+        Fraction of items in the second subset (False in mask).
+    random_seed : int, numpy.random.SeedSequence or numpy.random.Generator
+        Integer seeds give the same splits as earlier versions, which used
+        the global numpy random state. The global state is not touched.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask of length n, True for items of the first subset.
+    '''
+    if isinstance(random_seed, (np.random.Generator, np.random.SeedSequence)):
+        rng = np.random.default_rng(random_seed)
+    else:
+        rng = np.random.RandomState(random_seed)
+    return rng.choice([True, False], size=n, p=[1 - fraction, fraction])
+
+
 def find_overlapping_tiles(a, pos, shape):
 
     a = np.asarray(a)
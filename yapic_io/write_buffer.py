@@ -0,0 +1,168 @@
+import collections
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+DEFAULT_MAX_BYTES = 2 ** 28  # 256 MiB
+
+
+class WriteBuffer(object):
+    '''
+    Write-back buffer for 2D tiles written to the planes of output files
+    (e.g. memmapped probability maps).
+
+    Tiles are collected in memory until the buffer budget is exceeded or
+    `flush()` is called. On flush, the tiles of each plane are assembled
+    into their bounding region, which is written with one assignment in
+    row order. Thus, many small strided writes to the output file are
+    replaced by few large contiguous ones.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Buffer budget in bytes. If the buffered tiles exceed the budget,
+        `is_full()` returns True. A budget of 0 disables buffering
+        (each tile is flushed immediately by the owner of the buffer).
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.write_buffer import WriteBuffer
+    >>> out = np.zeros((1, 2, 2, 4), dtype=np.float32)  # two 2x4 planes
+    >>> buf = WriteBuffer()
+    >>> buf.put('out', (0, 1), (0, 0), np.ones((2, 2)))
+    >>> buf.put('out', (0, 1), (0, 2), 2 * np.ones((2, 2)))
+    >>> len(buf)
+    2
+    >>> buf.flush(lambda target: out)
+    >>> out[0, 1]
+    array([[1., 1., 2., 2.],
+           [1., 1., 2., 2.]], dtype=float32)
+    '''
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes if max_bytes is not None \
+            else DEFAULT_MAX_BYTES
+        self.nbytes = 0
+        self._tiles = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __repr__(self):
+        return 'WriteBuffer ({} tiles, {} of {} bytes)'.format(
+            len(self), self.nbytes, self.max_bytes)
+
+    def __len__(self):
+        return sum(len(tiles)
+                   for planes in self._tiles.values()
+                   for tiles in planes.values())
+
+    def is_full(self):
+        return self.nbytes > self.max_bytes
+
+    def put(self, target, plane, pos, tile):
+        '''
+        Add a 2D tile to the buffer.
+
+        Parameters
+        ----------
+        target : hashable
+            Identifier of the output file.
+        plane : tuple
+            Index of the 2D plane in the output file.
+        pos : (row, col)
+            Upper left position of the tile in the plane.
+        tile : numpy.ndarray
+            2D tile. The array is not copied and must not be changed
+            until it is flushed.
+        '''
+        with self._lock:
+            planes = self._tiles.setdefault(target, {})
+            planes.setdefault(plane, []).append((pos, tile))
+            self.nbytes += tile.nbytes
+
+    def pending(self, target):
+        '''
+        True if tiles for `target` are buffered.
+        '''
+        return target in self._tiles
+
+    def _pop(self, target=None):
+        with self._lock:
+            if target is None:
+                tiles = self._tiles
+                self._tiles = collections.OrderedDict()
+            elif target in self._tiles:
+                tiles = {target: self._tiles.pop(target)}
+            else:
+                tiles = {}
+
+            self.nbytes -= sum(tile.nbytes
+                               for planes in tiles.values()
+                               for plane_tiles in planes.values()
+                               for _, tile in plane_tiles)
+        return tiles
+
+    def flush(self, open_target, target=None):
+        '''
+        Write buffered tiles to the output files.
+
+        Parameters
+        ----------
+        open_target : callable
+            Called with a target identifier, returns the output file.
+            Planes of the output file are accessed with ``out[plane]``.
+        target : hashable, optional
+            Only flush tiles of this target. By default all tiles are
+            flushed.
+        '''
+        # flushes are serialized, since plane regions are read and
+        # written back as a whole
+        with self._flush_lock:
+            for tgt, planes in self._pop(target).items():
+                out = open_target(tgt)
+                for plane, tiles in planes.items():
+                    write_tiles(out[plane], tiles)
+                logger.debug('Flushed %s planes of %s', len(planes), tgt)
+
+
+def write_tiles(plane, tiles):
+    '''
+    Write 2D tiles to a 2D array with one assignment of their bounding
+    region. Tiles are written in the given order, i.e. later tiles
+    overwrite earlier ones where they overlap. If the tiles are too sparse
+    (the bounding region is more than twice as large as the tiles), each
+    tile is written separately.
+
+    Parameters
+    ----------
+    plane : numpy.ndarray
+        2D output array (e.g. a memmap).
+    tiles : list of ((row, col), numpy.ndarray)
+        Upper left positions and 2D tiles.
+    '''
+    starts = np.array([pos for pos, _ in tiles])
+    stops = starts + np.array([tile.shape for _, tile in tiles])
+    R, C = starts.min(axis=0)
+    RR, CC = stops.max(axis=0)
+
+    if (RR - R) * (CC - C) > 2 * sum(tile.size for _, tile in tiles):
+        for ((r, c), tile), (rr, cc) in zip(tiles, stops):
+            plane[r:rr, c:cc] = tile
+        return
+
+    region = np.empty((RR - R, CC - C), dtype=plane.dtype)
+    covered = np.zeros(region.shape, dtype=bool)
+    for ((r, c), tile), (rr, cc) in zip(tiles, stops):
+        region[r - R:rr - R, c - C:cc - C] = tile
+        covered[r - R:rr - R, c - C:cc - C] = True
+
+    if not covered.all():
+        # keep data between sparse tiles
+        region[~covered] = plane[R:RR, C:CC][~covered]
+
+    plane[R:RR, C:CC] = region